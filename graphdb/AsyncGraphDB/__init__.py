@@ -0,0 +1,159 @@
+''' asyncio wrapper that keeps graph databases off the event loop '''
+
+from concurrent.futures import ThreadPoolExecutor
+from itertools import islice
+import asyncio
+
+from ..RamGraphDB import RamGraphDBNode
+
+__all__ = ['AsyncGraphDB']
+
+class AsyncGraphDB(object):
+    ''' runs the operations of a RamGraphDB or SQLiteGraphDB in executor
+        threads and hands them back as awaitables.
+
+        writes go to one writer thread. every write awaited while a batch
+        is running is queued and the queue runs as the next batch in one
+        transaction, with a savepoint per write so a failing write only
+        fails its own await. reads run on a pool of readers threads that
+        use the reader connections of sqlite files, or on the writer
+        thread for databases that can only be used from one thread at a
+        time. reads see every write that has been awaited before them. '''
+
+    def __init__(self, db, readers=4):
+        assert isinstance(readers, int) and readers > 0, readers  # readers needs to be a positive int
+        self.db = db
+        self._writer = ThreadPoolExecutor(1)
+        # only sqlite files have reader connections to spread reads over
+        self._readers = ThreadPoolExecutor(readers) if getattr(db, '_readers', None) is not None else self._writer
+        self._pending = [] # (method, args, future) waiting for the next batch
+        self._flushing = None
+
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, *args):
+        await self.close()
+
+    async def close(self):
+        ''' waits for queued writes, stops the executors and closes the database '''
+        if self._flushing is not None:
+            await self._flushing
+        self._writer.shutdown()
+        self._readers.shutdown()
+        if hasattr(self.db, 'close'):
+            self.db.close()
+
+    def _run(self, executor, fn, *args):
+        return asyncio.get_event_loop().run_in_executor(executor, fn, *args)
+
+    async def _write(self, method, *args):
+        future = asyncio.get_event_loop().create_future()
+        self._pending.append((method, args, future))
+        if self._flushing is None:
+            self._flushing = asyncio.ensure_future(self._flush())
+        return await future
+
+    async def _flush(self):
+        ''' runs batches until no writes are waiting '''
+        try:
+            while self._pending:
+                batch, self._pending = self._pending, []
+                try:
+                    results = await self._run(self._writer, self._apply, batch)
+                except Exception as e:
+                    # the batch could not commit so none of it happened
+                    results = [(False, e)] * len(batch)
+                for (method, args, future), (ok, value) in zip(batch, results):
+                    if not future.done():
+                        if ok:
+                            future.set_result(value)
+                        else:
+                            future.set_exception(value)
+        finally:
+            self._flushing = None
+
+    def _apply(self, batch):
+        ''' runs a batch of writes in one transaction and returns the (ok, result or exception) of each '''
+        out = []
+        with self.db.transaction():
+            for method, args, future in batch:
+                try:
+                    with self.db.transaction():
+                        out.append((True, method(*args)))
+                except Exception as e:
+                    out.append((False, e))
+        return out
+
+    async def store_item(self, item):
+        await self._write(self.db.store_item, item)
+
+    async def store_items(self, items):
+        return await self._write(self.db.store_items, list(items))
+
+    async def store_relation(self, src, name, dst):
+        await self._write(self.db.store_relation, src, name, dst)
+
+    async def store_relations(self, relations):
+        return await self._write(self.db.store_relations, list(relations))
+
+    async def delete_item(self, item):
+        await self._write(self.db.delete_item, item)
+
+    async def delete_relation(self, src, relation, *targets):
+        await self._write(self.db.delete_relation, src, relation, *targets)
+
+    async def replace_item(self, old_item, new_item):
+        await self._write(self.db.replace_item, old_item, new_item)
+
+    @staticmethod
+    def _objects(found):
+        ''' RamGraphDB hands back nodes where sqlite hands back objects '''
+        return [i.obj if isinstance(i, RamGraphDBNode) else i for i in found]
+
+    async def contains(self, item):
+        return await self._run(self._readers, self.db.__contains__, item)
+
+    async def find(self, target, relation):
+        ''' returns a list of everything target has relation to '''
+        return await self._run(self._readers, lambda: self._objects(self.db.find(target, relation)))
+
+    async def relations_of(self, target, include_object=False):
+        return await self._run(self._readers, lambda: list(self.db.relations_of(target, include_object)))
+
+    async def relations_to(self, target, include_object=False):
+        return await self._run(self._readers, lambda: list(self.db.relations_to(target, include_object)))
+
+    async def count_objects(self):
+        return await self._run(self._readers, self.db.count_objects)
+
+    async def count_relations(self, name=None):
+        return await self._run(self._readers, self.db.count_relations, name)
+
+    async def out_degree(self, obj, relation=None):
+        return await self._run(self._readers, self.db.out_degree, obj, relation)
+
+    async def in_degree(self, obj, relation=None):
+        return await self._run(self._readers, self.db.in_degree, obj, relation)
+
+    async def _iterate(self, iterable, chunk_size):
+        ''' async iterates over iterable, pulling chunk_size items at a time
+            in a reader. databases without readers are listed in one go so
+            no write can change them between chunks. '''
+        if self._readers is self._writer:
+            chunk_size = None
+        iterator = iter(iterable)
+        while True:
+            chunk = await self._run(self._readers, lambda: list(islice(iterator, chunk_size)))
+            for i in chunk:
+                yield i
+            if chunk_size is None or len(chunk) < chunk_size:
+                return
+
+    def list_objects(self, chunk_size=256):
+        ''' async iterates over every stored object '''
+        return self._iterate(self.db, chunk_size)
+
+    def list_relations(self, chunk_size=256):
+        ''' async iterates over every relation as (src, relation, dst) '''
+        return self._iterate(self.db.list_relations(), chunk_size)
@@ -1,4 +1,5 @@
 import sys
+from sys import getsizeof
 
 if sys.version_info < (3, 6):
     raise SystemError(
@@ -8,11 +9,17 @@ if sys.version_info < (3, 6):
         )
     )
 
-from threading import Lock
+from threading import Lock, RLock
+from contextlib import contextmanager
+from functools import wraps
 from base64 import b64encode as b64e
 from strict_functions import overload
 import generators as gen
-from functools import partial
+
+from .persistence import Persistence, logged
+from .locks import LockStripes
+from ..search import relation_names, bidirectional_path, equivalent_values, listed_types
+from ..stats import instrument
 
 
 def graph_hash(obj):
@@ -27,17 +34,6 @@ def graph_hash(obj):
         # instead of the sum of their current internals
         return hash((obj_type, id(obj)))
 
-class better_default_dict(dict):
-    def __init__(self, constructor):
-        if not callable(constructor):
-            constructor = lambda:constructor
-        self._constructor = constructor
-
-    def __getitem__(self, target):
-        if target not in self:
-            dict.__setitem__(self, target, self._constructor())
-        return dict.__getitem__(self, target)
-
 class NodeLinker(dict):
     """linker between nodes in RamGraphDB"""
     def __init__(self):
@@ -45,49 +41,119 @@ class NodeLinker(dict):
     def __dir__(self):
         return dir({}) + self.keys()
 
-class NodeCollection(list):
-    def __init__(self, owner=None):
-        list.__init__(self)
-        self.owner = owner
-    def clear(self):
-        list.clear(self)
-        self.owner.autoclean()
-    def pop(self, *args, **kwargs):
-        list.pop(self, *args, **kwargs)
+class NodeCollection(dict):
+    ''' insertion ordered set of the nodes one relation links to. nodes
+        are the keys so membership, append and remove are O(1) and
+        iterating yields the nodes like the list this used to be. '''
+    __slots__ = ()
+    def __init__(self, nodes=()):
+        dict.__init__(self, ((node, None) for node in nodes))
+    def pop(self, index=-1):
+        ''' removes and returns the node at index, the newest by default '''
         if not self:
-            self.owner.autoclean()
+            raise IndexError('pop from empty NodeCollection')
+        if index == -1:
+            return self.popitem()[0]
+        node = list(self)[index]
+        del self[node]
+        return node
     def append(self, new_node):
         assert isinstance(new_node, RamGraphDBNode), 'NodeCollections can only append RamGraphDBNodes'
-        list.append(self, new_node)
+        self[new_node] = None
+    def remove(self, node):
+        del self[node]
     def __iadd__(self, target):
-        for t in target:
-            self.append(t)
-    @overload
-    def __iadd__(self, target):
-        self.append(target)
-
-class RelationCollection(better_default_dict):
-    def __init__(self):
-        better_default_dict.__init__(self, partial(NodeCollection, self))
-    def __iadd__(self, target):
-        assert isinstance(target, RelationCollection)
-        for key in target:
-            self[key] += target[key]
+        ''' appends a node or every node in target '''
+        if isinstance(target, RamGraphDBNode):
+            self.append(target)
+        else:
+            for t in target:
+                self.append(t)
+        return self
 
-    def autoclean(self):
-        targets = {k for k, v in self.items() if not v}
-        for t in targets:
-            del self[t]
+class RelationCollection(dict):
+    ''' relation name: what a node links to with that relation. a relation
+        with a single link holds the RamGraphDBNode itself and only grows
+        into a NodeCollection once it gets a second link, which keeps the
+        leaves that make up most graphs down to one dict entry per edge.
+
+        writers change collections in place while holding the stripe of
+        their node, so readers never iterate one directly. they iterate a
+        tuple copied in a single call, which the gil keeps from seeing a
+        write halfway done. '''
+    __slots__ = ()
+
+    def targets(self, name):
+        ''' returns the nodes linked to with name '''
+        links = self.get(name)
+        if links is None:
+            return ()
+        return tuple(links) if type(links) is NodeCollection else (links,)
+
+    def links(self):
+        ''' generates every (name, node) link in the collection '''
+        for name, links in tuple(self.items()):
+            if type(links) is NodeCollection:
+                for node in tuple(links):
+                    yield name, node
+            else:
+                yield name, links
+
+    def count(self, name=None):
+        ''' returns how many links there are with name or in total '''
+        if name is None:
+            return sum(len(i) if type(i) is NodeCollection else 1 for i in tuple(self.values()))
+        links = self.get(name)
+        if links is None:
+            return 0
+        return len(links) if type(links) is NodeCollection else 1
+
+    def add(self, name, node):
+        ''' links to node with name, returns True if the link is new '''
+        links = self.get(name)
+        if links is None:
+            self[name] = node
+        elif type(links) is NodeCollection:
+            if node in links:
+                return False
+            links[node] = None
+        elif links is node:
+            return False
+        else:
+            self[name] = NodeCollection((links, node))
+        return True
+
+    def discard(self, name, node):
+        ''' removes the link to node with name, returns True if it existed.
+            relations without links are removed so they never show up. '''
+        links = self.get(name)
+        if type(links) is NodeCollection:
+            if node not in links:
+                return False
+            del links[node]
+            if len(links) == 1:
+                self[name] = next(iter(links))
+        elif links is node and links is not None:
+            del self[name]
+        else:
+            return False
+        return True
 
     def __add__(self, target):
         out = RelationCollection()
         out += self
         out += target
         return out
-    def clear(self):
-        for key in list(self):
-            self[key].clear()
-        dict.clear(self)
+
+    def __iadd__(self, target):
+        assert isinstance(target, RelationCollection)
+        for name, node in target.links():
+            self.add(name, node)
+        return self
+
+# what nodes without any incoming or outgoing links share. it is never
+# written to, RamGraphDBNode.link swaps in a new RelationCollection first.
+empty_relations = RelationCollection()
 
 class RamGraphDBNode(object):
     """object containers for RamGraphDB to store objects in"""
@@ -95,8 +161,8 @@ class RamGraphDBNode(object):
     def __init__(self, obj):
         self.obj = obj
         self._hash = graph_hash(obj)
-        self.incoming = RelationCollection() # relations to the node
-        self.outgoing = RelationCollection() # relations from the node
+        self.incoming = empty_relations # relations to the node
+        self.outgoing = empty_relations # relations from the node
 
     def __hash__(self):
         return self._hash
@@ -109,39 +175,129 @@ class RamGraphDBNode(object):
         assert isinstance(target, RamGraphDBNode), 'RamGraphDBNodes can only link to other RamGraphDBNodes'
 
     def link(self, relation_name, target):
+        ''' links self to target, returns True if the link is new '''
         self.__validate_relation_name__(relation_name)
         self.__validate_link_target__(target)
-        if target not in self.outgoing[relation_name]:
-            self.outgoing[relation_name].append(target)
-        if self not in target.incoming[relation_name]:
-            target.incoming[relation_name].append(self)
+        if self.outgoing is empty_relations:
+            self.outgoing = RelationCollection()
+        if target.incoming is empty_relations:
+            target.incoming = RelationCollection()
+        linked = self.outgoing.add(relation_name, target)
+        target.incoming.add(relation_name, self)
+        return linked
     def unlink(self, relation_name, target):
+        ''' unlinks self from target, returns True if the link existed '''
         self.__validate_relation_name__(relation_name)
         self.__validate_link_target__(target)
-        if relation_name in self.outgoing and target in self.outgoing[relation_name]:
-            self.outgoing[relation_name].remove(target)
-            target.incoming[relation_name].remove(self)
+        if self.outgoing.discard(relation_name, target):
+            target.incoming.discard(relation_name, self)
+            # nodes without links go back to sharing the empty collection
+            if not self.outgoing:
+                self.outgoing = empty_relations
+            if not target.incoming:
+                target.incoming = empty_relations
+            return True
+        return False
     def __eq__(self, target):
         return target.obj == self.obj or target.obj is self.obj
     def absorb(self, target):
+        ''' moves every link of target over to self '''
         assert self == target, 'can only absorb nodes with the same internal obj'
-        self.incoming += target.incoming
-        self.outgoing += target.outgoing
+        for name, other in list(target.outgoing.links()):
+            target.unlink(name, other)
+            self.link(name, self if other is target else other)
+        for name, other in list(target.incoming.links()):
+            other.unlink(name, target)
+            other.link(name, self)
         target.clear()
     def clear(self):
-        self.incoming.clear()
-        self.outgoing.clear()
-        del self.obj
+        ''' drops every link. obj stays so readers that found the node
+            before it was deleted still get what they found. '''
+        self.incoming = self.outgoing = empty_relations
 
 class RamGraphDB(object):
     ''' sqlite based graph database for storing native python objects and their relationships to each other '''
 
-    def __init__(self, autostore=True):
+    # what instrument() times. see graphdb.stats
+    instrumented_operations = (
+        'store_item', 'store_items', 'store_relation', 'store_relations',
+        'delete_item', 'delete_relation', 'replace_item', 'find',
+        'relations_of', 'relations_to', 'list_objects', 'list_relations',
+        'bfs', 'neighbourhood', 'shortest_path', 'count_objects',
+        'count_relations', 'out_degree', 'in_degree', '_traverse'
+    )
+    instrumented_serializers = ()
+    instrumented_statements = ()
+
+    # how many locks writes are spread over. a write only waits for
+    # writes to nodes that share a stripe with the nodes it changes
+    lock_stripes = 64
+
+    def __init__(self, autostore=True, path=None, fsync=1.0, snapshot_every=1000000):
+        ''' path is an optional directory that makes the database durable.
+            writes are appended to a log there that is fsynced at least
+            every fsync seconds (0 for every write, None to leave it to the
+            os) and compacted into a snapshot every snapshot_every writes. '''
         self.nodes = {} # stores node_hash:node
+        self._relation_counts = {} # relation name: how many links have it
+        self._unlisted_counts = {} # relation name: how many links have it to objects not of listed_types
         self._autostore = autostore
-        self._write_lock = Lock()
+        self._write_lock = RLock() # held by durable writes and transactions
+        self._stripes = LockStripes(self.lock_stripes) # held by writes to the nodes on them
+        self._counts_lock = Lock()
+        self._instrumentation = None
+        self._log_depth = 0
+        self._persistence = None
+        if path is not None:
+            persistence = Persistence(path, fsync, snapshot_every)
+            persistence.load(self, RamGraphDBNode)
+            self._persistence = persistence
+
+    @contextmanager
+    def transaction(self):
+        ''' holds the write lock and every stripe for the with block to
+            match the SQLiteGraphDB api, so no other thread writes until it
+            ends. changes are applied immediately and are not rolled back
+            if an exception is raised. '''
+        with self._write_lock, self._stripes.all():
+            yield self
+
+    def freeze(self):
+        ''' returns a read only FrozenRamGraphDB snapshot of the graph that
+            uses far less memory and traverses faster. later writes to this
+            database do not show up in the snapshot. '''
+        return FrozenRamGraphDB(self)
+
+    def snapshot(self):
+        ''' compacts the log of a durable database into a new snapshot '''
+        assert self._persistence is not None, 'snapshots need a database opened with a path'
+        with self._write_lock:
+            self._persistence.snapshot(self)
+
+    def close(self):
+        ''' fsyncs and closes the log of a durable database '''
+        if self._persistence is not None:
+            with self._write_lock:
+                self._persistence.close()
+
+    def instrument(self, enabled=True, slow_query_seconds=None, hook=None):
+        ''' starts recording how long every public method, the traversals
+            behind V and VList and waiting for the write lock take,
+            replacing anything recorded before. hook is called with the
+            (kind, name, seconds) of each recording. ram runs no sql so
+            slow_query_seconds is only there to match SQLiteGraphDB.
+            instrument(False) stops recording and takes every wrapper off
+            again. returns the Instrumentation. '''
+        return instrument(self, enabled, slow_query_seconds, hook)
+
+    def stats(self):
+        ''' returns what instrument() has recorded or None if it is off '''
+        return None if self._instrumentation is None else self._instrumentation.stats()
 
     def _destroy(self):
+        if self._persistence is not None:
+            self._persistence.destroy()
+            self._persistence = None
         targets = list(self)
         for t in targets:
             self.delete_item(t)
@@ -157,25 +313,68 @@ class RamGraphDB(object):
     def _get_item_node(self, item):
         return item if isinstance(item, RamGraphDBNode) else self.nodes[self._item_hash(item)]
 
+    @logged
     def store_item(self, item):
         ''' use this function to store a python object in the database '''
         assert not isinstance(item, RamGraphDBNode)
         item_hash = graph_hash(item)
-        if item_hash not in self.nodes:
-            self.nodes[item_hash] = RamGraphDBNode(item)
-        return self.nodes[item_hash]
-
+        node = self.nodes.get(item_hash)
+        # a delete_item can remove a node another writer just stored
+        while node is None:
+            node = self._add_node(item_hash, item) or self.nodes.get(item_hash)
+        return node
+
+    def _add_node(self, item_hash, item):
+        ''' stores a node for item and returns it or returns None if
+            another writer stored one first '''
+        with self._stripes(item_hash):
+            if item_hash not in self.nodes:
+                node = self.nodes[item_hash] = RamGraphDBNode(item)
+                return node
+
+    @logged
     def replace_item(self, old_item, new_item):
-        for relation, dst in self.relations_of(old_item, True):
+        node = self.nodes.get(self._item_hash(old_item))
+        if node is None: # if there is nothing to replace
+            return
+        for relation, dst in list(self.relations_of(node, True)):
             self.delete_relation(old_item, relation, dst)
             self.store_relation(new_item, relation, dst)
-        for src, relation in self.relations_to(old_item, True):
+        for src, relation in list(self.relations_to(node, True)):
             self.delete_relation(src, relation, old_item)
             self.store_relation(src, relation, new_item)
         self.delete_item(old_item)
 
     _id_of = _item_hash
 
+    def _link(self, src, name, dst):
+        ''' links the nodes, returns True and counts the link if it is new.
+            callers hold the stripes of both nodes. '''
+        if src.link(name, dst):
+            counts = self._relation_counts
+            with self._counts_lock:
+                counts[name] = counts.get(name, 0) + 1
+                if type(dst.obj) not in listed_types:
+                    unlisted = self._unlisted_counts
+                    unlisted[name] = unlisted.get(name, 0) + 1
+            return True
+        return False
+
+    def _unlink(self, src, name, dst):
+        ''' unlinks the nodes and stops counting the link if it existed.
+            callers hold the stripes of both nodes. '''
+        if src.unlink(name, dst):
+            counts = self._relation_counts
+            with self._counts_lock:
+                counts[name] -= 1
+                if not counts[name]:
+                    del counts[name]
+                if type(dst.obj) not in listed_types:
+                    unlisted = self._unlisted_counts
+                    unlisted[name] -= 1
+                    if not unlisted[name]:
+                        del unlisted[name]
+
     @staticmethod
     def serialize(o):
         '''this is a placeholder function to support SQLiteGraphDB api compatibility. NO SERIALIZING IN RAM!!!'''
@@ -187,10 +386,30 @@ class RamGraphDB(object):
         return o
 
     def __iadd__(self, target):
-        ''' use this to combine databases '''
+        ''' use this to combine databases. every node of target is matched
+            to its node here once and its links are copied straight between
+            the nodes, including nodes without links. '''
         assert isinstance(target, RamGraphDB), 'graph databases can only be added to other graph databases'
-        for src, name, dst in target.list_relations():
-            self.store_relation(src, name, dst)
+        if target is self:
+            return self
+        persistence = self._persistence
+        with self._write_lock, self._stripes.all(), target._write_lock, target._stripes.all():
+            # id of a node in target: the node here with the same object
+            nodes = {}
+            for item_hash, node in target.nodes.items():
+                mine = self.nodes.get(item_hash)
+                if mine is None:
+                    mine = self.nodes[item_hash] = RamGraphDBNode(node.obj)
+                    if persistence is not None:
+                        persistence.append('store_item', (node.obj,))
+                nodes[id(node)] = mine
+            for node in target.nodes.values():
+                mine = nodes[id(node)]
+                for name, other in node.outgoing.links():
+                    if self._link(mine, name, nodes[id(other)]) and persistence is not None:
+                        persistence.append('store_relation', (node.obj, name, other.obj))
+            if persistence is not None:
+                persistence.sync(self)
         return self
 
     def __add__(self, target):
@@ -205,69 +424,276 @@ class RamGraphDB(object):
     def __require_string__(target):
         assert type(target).__name__ in {'str','unicode'}, 'string required'
 
+    @logged
     def store_relation(self, src, name, dst):
         ''' use this to store a relation between two objects '''
         self.__require_string__(name)
-        #print('storing relation', src, name, dst)
-        # make sure both items are stored
-        self.store_item(src).link(name, self.store_item(dst))
-
+        self._store_relation(src, name, dst)
+
+    def _store_relation(self, src, name, dst):
+        ''' links src to dst with name, storing them first if they are new.
+            returns True if the link is new. '''
+        nodes = self.nodes
+        while True:
+            src_node = nodes.get(graph_hash(src)) or self.store_item(src)
+            dst_node = nodes.get(graph_hash(dst)) or self.store_item(dst)
+            with self._stripes.pair(src_node._hash, dst_node._hash):
+                # a delete_item can remove either node before the stripes are held
+                if nodes.get(src_node._hash) is src_node and nodes.get(dst_node._hash) is dst_node:
+                    return self._link(src_node, name, dst_node)
+
+    def store_items(self, items):
+        ''' stores every object in items and returns how many of them were new to the database '''
+        if self._persistence is None:
+            return self._store_items(items)
+        # the log needs the writes in the order they were made
+        with self._write_lock:
+            return self._store_items(items)
+
+    def _store_items(self, items):
+        nodes = self.nodes
+        persistence = self._persistence
+        stored = 0
+        for item in items:
+            assert not isinstance(item, RamGraphDBNode)
+            item_hash = graph_hash(item)
+            if item_hash not in nodes and self._add_node(item_hash, item) is not None:
+                stored += 1
+                if persistence is not None:
+                    persistence.append('store_item', (item,))
+        if persistence is not None:
+            persistence.sync(self)
+        return stored
+
+    def store_relations(self, relations):
+        ''' stores every (src, name, dst) in relations and returns how many of them were new to the database '''
+        if self._persistence is None:
+            return self._store_relations(relations)
+        with self._write_lock:
+            return self._store_relations(relations)
+
+    def _store_relations(self, relations):
+        nodes = self.nodes
+        persistence = self._persistence
+        stored = 0
+        self._log_depth += 1
+        try:
+            for src, name, dst in relations:
+                self.__require_string__(name)
+                node_count = len(nodes)
+                linked = self._store_relation(src, name, dst)
+                stored += linked
+                # only log relations that changed something
+                if persistence is not None and (linked or node_count != len(nodes)):
+                    persistence.append('store_relation', (src, name, dst))
+        finally:
+            self._log_depth -= 1
+        if persistence is not None:
+            persistence.sync(self)
+        return stored
 
     def _delete_single_relation(self, src, relation, dst):
         ''' deletes a single relation between objects '''
         raise NotImplementedError()
         self.__require_string__(relation)
 
+    @logged
     def delete_relation(self, src, relation, target):
         ''' can be both used as (src, relation, dest) for a single relation or
             (src, relation) to delete all relations of that type from the src '''
         self.__require_string__(relation)
-        if src in self and target in self:
-            self._get_item_node(src).unlink(relation, self._get_item_node(target))
+        src, target = self.nodes.get(self._item_hash(src)), self.nodes.get(self._item_hash(target))
+        if src is not None and target is not None:
+            with self._stripes.pair(src._hash, target._hash):
+                self._unlink(src, relation, target)
+
+    @staticmethod
+    def _linked_hashes(node):
+        ''' returns the hashes of node and every node it links to or from '''
+        return {node._hash}.union(
+            other._hash for links in (node.outgoing, node.incoming) for name, other in links.links()
+        )
 
+    @logged
     def delete_item(self, item):
         ''' removes an item from the db '''
-        for relation, dst in self.relations_of(item, True):
-            self.delete_relation(item, relation, dst)
-            #print(item, relation, dst)
-        for src, relation in self.relations_to(item, True):
-            self.delete_relation(src, relation, item)
-            #print(src, relation, item)
         h = self._item_hash(item)
-        if item in self:
-            #print('deleting item:', item)
-            self.nodes[h].clear()
-            del self.nodes[h]
+        while True:
+            node = self.nodes.get(h)
+            if node is None:
+                return
+            linked = self._linked_hashes(node)
+            with self._stripes(*linked):
+                # links to nodes on stripes that are not held can be made
+                # before the stripes are taken, which sends it round again
+                if self.nodes.get(h) is node and self._linked_hashes(node) <= linked:
+                    for relation, dst in node.outgoing.links():
+                        self._unlink(node, relation, dst)
+                    for relation, src in node.incoming.links():
+                        self._unlink(src, relation, node)
+                    node.clear()
+                    del self.nodes[h]
+                    return
 
     def find(self, target, relation):
         ''' returns back all elements the target has a relation to '''
-        return self._get_item_node(target).outgoing[relation]
+        return NodeCollection(self._get_item_node(target).outgoing.targets(relation))
+
+    def count_objects(self):
+        ''' returns how many objects are stored '''
+        return len(self.nodes)
+
+    def count_relations(self, name=None):
+        ''' returns how many relations are stored, or how many are named name '''
+        if name is None:
+            return sum(self._relation_counts.values())
+        return self._relation_counts.get(name, 0)
+
+    def out_degree(self, obj, relation=None):
+        ''' returns how many relations obj has, or how many named relation '''
+        node = self.nodes.get(self._item_hash(obj))
+        return 0 if node is None else node.outgoing.count(relation)
+
+    def in_degree(self, obj, relation=None):
+        ''' returns how many relations point at obj, or how many named relation '''
+        node = self.nodes.get(self._item_hash(obj))
+        return 0 if node is None else node.incoming.count(relation)
+
+    def _traverse(self, values, steps, distinct=False):
+        ''' generates every node reached by following steps from each value
+            in values. steps are ('hop', relation) to move along a relation
+            or ('has', relation, targets) to keep what has relation to one of
+            targets. distinct finds every node once instead of once per path
+            to it and only steps from it once. '''
+        nodes = (self._get_item_node(v) for v in values)
+        for step in steps:
+            if distinct:
+                nodes = self._unique_nodes(nodes)
+            nodes = self._hop(nodes, step[1]) if step[0] == 'hop' else self._has(nodes, step[1], step[2])
+        return self._unique_nodes(nodes) if distinct else nodes
+
+    @staticmethod
+    def _hop(nodes, relation):
+        for node in nodes:
+            links = node.outgoing.get(relation)
+            if type(links) is NodeCollection:
+                yield from tuple(links)
+            elif links is not None:
+                yield links
+
+    # has steps collect the nodes linking to their targets up front unless
+    # more than this many do, then the links of each node are probed instead
+    max_has_sources = 4096
+
+    def _has(self, nodes, relation, targets):
+        ''' keeps the nodes with relation to one of targets. targets with few
+            incoming links are joined through them, popular ones are probed
+            for in the outgoing links of each node. nothing is compared by
+            value either way since equal targets are the same node, unless
+            relation links to objects not of listed_types that can == targets
+            without being one of them. '''
+        if self._unlisted_counts.get(relation):
+            def equal(node):
+                return any(other.obj == t for other in node.outgoing.targets(relation) for t in targets)
+            return (node for node in nodes if equal(node))
+        targets = [i for i in (self.nodes.get(graph_hash(t)) for t in targets) if i is not None]
+        if not targets:
+            return iter(())
+        if sum(i.incoming.count(relation) for i in targets) <= self.max_has_sources:
+            sources = {id(node) for target in targets for node in target.incoming.targets(relation)}
+            return (node for node in nodes if id(node) in sources)
+        def linked(node):
+            links = node.outgoing.get(relation)
+            if type(links) is NodeCollection:
+                return any(target in links for target in targets)
+            return links is not None and any(links is target for target in targets)
+        return (node for node in nodes if linked(node))
+
+    @staticmethod
+    def _unique_nodes(nodes):
+        seen = set()
+        for node in nodes:
+            if id(node) not in seen:
+                seen.add(id(node))
+                yield node
+
+    @staticmethod
+    def _links(relations, names):
+        ''' generates the nodes a RelationCollection links to with names or with any name if names is None '''
+        if names is None:
+            for name, node in relations.links():
+                yield node
+        else:
+            for name in names:
+                yield from relations.targets(name)
+
+    def bfs(self, start, relations=None, max_depth=None):
+        ''' generates (object, depth) for everything reachable from start in
+            breadth first order, beginning with (start, 0). each object is
+            found once at the depth of its shortest path. relations limits
+            which relation names are followed and max_depth how many hops. '''
+        assert max_depth is None or (isinstance(max_depth, int) and max_depth >= 0), max_depth  # max_depth needs to be None or a non negative int
+        names = relation_names(relations)
+        node = self.nodes.get(self._item_hash(start))
+        if node is None:
+            return
+        yield node.obj, 0
+        seen = {id(node)}
+        level, depth = [node], 0
+        while level and depth != max_depth:
+            depth += 1
+            found = []
+            for node in level:
+                for other in self._links(node.outgoing, names):
+                    if id(other) not in seen:
+                        seen.add(id(other))
+                        found.append(other)
+                        yield other.obj, depth
+            level = found
+
+    def neighbourhood(self, start, k, relations=None):
+        ''' generates everything within k hops of start, not counting start '''
+        for obj, depth in self.bfs(start, relations, k):
+            if depth:
+                yield obj
+
+    def shortest_path(self, src, dst, relations=None):
+        ''' returns the objects on a shortest path from src to dst, both
+            included, or None if dst cant be reached from src '''
+        names = relation_names(relations)
+        src, dst = self.nodes.get(self._item_hash(src)), self.nodes.get(self._item_hash(dst))
+        if src is None or dst is None:
+            return None
+        def expand(nodes, reverse):
+            for node in nodes:
+                for other in self._links(node.incoming if reverse else node.outgoing, names):
+                    yield node, other
+        path = bidirectional_path(src, dst, expand)
+        return None if path is None else [node.obj for node in path]
 
     def relations_of(self, target, include_object=False):
         ''' list all relations the originate from target '''
         relations = (target if isinstance(target, RamGraphDBNode) else self._get_item_node(target)).outgoing
         if include_object:
-            for k in relations:
-                for v in relations[k]:
-                    if hasattr(v, 'obj'): # filter dead links
-                        yield k, v.obj
+            for k, v in relations.links():
+                if hasattr(v, 'obj'): # filter dead links
+                    yield k, v.obj
         else:
-            yield from relations
+            yield from tuple(relations)
 
     def relations_to(self, target, include_object=False):
         ''' list all relations pointing at an object '''
         relations = self._get_item_node(target).incoming
         if include_object:
-            for k in relations:
-                for v in relations[k]:
-                    if hasattr(v, 'obj'): # filter dead links
-                        yield v.obj, k
+            for k, v in relations.links():
+                if hasattr(v, 'obj'): # filter dead links
+                    yield v.obj, k
         else:
-            yield from relations
+            yield from tuple(relations)
 
     def iter_nodes(self):
-        for _id in self.nodes:
-            yield self.nodes[_id]
+        # a copy so other threads can store and delete while this runs
+        yield from tuple(self.nodes.values())
 
     def __iter__(self):
         ''' iterate over all stored objects in the database '''
@@ -280,23 +706,58 @@ class RamGraphDB(object):
 
     def show_objects(self):
         ''' display the entire of objects with their (id, value, node) '''
-        for key in self.nodes:
-            node = self.nodes[key]
+        for key, node in tuple(self.nodes.items()):
             value = node.obj
             print(key, '-', repr(value), '-', node)
 
     def list_relations(self):
         ''' list every relation in the database as (src, relation, dst) '''
         for node in self.iter_nodes():
-            for relation, target in self.relations_of(node.obj, True):
+            for relation, target in self.relations_of(node, True):
                 yield node.obj, relation, target
 
     def show_relations(self):
         ''' display every relation in the database as (src, relation, dst) '''
         for src_node in self.iter_nodes():
-            for relation in src_node.outgoing:
-                for dst_node in src_node.outgoing[relation]:
-                    print(repr(src_node.obj), '-', relation, '-', repr(dst_node.obj))
+            for relation, dst_node in src_node.outgoing.links():
+                print(repr(src_node.obj), '-', relation, '-', repr(dst_node.obj))
+
+    def memory_usage(self):
+        ''' returns how many bytes the graph structure takes as a dict of
+            nodes and edges with their counts, node_bytes and edge_bytes with
+            what they take in total, bytes_per_node, bytes_per_edge, the
+            edge bytes of each relation name in relations and the total.
+            the stored objects themselves are not counted since they are
+            owned by the caller and can be shared with the rest of python. '''
+        with self.transaction():
+            node_bytes = getsizeof(self.nodes)
+            relations = {}
+            edges = 0
+            for node in self.iter_nodes():
+                node_bytes += getsizeof(node) + getsizeof(node._hash)
+                for collection in (node.outgoing, node.incoming):
+                    if collection is empty_relations or not collection:
+                        continue
+                    # the dict is split evenly between the names in it
+                    share = getsizeof(collection) / len(collection)
+                    for name, links in collection.items():
+                        size = share
+                        if type(links) is NodeCollection:
+                            size += getsizeof(links)
+                        relations[name] = relations.get(name, 0) + size
+                edges += node.outgoing.count()
+            relations = {name: int(size) for name, size in relations.items()}
+            edge_bytes = sum(relations.values())
+            return {
+                'nodes': len(self.nodes),
+                'edges': edges,
+                'node_bytes': node_bytes,
+                'edge_bytes': edge_bytes,
+                'bytes_per_node': node_bytes / len(self.nodes) if self.nodes else 0.0,
+                'bytes_per_edge': edge_bytes / edges if edges else 0.0,
+                'relations': relations,
+                'total': node_bytes + edge_bytes
+            }
 
     def __getitem__(self, key):
         if self._autostore:
@@ -320,7 +781,7 @@ class V(object):
 
     def __getattribute__(self, key):
         ''' this runs a query on the next step of the query '''
-        return object.__getattribute__(self, key) if key in V.__reserved__ else VList(V(self._graph_db, _) for _ in self._graph_db.find(self._graph_value, key))
+        return object.__getattribute__(self, key) if key in V.__reserved__ else VList._traversal(self._graph_db, (self._graph_value,), (('hop', key),), False)
 
     __getitem__ = __getattribute__
 
@@ -344,13 +805,112 @@ class V(object):
     def __call__(self):
         return self._graph_value.obj if isinstance(self._graph_value, RamGraphDBNode) else self._graph_value
 
+def _materialized(method):
+    ''' wraps a list method so it sees what pending plans find, both in
+        the VList it runs on and in any VList passed to it '''
+    @wraps(method)
+    def wrapper(self, *args, **kwargs):
+        return method(self._materialize(), *(i._materialize() if isinstance(i, VList) else i for i in args), **kwargs)
+    return wrapper
+
 class VList(list):
-    _slots = set(tuple(dir(list)) + ('_slots','to','where'))
+    ''' list of V's. stepping through relations builds a plan of
+        (db, start values, steps, distinct) that only walks the graph once
+        the VList is called, iterated or otherwise looked at. '''
+    _slots = set(tuple(dir(list)) + ('_slots','to','where','distinct','distinct_count','stream','_plan','_traversal','_materialize','_then','_where_equals','__radd__','__copy__'))
+
+    def __init__(self, *args):
+        list.__init__(self, *args)
+        object.__setattr__(self, '_plan', None)
 
     #def __init__(self, arg):
     #    list.__init__(self, arg)
     #    assert all(type(i)==V for i in self), 'VLists can only contain V objects'
 
+    @staticmethod
+    def _traversal(db, values, steps, distinct):
+        ''' returns a VList of what steps reach from values in db '''
+        out = VList()
+        object.__setattr__(out, '_plan', (db, values, steps, distinct))
+        return out
+
+    def _materialize(self):
+        ''' walks the pending plan and fills the list with what it finds '''
+        if self._plan is not None:
+            db, values, steps, distinct = self._plan
+            object.__setattr__(self, '_plan', None)
+            list.extend(self, (V(db, i) for i in db._traverse(values, steps, distinct)))
+        return self
+
+    def _then(self, *step, distinct=False):
+        ''' returns a VList that runs step on everything in this one.
+            once a plan is distinct every later step is as well. '''
+        if self._plan is not None:
+            db, values, steps, was_distinct = self._plan
+            return VList._traversal(db, values, steps + step, distinct or was_distinct)
+        if not list.__len__(self):
+            return VList()
+        return VList._traversal(
+            list.__getitem__(self, 0)._graph_db,
+            tuple(i._graph_value for i in list.__iter__(self)),
+            step,
+            distinct
+        )
+
+    def distinct(self):
+        ''' returns a VList that only holds each object once and only steps
+            from each object once on every later hop '''
+        return self._then(distinct=True)
+
+    def stream(self):
+        ''' generates the V's of this VList straight from the graph without
+            holding them in the list '''
+        if self._plan is None:
+            return list.__iter__(self)
+        db, values, steps, distinct = self._plan
+        return (V(db, i) for i in db._traverse(values, steps, distinct))
+
+    def __iter__(self):
+        return list.__iter__(self._materialize())
+
+    def __len__(self):
+        return list.__len__(self._materialize())
+
+    def __contains__(self, target):
+        return list.__contains__(self._materialize(), target)
+
+    def __repr__(self):
+        return list.__repr__(self._materialize())
+
+    def __radd__(self, other):
+        # list + VList reads the list storage of the VList directly
+        if not isinstance(other, list):
+            return NotImplemented
+        return list.__add__(other, self._materialize())
+
+    def __copy__(self):
+        return VList(list.__iter__(self._materialize()))
+
+    def __reduce_ex__(self, protocol):
+        return VList, (list(list.__iter__(self._materialize())),)
+
+    def count(self, *value):
+        ''' returns how many objects the VList holds by walking its plan
+            without building the list. count(value) works like list.count. '''
+        if value:
+            return list.count(self._materialize(), *value)
+        if self._plan is None:
+            return list.__len__(self)
+        db, values, steps, distinct = self._plan
+        return sum(1 for _ in db._traverse(values, steps, distinct))
+
+    def distinct_count(self):
+        ''' returns how many different objects the VList holds '''
+        if self._plan is None:
+            return len({i._graph_db._id_of(i._graph_value) for i in list.__iter__(self)})
+        db, values, steps, distinct = self._plan
+        return sum(1 for _ in db._traverse(values, steps, True))
+
     def where(self, relation, filter_fn):
         ''' use this to filter VLists, simply provide a filter function and what relation to apply it to '''
         assert type(relation).__name__ in {'str','unicode'}, 'where needs the first arg to be a string'
@@ -368,11 +928,21 @@ class VList(list):
         '''use this to filter VLists with kv pairs'''
         out = self
         for k,v in kwargs.items():
-            out = out.where(k, lambda i:i==v)
+            out = out._where_equals(k, v)
         return out
     
     where = overload(_where, where)
 
+    def _where_equals(self, relation, value):
+        ''' keeps what has relation to something equal to value. this joins
+            through the incoming links of value when every stored form of
+            value is known and relation only links to listed_types. '''
+        assert type(relation).__name__ in {'str','unicode'}, 'where needs a string relation'
+        targets = equivalent_values(value)
+        if targets is None:
+            return self.where(relation, lambda i:i==value)
+        return self._then(('has', relation, targets))
+
     def to(self, output_type):
         assert type(output_type) == type, 'needed a type here not: {}'.format(output_type)
         return output_type(self())
@@ -396,20 +966,38 @@ class VList(list):
         if key in VList._slots:
             return object.__getattribute__(self, key)
         else:
-            # run the attribute query on all elements in self
-            g = lambda:gen.chain( (fv for fv in getattr(v,key)) for v in self )
-            return VList(g())
+            # add the attribute query to the plan
+            return self._then(('hop', key))
 
     __getitem__ = __getattribute__
 
     def __call__(self, output_type=None):
-        # load all values where this is called
+        # load all values where this is called. pending plans stream
+        # straight from the graph without filling the list
+        if self._plan is not None:
+            db, values, steps, distinct = self._plan
+            values = (i.obj if isinstance(i, RamGraphDBNode) else i for i in db._traverse(values, steps, distinct))
+        else:
+            values = (i() for i in list.__iter__(self))
         if output_type is None:
-            return (i() for i in self)
+            return values
         else:
-            return output_type(i() for i in self)
+            return output_type(values)
+
+# list methods that read or change the list storage directly instead of
+# going through __iter__ or __len__
+for _name in (
+    '__eq__', '__ne__', '__lt__', '__le__', '__gt__', '__ge__', '__add__',
+    '__mul__', '__rmul__', '__reversed__', 'copy', 'index', 'append',
+    'extend', 'insert', 'pop', 'remove', 'clear', 'sort', 'reverse',
+    '__setitem__', '__delitem__', '__iadd__', '__imul__'
+):
+    setattr(VList, _name, _materialized(getattr(list, _name)))
+del _name
  
 
+from .frozen import FrozenRamGraphDB
+
 if __name__ == '__main__':
     db = RamGraphDB()
     def show():
@@ -434,6 +1022,8 @@ if __name__ == '__main__':
     assert list(db.relations_to('bob')) == ['knows']
     assert list(db.relations_to('bob', True)) == [('tom', 'knows')]
     assert isinstance(db.find('tom', 'knows'), NodeCollection)
+    assert db.memory_usage()['edges'] == 2
+    assert db.count_relations() == db.count_relations('knows') == db.out_degree('tom') == 2
     assert {i.obj for i in db.find('tom', 'knows')} == {'bob', 'bill'}
     db.delete_relation('tom', 'knows', 'bill')
     show()
@@ -452,8 +1042,8 @@ if __name__ == '__main__':
 
     db._destroy()
     show()
-    assert len(list(db.list_relations())) == 0
-    assert len(list(db)) == 0
+    assert db.count_relations() == 0
+    assert db.count_objects() == 0
 
     db1 = RamGraphDB()
     db2 = RamGraphDB()
@@ -0,0 +1,211 @@
+''' read only snapshots of RamGraphDB for graphs that are loaded once and
+    then only read. nodes become dense integer ids, relation names are
+    interned and each direction of adjacency is stored in compressed
+    sparse row buffers instead of per node dicts. '''
+
+from array import array
+from bisect import bisect_left, bisect_right
+from contextlib import contextmanager
+
+from . import V, VList, graph_hash
+
+def _typecode(largest):
+    ''' returns the smallest unsigned array typecode that can hold largest '''
+    for code in 'IQ':
+        if largest < 2 ** (array(code).itemsize * 8):
+            return code
+    raise OverflowError(largest)
+
+class FrozenRamGraphDB(object):
+    ''' read only snapshot of a RamGraphDB. use RamGraphDB.freeze() to make one '''
+
+    def __init__(self, db):
+        with db.transaction():
+            nodes = list(db.iter_nodes())
+            node_ids = {id(node): i for i, node in enumerate(nodes)}
+            self._objects = [node.obj for node in nodes]
+            self._ids = {node._hash: i for i, node in enumerate(nodes)}
+            self._names = sorted({name for node in nodes for name in node.outgoing})
+            self._name_ids = {name: i for i, name in enumerate(self._names)}
+            self._relation_counts = dict(db._relation_counts)
+            self._unlisted = set(db._unlisted_counts)
+            self._outgoing = self._csr(nodes, node_ids, 'outgoing')
+            self._incoming = self._csr(nodes, node_ids, 'incoming')
+
+    def _csr(self, nodes, node_ids, direction):
+        ''' returns read only (offsets, relations, targets) buffers where the
+            links of node i are at offsets[i]:offsets[i+1], sorted by relation '''
+        links = []
+        offsets = [0]
+        for node in nodes:
+            collections = getattr(node, direction)
+            for name in sorted((i for i in collections if i in self._name_ids), key=self._name_ids.get):
+                r = self._name_ids[name]
+                links.extend((r, node_ids[id(other)]) for other in collections.targets(name) if id(other) in node_ids)
+            offsets.append(len(links))
+        offsets = array(_typecode(len(links)), offsets)
+        relations = array(_typecode(len(self._names)), (r for r, t in links))
+        targets = array(_typecode(len(nodes)), (t for r, t in links))
+        return tuple(memoryview(i).toreadonly() for i in (offsets, relations, targets))
+
+    def _id_of(self, item):
+        return self._ids[graph_hash(item)]
+
+    def __contains__(self, item):
+        return graph_hash(item) in self._ids
+
+    def _span(self, csr, node, relation=None):
+        ''' returns the (start, stop) of the links of node in csr '''
+        offsets, relations, targets = csr
+        lo, hi = offsets[node], offsets[node+1]
+        if relation is None:
+            return lo, hi
+        r = self._name_ids.get(relation)
+        if r is None:
+            return lo, lo
+        return bisect_left(relations, r, lo, hi), bisect_right(relations, r, lo, hi)
+
+    def _find_ids(self, node, relation):
+        lo, hi = self._span(self._outgoing, node, relation)
+        return self._outgoing[2][lo:hi]
+
+    def find(self, target, relation):
+        ''' returns back all elements the target has a relation to '''
+        objects = self._objects
+        return (objects[i] for i in self._find_ids(self._id_of(target), relation))
+
+    def count_objects(self):
+        ''' returns how many objects are stored '''
+        return len(self._objects)
+
+    def count_relations(self, name=None):
+        ''' returns how many relations are stored, or how many are named name '''
+        if name is None:
+            return len(self._outgoing[2])
+        return self._relation_counts.get(name, 0)
+
+    def _degree(self, csr, obj, relation):
+        node = self._ids.get(graph_hash(obj))
+        if node is None:
+            return 0
+        lo, hi = self._span(csr, node, relation)
+        return hi - lo
+
+    def out_degree(self, obj, relation=None):
+        ''' returns how many relations obj has, or how many named relation '''
+        return self._degree(self._outgoing, obj, relation)
+
+    def in_degree(self, obj, relation=None):
+        ''' returns how many relations point at obj, or how many named relation '''
+        return self._degree(self._incoming, obj, relation)
+
+    def _relations(self, csr, node, include_object):
+        lo, hi = self._span(csr, node)
+        names, objects = self._names, self._objects
+        relations, targets = csr[1][lo:hi], csr[2][lo:hi]
+        if include_object:
+            return ((names[r], objects[t]) for r, t in zip(relations, targets))
+        # relations are sorted so repeats are next to each other
+        return (names[r] for i, r in enumerate(relations) if not i or relations[i-1] != r)
+
+    def relations_of(self, target, include_object=False):
+        ''' list all relations the originate from target '''
+        return self._relations(self._outgoing, self._id_of(target), include_object)
+
+    def relations_to(self, target, include_object=False):
+        ''' list all relations pointing at an object '''
+        out = self._relations(self._incoming, self._id_of(target), include_object)
+        return ((obj, name) for name, obj in out) if include_object else out
+
+    def _traverse(self, values, steps, distinct=False):
+        ''' generates every object reached by following the ('hop', relation)
+            and ('has', relation, targets) steps from each value in values
+            over node ids '''
+        nodes = (self._id_of(v) for v in values)
+        for step in steps:
+            if distinct:
+                nodes = self._unique(nodes)
+            nodes = self._hop(nodes, step[1]) if step[0] == 'hop' else self._has(nodes, step[1], step[2])
+        if distinct:
+            nodes = self._unique(nodes)
+        objects = self._objects
+        return (objects[i] for i in nodes)
+
+    def _hop(self, nodes, relation):
+        for node in nodes:
+            yield from self._find_ids(node, relation)
+
+    def _has(self, nodes, relation, targets):
+        ''' keeps the nodes with relation to one of targets by joining
+            through the incoming links of the targets, or by comparing the
+            objects relation links to if they are not all of listed_types '''
+        if relation in self._unlisted:
+            objects = self._objects
+            return (node for node in nodes if any(objects[i] == t for i in self._find_ids(node, relation) for t in targets))
+        sources = set()
+        for target in targets:
+            target = self._ids.get(graph_hash(target))
+            if target is not None:
+                lo, hi = self._span(self._incoming, target, relation)
+                sources.update(self._incoming[2][lo:hi])
+        return (node for node in nodes if node in sources)
+
+    @staticmethod
+    def _unique(nodes):
+        seen = set()
+        for node in nodes:
+            if node not in seen:
+                seen.add(node)
+                yield node
+
+    def __iter__(self):
+        ''' iterate over all stored objects in the database '''
+        return iter(self._objects)
+
+    list_objects = __iter__
+
+    def list_relations(self):
+        ''' list every relation in the database as (src, relation, dst) '''
+        for src, obj in enumerate(self._objects):
+            for relation, target in self._relations(self._outgoing, src, True):
+                yield obj, relation, target
+
+    def show_objects(self):
+        ''' display the entire of objects with their (id, value) '''
+        for i, obj in enumerate(self._objects):
+            print(i, '-', repr(obj))
+
+    def show_relations(self):
+        ''' display every relation in the database as (src, relation, dst) '''
+        for src, relation, dst in self.list_relations():
+            print(repr(src), '-', relation, '-', repr(dst))
+
+    @staticmethod
+    def serialize(o):
+        '''this is a placeholder function to support SQLiteGraphDB api compatibility. NO SERIALIZING IN RAM!!!'''
+        return o
+
+    @staticmethod
+    def deserialize(o):
+        '''this is a placeholder function to support SQLiteGraphDB api compatibility. NO SERIALIZING IN RAM!!!'''
+        return o
+
+    @contextmanager
+    def transaction(self):
+        ''' snapshots never change so there is nothing to hold '''
+        yield self
+
+    def _read_only(self, *args, **kwargs):
+        raise TypeError('FrozenRamGraphDB snapshots are read only')
+
+    store_item = store_items = store_relation = store_relations = _read_only
+    delete_item = delete_relation = replace_item = _read_only
+
+    def _destroy(self):
+        self.__dict__.clear()
+
+    def __getitem__(self, key):
+        return VList([V(self, key)])
+
+    def __call__(self, key):
+        return VList([V(self, key)])
@@ -0,0 +1,72 @@
+''' striped write locks for RamGraphDB. every node maps to one of a fixed
+    set of reentrant locks by its graph_hash so writers only wait on each
+    other when they touch nodes on the same stripe. writes that change two
+    nodes hold both stripes, which are always taken in stripe order so
+    writers holding several of them can never deadlock. '''
+
+from threading import RLock
+
+__all__ = ['LockStripes']
+
+class HeldStripes(object):
+    ''' context manager that holds locks for its with block '''
+    __slots__ = ('locks',)
+
+    def __init__(self, locks):
+        self.locks = locks
+
+    def __enter__(self):
+        for lock in self.locks:
+            lock.acquire()
+        return self
+
+    def __exit__(self, *args):
+        for lock in reversed(self.locks):
+            lock.release()
+
+class HeldPair(object):
+    ''' HeldStripes for the two stripes most writes hold '''
+    __slots__ = ('first', 'second')
+
+    def __init__(self, first, second):
+        self.first = first
+        self.second = second
+
+    def __enter__(self):
+        self.first.acquire()
+        self.second.acquire()
+        return self
+
+    def __exit__(self, *args):
+        self.second.release()
+        self.first.release()
+
+class LockStripes(object):
+    ''' a fixed number of reentrant locks that hashes are spread over '''
+    __slots__ = ('locks',)
+
+    def __init__(self, stripes=64):
+        assert isinstance(stripes, int) and stripes > 0, stripes  # stripes needs to be a positive int
+        self.locks = tuple(RLock() for _ in range(stripes))
+
+    def __call__(self, *hashes):
+        ''' returns a context manager holding the stripes of hashes '''
+        locks = self.locks
+        if len(hashes) == 1:
+            # a lock is its own context manager
+            return locks[hashes[0] % len(locks)]
+        if len(hashes) == 2:
+            return self.pair(*hashes)
+        return HeldStripes([locks[i] for i in sorted({h % len(locks) for h in hashes})])
+
+    def pair(self, a, b):
+        ''' returns a context manager holding the stripes of hashes a and b '''
+        locks = self.locks
+        a, b = a % len(locks), b % len(locks)
+        if a == b:
+            return locks[a]
+        return HeldPair(locks[a], locks[b]) if a < b else HeldPair(locks[b], locks[a])
+
+    def all(self):
+        ''' returns a context manager holding every stripe '''
+        return HeldStripes(self.locks)
@@ -0,0 +1,304 @@
+''' durable storage for RamGraphDB. every write is appended to an operation
+    log and the whole graph is periodically compacted into a snapshot so
+    startup only loads the newest snapshot and replays the log after it.
+
+    a database directory holds snapshot-<n>.bin and log-<n>.bin where the
+    log holds the writes made after snapshot n.
+
+    objects that can't be hashed are keyed by identity, so two records
+    holding equal lists still mean the same node only if they share a ref.
+    the first record of such an object holds its value and every later
+    one a ref number. objects loaded from a snapshot have the ref of their
+    index in it and refs made by the log after it count on from there. '''
+
+from functools import wraps
+from os import fsync, listdir, makedirs, remove, replace, open as os_open, close as os_close, O_RDONLY
+from os.path import join, isfile
+from struct import pack, unpack
+from threading import Lock, Timer
+from time import monotonic
+from zlib import crc32
+import re
+
+from ..serializers import tagged_dumps, tagged_loads, varint, read_varint
+
+__all__ = ['Persistence', 'logged']
+
+snapshot_magic = b'graphdb-ram-snapshot\x01'
+
+# operation name: code stored in the log
+operations = {
+    'store_item': 0,
+    'store_relation': 1,
+    'delete_relation': 2,
+    'delete_item': 3,
+    'replace_item': 4
+}
+operation_names = {v: k for k, v in operations.items()}
+
+# code of records that are (refs_code, operation code, ((arg index, ref), ...), *args)
+refs_code = 5
+
+file_pattern = re.compile(r'^(snapshot|log)-(\d+)\.bin$')
+
+def logged(method):
+    ''' records a call to a write method of RamGraphDB in its operation log.
+        writes made by other logged methods are part of the outer call and
+        are not logged again. '''
+    operation = method.__name__
+    assert operation in operations, operation
+    @wraps(method)
+    def wrapper(self, *args):
+        if self._persistence is None:
+            return method(self, *args)
+        with self._write_lock:
+            self._log_depth += 1
+            try:
+                out = method(self, *args)
+            finally:
+                self._log_depth -= 1
+            if not self._log_depth:
+                self._persistence.append(operation, args)
+                self._persistence.sync(self)
+            return out
+    return wrapper
+
+def keyed_by_identity(obj):
+    ''' true if RamGraphDB keys obj by id() instead of its value '''
+    try:
+        hash(obj)
+        return False
+    except Exception:
+        return True
+
+def _fsync_dir(path):
+    ''' makes renames in path durable '''
+    fd = os_open(path, O_RDONLY)
+    try:
+        fsync(fd)
+    finally:
+        os_close(fd)
+
+def write_snapshot(db, f):
+    ''' writes every node and relation of db to f as varint framed
+        tagged objects followed by (src, relation, dst) varint triples.
+        returns the nodes in the order they were written. '''
+    nodes = list(db.iter_nodes())
+    index = {id(node): i for i, node in enumerate(nodes)}
+    f.write(snapshot_magic)
+    f.write(varint(len(nodes)))
+    for node in nodes:
+        code = tagged_dumps(node.obj)
+        f.write(varint(len(code)))
+        f.write(code)
+    names = {}
+    edges = []
+    for i, node in enumerate(nodes):
+        for name, target in node.outgoing.links():
+            if id(target) in index:
+                edges.append((i, names.setdefault(name, len(names)), index[id(target)]))
+    f.write(varint(len(names)))
+    for name in names:
+        code = name.encode('utf-8')
+        f.write(varint(len(code)))
+        f.write(code)
+    f.write(varint(len(edges)))
+    f.write(b''.join(varint(i) for edge in edges for i in edge))
+    return nodes
+
+def read_snapshot(db, data, node_type):
+    ''' loads a snapshot written by write_snapshot into an empty db and
+        returns its nodes in the order they were written '''
+    assert data.startswith(snapshot_magic), 'not a RamGraphDB snapshot'
+    i = len(snapshot_magic)
+    count, i = read_varint(data, i)
+    nodes = []
+    for _ in range(count):
+        size, i = read_varint(data, i)
+        node = node_type(tagged_loads(data[i:i+size]))
+        db.nodes[node._hash] = node
+        nodes.append(node)
+        i += size
+    count, i = read_varint(data, i)
+    names = []
+    for _ in range(count):
+        size, i = read_varint(data, i)
+        names.append(data[i:i+size].decode('utf-8'))
+        i += size
+    count, i = read_varint(data, i)
+    for _ in range(count):
+        src, i = read_varint(data, i)
+        name, i = read_varint(data, i)
+        dst, i = read_varint(data, i)
+        db._link(nodes[src], names[name], nodes[dst])
+    return nodes
+
+class Persistence(object):
+    ''' owns the snapshot and log files of one RamGraphDB directory.
+        fsync is the most seconds written operations can go without being
+        fsynced, 0 fsyncs every write and None leaves it to the os. the log
+        is compacted into a new snapshot every snapshot_every operations.
+        writes that are not fsynced right away are fsynced by a timer once
+        fsync seconds have passed since the last fsync. '''
+
+    def __init__(self, path, fsync=1.0, snapshot_every=1000000):
+        assert isinstance(path, str), path  # path needs to be a string
+        assert fsync is None or (isinstance(fsync, (int, float)) and fsync >= 0), fsync  # fsync needs to be None or a non negative number of seconds
+        assert snapshot_every is None or (isinstance(snapshot_every, int) and snapshot_every > 0), snapshot_every  # snapshot_every needs to be None or a positive int
+        makedirs(path, exist_ok=True)
+        self.path = path
+        self.fsync = fsync
+        self.snapshot_every = snapshot_every
+        self.ops = 0 # operations in the log since the last snapshot
+        self._log = None
+        self._synced = monotonic()
+        self._timer = None # fsyncs writes left unsynced by sync
+        self._lock = Lock() # held while fsyncing or swapping the log
+        self._refs = {} # id of an object keyed by identity: (ref, object)
+        self._next_ref = 0
+        self.seq = max((n for kind, n in self._files() if kind == 'snapshot'), default=0)
+
+    def _files(self):
+        for name in listdir(self.path):
+            match = file_pattern.match(name)
+            if match:
+                yield match.group(1), int(match.group(2))
+
+    def _file(self, kind, seq):
+        return join(self.path, '{}-{}.bin'.format(kind, seq))
+
+    def load(self, db, node_type):
+        ''' loads the newest snapshot into db, replays the log after it and
+            opens the log for appending '''
+        snapshot = self._file('snapshot', self.seq)
+        nodes = []
+        if isfile(snapshot):
+            with open(snapshot, 'rb') as f:
+                nodes = read_snapshot(db, f.read(), node_type)
+        # ref: the object it was loaded as
+        refs = {i: node.obj for i, node in enumerate(nodes) if keyed_by_identity(node.obj)}
+        self._next_ref = len(nodes)
+        log = self._file('log', self.seq)
+        end = 0
+        if isfile(log):
+            with open(log, 'rb') as f:
+                data = f.read()
+            for operation, args, arg_refs, end in self._records(data):
+                if arg_refs:
+                    args = list(args)
+                    for i, ref in arg_refs:
+                        if ref in refs:
+                            args[i] = refs[ref]
+                        else:
+                            refs[ref] = args[i]
+                            self._next_ref = max(self._next_ref, ref + 1)
+                getattr(db, operation)(*args)
+                self.ops += 1
+            if end < len(data):
+                # drop a record that was torn by a crash
+                with open(log, 'r+b') as f:
+                    f.truncate(end)
+        self._refs = {id(obj): (ref, obj) for ref, obj in refs.items()}
+        self._log = open(log, 'ab')
+        self._remove_older(self.seq)
+
+    @staticmethod
+    def _records(data):
+        ''' generates the (operation, args, ((arg index, ref), ...), end
+            offset) of every complete record in data '''
+        i = 0
+        while i + 8 <= len(data):
+            size, checksum = unpack('>II', data[i:i+8])
+            payload = data[i+8:i+8+size]
+            if len(payload) < size or crc32(payload) != checksum:
+                return
+            record = tagged_loads(payload)
+            i += 8 + size
+            if record[0] == refs_code:
+                yield operation_names[record[1]], record[3:], record[2], i
+            else:
+                yield operation_names[record[0]], record[1:], (), i
+
+    def append(self, operation, args):
+        args = tuple(args)
+        arg_refs = []
+        for i, arg in enumerate(args):
+            if keyed_by_identity(arg):
+                ref = self._refs.get(id(arg))
+                if ref is None:
+                    # holding the object keeps its id from being reused
+                    self._refs[id(arg)] = self._next_ref, arg
+                    arg_refs.append((i, self._next_ref))
+                    self._next_ref += 1
+                else:
+                    arg_refs.append((i, ref[0]))
+                    args = args[:i] + (None,) + args[i+1:]
+        if arg_refs:
+            record = (refs_code, operations[operation], tuple(arg_refs)) + args
+        else:
+            record = (operations[operation],) + args
+        payload = tagged_dumps(record)
+        self._log.write(pack('>II', len(payload), crc32(payload)))
+        self._log.write(payload)
+        self.ops += 1
+
+    def sync(self, db):
+        ''' hands written records to the os, fsyncs them as the fsync policy
+            asks and compacts the log once it is long enough '''
+        self._log.flush()
+        if self.fsync is not None:
+            waited = monotonic() - self._synced
+            if waited >= self.fsync:
+                self._fsync()
+            elif self._timer is None:
+                self._timer = Timer(self.fsync - waited, self._fsync)
+                self._timer.daemon = True
+                self._timer.start()
+        if self.snapshot_every is not None and self.ops >= self.snapshot_every:
+            self.snapshot(db)
+
+    def _fsync(self):
+        ''' fsyncs everything flushed to the log so far '''
+        with self._lock:
+            if self._timer is not None:
+                self._timer.cancel()
+                self._timer = None
+            if self._log is not None and not self._log.closed:
+                fsync(self._log.fileno())
+            self._synced = monotonic()
+
+    def snapshot(self, db):
+        ''' writes db to a new snapshot and starts a new empty log after it '''
+        seq = self.seq + 1
+        path = self._file('snapshot', seq)
+        with open(path + '.tmp', 'wb') as f:
+            nodes = write_snapshot(db, f)
+            f.flush()
+            fsync(f.fileno())
+        replace(path + '.tmp', path)
+        with self._lock:
+            self._log.close()
+            self._log = open(self._file('log', seq), 'ab')
+        _fsync_dir(self.path)
+        self.seq, self.ops = seq, 0
+        self._refs = {id(node.obj): (i, node.obj) for i, node in enumerate(nodes) if keyed_by_identity(node.obj)}
+        self._next_ref = len(nodes)
+        self._remove_older(seq)
+
+    def _remove_older(self, seq):
+        for kind, n in list(self._files()):
+            if n < seq:
+                remove(self._file(kind, n))
+
+    def close(self):
+        if self._log is not None and not self._log.closed:
+            self._log.flush()
+            self._fsync()
+            with self._lock:
+                self._log.close()
+
+    def destroy(self):
+        ''' closes and removes every file this owns '''
+        self.close()
+        for kind, n in list(self._files()):
+            remove(self._file(kind, n))
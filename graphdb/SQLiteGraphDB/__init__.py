@@ -1,32 +1,59 @@
 from __future__ import print_function, unicode_literals
 del print_function
-from base64 import b64encode as b64e, b64decode as b64d
 import generators as gen
 from generators.inline_tools import attempt
 from strict_functions import overload
 import hashlib
-import dill
 import sqlite3
+from struct import unpack
 from os import remove
 from os.path import isfile
+from contextlib import contextmanager
+from functools import wraps
+from collections import OrderedDict, namedtuple
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor, wait, FIRST_COMPLETED
+import sys
+
+from ..serializers import serializers, default_serializer
+from ..search import relation_names, bidirectional_path, equivalent_values
+from ..stats import instrument
 
 ''' sqlite based graph database for storing native python objects and their relationships to each other '''
 
 __todo__ = '''
-- have different relations stored in generated
-  tables produced from the hash of the relation
-  so lookup times arent as affected by scale
 - set up a view between objects and relations
 - add type enforcement to match relationships with attributes
 '''
 
+# bump this whenever startup_sql changes shape and add a matching
+# SQLiteGraphDB._migrate_to_<version> method to upgrade existing files
+schema_version = 1
+
+# objects the tagged serializer dilled since they are not a builtin type
+dilled_sql = "substr(code, 1, 1) = x'64'"
+
 startup_sql='''
 CREATE TABLE if not exists objects (
     id integer primary key autoincrement,
     code text not null,
-    unique(code) on conflict ignore
+    digest integer not null
 );
 ''','''
+CREATE INDEX if not exists objects_digest on objects(digest);
+''','''
+CREATE INDEX if not exists objects_dilled on objects(id) where {};
+'''.format(dilled_sql),'''
+CREATE TABLE if not exists graphdb_meta (
+    key text primary key,
+    value
+);
+'''
+
+# the tables each storage layout keeps relations in. both layouts expose
+# every relation through a "relations" table or view of (src, name, dst)
+layout_sql = {
+    # every relation in one table
+    'single': ('''
 CREATE TABLE if not exists relations (
     src int not null,
     name text not null,
@@ -35,143 +62,623 @@ CREATE TABLE if not exists relations (
     foreign key(src) references objects(id),
     foreign key(dst) references objects(id)
 );
-'''
+''','''
+CREATE INDEX if not exists relations_dst on relations(dst, name, src);
+''','''
+CREATE INDEX if not exists relations_name on relations(name, src);
+'''),
+    # each relation name in its own generated table of (src, dst) so
+    # lookups only pay for the size of the relation they are looking at.
+    # the relations view is rebuilt whenever a table is added.
+    'partitioned': ('''
+CREATE TABLE if not exists relation_tables (
+    name text primary key,
+    tbl text not null unique
+);
+''',)
+}
 
+# what _relations_named returns for a partitioned name without a table
+no_relations_sql = '(select 0 as src, 0 as dst where 0)'
 
-from threading import Lock, Semaphore
+partition_sql = '''
+CREATE TABLE if not exists {0} (
+    src int not null,
+    dst int not null,
+    unique(src, dst) on conflict ignore,
+    foreign key(src) references objects(id),
+    foreign key(dst) references objects(id)
+);
+''','''
+CREATE INDEX if not exists {0}_dst on {0}(dst, src);
+'''
 
-class read_write_state_machine(object):
-    READ=0
-    WRITE=1
 
-    def __init__(self, readers=4, writers=1):
-        self._state = self.WRITE
-        self.readers = readers
-        self.writers = writers
-        self.state_setter_lock = Lock()
-        self.states = {
-            self.READ: Semaphore(readers),
-            self.WRITE: Semaphore(writers)
-        }
-        self.state = self.READ
+from threading import Lock, RLock, Semaphore, get_ident
 
-    @property
-    def state_lock(self):
-        return self.states[self._state]
-
-    def acquire_current_locks(self):
-        needed = self.writers if self._state else self.readers
-        collected = 0
-        #print(self.state_lock.__dict__)
-        while collected < needed:
-            self.state_lock.acquire()
-            collected+=1
-
-    def release_current_state(self):
-        needed = self.writers if self._state else self.readers
-        for i in range(needed):
-            self.state_lock.release()
-    @property
-    def state(self):
-        return self._state
-
-    @state.setter
-    def state(self, new_state):
-        if new_state != self._state:
-            try: # check if state is being changed
-                self.state_setter_lock.acquire(blocking=False)
-            except:
-                # just wait for the change
-                with self.states[new_state]:
-                    pass
-            else:
-                if new_state != self._state:
-                    #print('switching to write' if new_state else 'switching to read')
-                    self.acquire_current_locks()
-                    self._state = new_state
-                    self.release_current_state()
-                    #print('switched to write' if self._state else 'switched to read')
-    @property
-    def read(self):
-        self.state=self.READ
-        return self.states[self.READ]
+class WriteLock(object):
+    ''' reentrant lock that knows which thread is holding it '''
+
+    def __init__(self):
+        self._lock = RLock()
+        self._depth = 0
+        self.owner = None
 
     @property
-    def write(self):
-        self.state=self.WRITE
-        return self.states[self.WRITE]
-
-class better_default_dict(dict):
-    def __init__(self, constructor):
-        if not callable(constructor):
-            constructor = lambda:constructor
-        self._constructor = constructor
-
-    def __getitem__(self, target):
-        if target in self:
-            return dict.__getitem__(self, target)
-        else:
-            dict.__setitem__(self, target, self._constructor())
-            return dict.__getitem__(self, target)
+    def owned(self):
+        ''' true if the current thread is holding the lock '''
+        return self.owner == get_ident()
+
+    def __enter__(self):
+        self._lock.acquire()
+        self.owner = get_ident()
+        self._depth += 1
+        return self
+
+    def __exit__(self, *args):
+        self._depth -= 1
+        if not self._depth:
+            self.owner = None
+        self._lock.release()
+
+class ConnectionPool(object):
+    ''' bounded pool of reader connections. a thread leases one connection
+        for as long as it has a query running and reuses it for nested
+        queries, so finished or exited threads never keep a connection. '''
+
+    def __init__(self, connect, size=4):
+        assert isinstance(size, int) and size > 0, size  # size needs to be a positive int
+        self._connect = connect
+        self._slots = Semaphore(size)
+        self._lock = Lock()
+        self._idle = []
+        self._leases = {} # thread ident: [connection, active queries]
+        self.connections = []
+
+    @contextmanager
+    def lease(self):
+        ident = get_ident()
+        lease = self._leases.get(ident)
+        if lease is None:
+            self._slots.acquire()
+            with self._lock:
+                if self._idle:
+                    conn = self._idle.pop()
+                else:
+                    conn = self._connect()
+                    self.connections.append(conn)
+            lease = self._leases[ident] = [conn, 0]
+        lease[1] += 1
+        try:
+            yield lease[0]
+        finally:
+            lease[1] -= 1
+            if not lease[1]:
+                del self._leases[ident]
+                with self._lock:
+                    self._idle.append(lease[0])
+                self._slots.release()
 
-from threading import current_thread
+    def close(self):
+        with self._lock:
+            for conn in self.connections:
+                conn.close()
+            del self.connections[:], self._idle[:]
+
+primitive_types = {type(None), bool, int, str, bytes}
+
+def value_key(obj):
+    ''' returns a hashable key that only equals the key of objects that
+        serialize identically, or None if obj cant safely be keyed by value '''
+    obj_type = type(obj)
+    if obj_type in primitive_types:
+        return obj_type, obj
+    elif obj_type is float:
+        return obj_type, obj.hex() # keeps 0.0 and -0.0 apart
+    elif obj_type is tuple:
+        keys = tuple(value_key(i) for i in obj)
+        if all(i is not None for i in keys):
+            return obj_type, keys
+
+def memo_key(obj):
+    ''' keys obj by value when that is safe and by identity otherwise '''
+    key = value_key(obj)
+    return id(obj) if key is None else key
+
+def _loads_chunk(serializer, codes):
+    ''' deserializes a chunk of codes in a scan worker. equal codes in the
+        chunk are only deserialized once unless they hold mutable objects. '''
+    loads = serializers[serializer].loads
+    loaded = {}
+    out = []
+    for code in codes:
+        obj = loaded.get(code, loaded)
+        if obj is loaded:
+            obj = loads(code)
+            if value_key(obj) is not None:
+                loaded[code] = obj
+        out.append(obj)
+    return out
+
+def _scan_pool(workers):
+    ''' returns an executor that deserializes in parallel. builds without
+        a gil can use threads, everything else needs processes. '''
+    if getattr(sys, '_is_gil_enabled', lambda: True)():
+        return ProcessPoolExecutor(workers)
+    return ThreadPoolExecutor(workers)
+
+CacheInfo = namedtuple('CacheInfo', ('hits', 'misses', 'maxsize', 'currsize'))
+
+class ObjectCache(object):
+    ''' thread safe LRU cache mapping the value_key of an object to a
+        [(digest, code), id] entry. the id is None until it is known. '''
+
+    def __init__(self, size=4096):
+        assert isinstance(size, int) and size >= 0, size  # size needs to be a non negative int
+        self.size = size
+        self.hits = 0
+        self.misses = 0
+        # bumped whenever ids are forgotten so queries that started
+        # before a delete cant put the id they found back in the cache
+        self.generation = 0
+        self._entries = OrderedDict()
+        self._lock = Lock()
+
+    def get(self, key):
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                self.misses += 1
+            else:
+                self._entries.move_to_end(key)
+                self.hits += 1
+            return entry
+
+    def put(self, key, entry):
+        ''' adds entry unless key is already cached and returns the cached entry '''
+        if not self.size:
+            return entry
+        with self._lock:
+            entry = self._entries.setdefault(key, entry)
+            while len(self._entries) > self.size:
+                self._entries.popitem(last=False)
+            return entry
+
+    def set_id(self, key, id, generation):
+        ''' caches the id of key if nothing was forgotten since generation '''
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None and generation == self.generation:
+                entry[1] = id
+
+    def forget_id(self, key):
+        with self._lock:
+            self.generation += 1
+            entry = self._entries.get(key)
+            if entry is not None:
+                entry[1] = None
+
+    def clear(self):
+        with self._lock:
+            self.generation += 1
+            self._entries.clear()
+
+    def info(self):
+        return CacheInfo(self.hits, self.misses, self.size, len(self._entries))
 
 class SQLiteGraphDB(object):
     ''' sqlite based graph database for storing native python objects and their relationships to each other '''
 
-    def __init__(self, path=':memory:', autostore=True, autocommit=True):
+    # applied to every connection of a file database
+    file_pragmas = (
+        'PRAGMA synchronous=NORMAL;', # safe with WAL, only checkpoints fsync
+        'PRAGMA mmap_size=268435456;', # 256MB
+        'PRAGMA cache_size=-65536;' # 64MB
+    )
+
+    # what instrument() times. see graphdb.stats
+    instrumented_operations = (
+        'store_item', 'store_items', 'store_relation', 'store_relations',
+        'delete_item', 'delete_relation', 'replace_item', 'find',
+        'relations_of', 'relations_to', 'list_objects', 'list_relations',
+        'bfs', 'neighbourhood', 'shortest_path', 'count_objects',
+        'count_relations', 'out_degree', 'in_degree', '_traverse'
+    )
+    instrumented_serializers = ('serialize', 'deserialize')
+    instrumented_statements = ('_execute', '_executemany', '_query', '_query_one')
+
+    def __init__(self, path=':memory:', autostore=True, autocommit=True, readers=4, layout=None, cache_size=4096, serializer=None):
         assert isinstance(autostore, bool), autostore  # autostore needs to be a boolean
         assert isinstance(autocommit, bool), autocommit  # autocommit needs to be a boolean
+        assert layout is None or layout in layout_sql, layout  # layout needs to be one of layout_sql
+        assert serializer is None or serializer in serializers, serializer  # serializer needs to be registered in graphdb.serializers
         if path != ':memory:':
             self._create_file(path)
-        self._state = read_write_state_machine()
         self._autostore = autostore
         self._autocommit = autocommit
         self._path = path
-        self._connections = better_default_dict(lambda s=self:sqlite3.connect(s._path))
-        self._cursors = better_default_dict(lambda s=self:s.conn.cursor())
-        self._write_lock = Lock()
+        self._write_lock = WriteLock()
+        self._instrumentation = None
+        self._transaction_depth = 0
+        self._traces = {} # thread ident: [(sql, params)] collected by explain
+        # objects that can be keyed by value remember what they serialize
+        # to and their id. ids found or changed by uncommitted writes are
+        # kept in _new_ids (None for forgotten ids) until they commit.
+        self._cache = ObjectCache(cache_size)
+        self._new_ids = {}
+        # PRAGMA data_version of the writer when cached ids were last
+        # checked. it changes when another connection commits to the file
+        self._data_version = None
+        # all writes go through one connection. file databases run in WAL
+        # mode so a pool of reader connections can query while it writes.
+        # in memory databases only exist inside the connection that made
+        # them, so they read through the writer as well.
+        self._writer = self._connect()
+        self._readers = None if path == ':memory:' else ConnectionPool(self._connect_reader, readers)
         with self._write_lock:
+            if path != ':memory:':
+                self._execute('PRAGMA journal_mode=WAL;')
+            self._writer.create_function('graphdb_digest', 1, self.digest)
+            self._migrate()
             for i in startup_sql:
                 self._execute(i)
+            self._execute('PRAGMA user_version={}'.format(schema_version))
+            self._partitions = {} # relation name: committed table name
+            self._new_partitions = {} # relation name: uncommitted table name
+            self._layout = self._meta('layout', 'single')
+            for i in layout_sql[self._layout]:
+                self._execute(i)
+            if self._layout == 'partitioned':
+                self._load_partitions()
+            if layout is not None and layout != self._layout:
+                self._convert_layout(layout)
+            # files written before the marker existed hold base64 dill
+            self._serializer_name = self._meta('serializer') or (
+                'base64-dill' if self._query_one('select 1 from objects limit 1') else default_serializer
+            )
+            self._serializer = serializers[self._serializer_name]
+            self._set_meta('serializer', self._serializer_name)
+            if serializer is not None and serializer != self._serializer_name:
+                self._convert_serializer(serializer)
             self.commit()
 
+    def _connect(self, **kwargs):
+        conn = sqlite3.connect(self._path, check_same_thread=False, **kwargs)
+        if self._path != ':memory:':
+            for pragma in self.file_pragmas:
+                conn.execute(pragma)
+        return conn
+
+    def _connect_reader(self):
+        conn = self._connect(isolation_level=None)
+        conn.execute('PRAGMA query_only=1;')
+        return conn
+
+    def _migrate(self):
+        ''' upgrades the tables of an existing database file to the current schema_version '''
+        if not self._query_one("select count(*) from sqlite_master where type='table' and name='objects'")[0]:
+            return # fresh database, startup_sql builds the current schema
+        for version in range(self._query_one('PRAGMA user_version')[0] + 1, schema_version + 1):
+            getattr(self, '_migrate_to_{}'.format(version))()
+
+    def _migrate_to_1(self):
+        ''' rebuilds objects with a digest column and without the unique index over code '''
+        self._execute('''
+            CREATE TABLE objects_migration (
+                id integer primary key autoincrement,
+                code text not null,
+                digest integer not null
+            );
+        ''')
+        self._execute('''
+            INSERT into objects_migration (id, code, digest)
+                select id, code, graphdb_digest(code) from objects;
+        ''')
+        self._execute('DROP TABLE objects;')
+        self._execute('ALTER TABLE objects_migration RENAME TO objects;')
+
+    def _meta(self, key, default=None):
+        ''' reads a setting stored in the database file '''
+        row = self._query_one('select value from graphdb_meta where key=?', (key,))
+        return default if row is None else row[0]
+
+    def _set_meta(self, key, value):
+        self._execute('INSERT or REPLACE into graphdb_meta (key, value) values (?, ?);', (key, value))
+
+    @property
+    def layout(self):
+        ''' the storage layout of the relations, either single or partitioned '''
+        return self._layout
+
+    @staticmethod
+    def _partition_name(name):
+        ''' generates the table name that stores the relations named name '''
+        return 'relations_' + hashlib.sha256(name.encode('utf-8')).hexdigest()[:16]
+
+    def _load_partitions(self):
+        self._partitions = dict(self._query('select name, tbl from relation_tables'))
+
+    def _create_partition(self, name):
+        ''' creates the table for a new relation name and adds it to the relations view '''
+        tbl = self._partition_name(name)
+        for i in partition_sql:
+            self._execute(i.format(tbl))
+        self._execute('INSERT or IGNORE into relation_tables (name, tbl) values (?, ?);', (name, tbl))
+        # readers cant see the table until it is committed
+        self._new_partitions[name] = tbl
+        self._create_relations_view()
+        return tbl
+
+    def _create_relations_view(self):
+        ''' rebuilds the relations view as a union of every partition '''
+        selects = [
+            "select src, (select name from relation_tables where tbl='{0}') as name, dst from {0}".format(i[0])
+            for i in self._execute('select tbl from relation_tables order by tbl').fetchall()
+        ] or ["select 0 as src, '' as name, 0 as dst where 0"]
+        # sqlite limits how many selects fit in one compound select
+        selects = [
+            'select * from ({})'.format(' union all '.join(selects[i:i+256]))
+            for i in range(0, len(selects), 256)
+        ]
+        self._execute('DROP VIEW if exists relations;')
+        self._execute('CREATE VIEW relations as {};'.format(' union all '.join(selects)))
+
+    def _convert_layout(self, layout):
+        ''' moves every relation into the tables of another layout '''
+        if layout == 'partitioned':
+            for i in layout_sql[layout]:
+                self._execute(i)
+            for name in [i[0] for i in self._query('select distinct name from relations')]:
+                tbl = self._partition_name(name)
+                for i in partition_sql:
+                    self._execute(i.format(tbl))
+                self._execute('INSERT into relation_tables (name, tbl) values (?, ?);', (name, tbl))
+                self._execute('INSERT into {} (src, dst) select src, dst from relations where name=?;'.format(tbl), (name,))
+            self._execute('DROP TABLE relations;')
+            self._create_relations_view()
+        else:
+            self._execute('CREATE TABLE relations_conversion as select src, name, dst from relations;')
+            self._execute('DROP VIEW relations;')
+            for i in self._execute('select tbl from relation_tables').fetchall():
+                self._execute('DROP TABLE {};'.format(i[0]))
+            self._execute('DROP TABLE relation_tables;')
+            for i in layout_sql[layout]:
+                self._execute(i)
+            self._execute('INSERT into relations (src, name, dst) select src, name, dst from relations_conversion;')
+            self._execute('DROP TABLE relations_conversion;')
+        self._partitions = {}
+        self._layout = layout
+        self._set_meta('layout', layout)
+
+    @property
+    def serializer(self):
+        ''' the name of the serializer objects are stored with '''
+        return self._serializer_name
+
+    def _convert_serializer(self, name):
+        ''' re-encodes every object with another serializer '''
+        old, new = self._serializer, serializers[name]
+        last_id = -1
+        while True:
+            rows = self._execute('select id, code from objects where id>? order by id limit 4096', (last_id,)).fetchall()
+            if not rows:
+                break
+            last_id = rows[-1][0]
+            codes = ((_id, new.dumps(old.loads(code))) for _id, code in rows)
+            self._executemany(
+                'UPDATE objects set code=?, digest=? where id=?;',
+                ((code, self.digest(code), _id) for _id, code in codes)
+            )
+        self._cache.clear()
+        self._serializer_name, self._serializer = name, new
+        self._set_meta('serializer', name)
+
+    def _relations_named(self, name, create=False, param='relation'):
+        ''' returns a sql table or subquery with the (src, dst) columns of
+            every relation named name. queries using it pass the name as
+            the :relation parameter, or whatever param is set to. '''
+        if self._layout == 'single':
+            return '(select src, dst from relations where name=:{})'.format(param)
+        writing = self._reads_through_writer()
+        tbl = self._partitions.get(name) or (writing and self._new_partitions.get(name))
+        if not tbl:
+            # the table could have been made by another connection
+            row = self._query_one('select tbl from relation_tables where name=?', (name,))
+            if row is not None:
+                tbl = row[0]
+                if not writing:
+                    self._partitions[name] = tbl
+            elif create:
+                tbl = self._create_partition(name)
+            else:
+                return no_relations_sql
+        return tbl
+
+    def _insert_relations_sql(self, name, select):
+        ''' returns a statement inserting the (src, dst) rows of select as relations named name '''
+        if self._layout == 'single':
+            return 'INSERT into relations (src, name, dst) select src, :relation, dst from ({});'.format(select)
+        return 'INSERT into {} (src, dst) {};'.format(self._relations_named(name, create=True), select)
+
+    def _delete_relations_sql(self, name, where):
+        ''' returns a statement deleting the relations named name that match
+            where or None if there can't be any relations named name '''
+        if self._layout == 'single':
+            return 'DELETE from relations where name=:relation and {};'.format(where)
+        tbl = self._relations_named(name)
+        if tbl == no_relations_sql:
+            return None
+        return 'DELETE from {} where {};'.format(tbl, where)
+
     def close(self):
-        for con in self._connections.values():
-            con.close()
+        if self._readers is not None:
+            self._readers.close()
+        self._writer.close()
 
     def _destroy(self):
         self.close()
-        if self._path != ':memory:' and isfile(self._path):
-            remove(self._path)
+        if self._path != ':memory:':
+            for path in (self._path, self._path+'-wal', self._path+'-shm'):
+                if isfile(path):
+                    remove(path)
         self.__dict__.clear()
         del self
 
-    def _fetchone(self):
-        return self._cursor.fetchone()
-
-    def _fetchall(self):
-        return self._cursor.fetchall()
+    def _trace(self, args):
+        ''' records statements for explain '''
+        trace = self._traces.get(get_ident())
+        if trace is not None:
+            trace.append(args)
 
     def _execute(self, *args):
-        return self._cursor.execute(*args)
-
-    @property
-    def _cursor(self):
-        return self._cursors[current_thread()]
+        ''' runs a statement on the writer connection '''
+        self._trace(args)
+        return self._writer.execute(*args)
+
+    def _executemany(self, *args):
+        ''' runs a statement for each set of parameters on the writer connection '''
+        return self._writer.executemany(*args)
+
+    def _reads_through_writer(self):
+        ''' true if this thread is writing or could see uncommitted writes '''
+        return self._readers is None or self._write_lock.owned or (not self._autocommit and self._writer.in_transaction)
+
+    @contextmanager
+    def _read_connection(self):
+        ''' provides the connection this thread should read from. threads
+            that are writing, or any thread while autocommit is off and
+            writes are pending, read through the writer. everyone else
+            leases a reader from the pool. '''
+        if self._reads_through_writer():
+            yield self._writer
+        else:
+            with self._readers.lease() as conn:
+                yield conn
+
+    def _query(self, *args):
+        ''' streams the rows of a read query from its own cursor '''
+        self._trace(args)
+        with self._read_connection() as conn:
+            cursor = conn.execute(*args)
+            try:
+                rows = cursor.fetchmany(256)
+                while rows:
+                    for row in rows:
+                        yield row
+                    rows = cursor.fetchmany(256)
+            finally:
+                cursor.close()
+
+    def _query_one(self, *args):
+        ''' returns the first row of a read query or None '''
+        self._trace(args)
+        with self._read_connection() as conn:
+            return conn.execute(*args).fetchone()
+
+    def explain(self, query_method, *args):
+        ''' returns the sqlite query plan of every statement query_method
+            runs when called with args as a list of (sql, [plan details]).
+            query_method can also be a sql string to explain directly. '''
+        if isinstance(query_method, str):
+            statements = [(query_method, args)]
+        else:
+            ident = get_ident()
+            self._traces[ident] = statements = []
+            try:
+                out = query_method(*args)
+                if hasattr(out, '__next__'):
+                    for _ in out:
+                        pass
+            finally:
+                del self._traces[ident]
+        return [
+            (sql, [row[-1] for row in self._query('EXPLAIN QUERY PLAN ' + sql, params[0] if params else ())])
+            for sql, *params in statements
+        ]
 
     def commit(self):
-        self.conn.commit()
+        self._writer.commit()
+        if self._new_partitions:
+            self._partitions.update(self._new_partitions)
+            self._new_partitions.clear()
+        if self._new_ids:
+            for key, _id in self._new_ids.items():
+                if _id is None:
+                    self._cache.forget_id(key)
+                else:
+                    self._cache.set_id(key, _id, self._cache.generation)
+            self._new_ids.clear()
+
+    def _rolled_back(self):
+        ''' forgets everything cached about uncommitted writes '''
+        self._new_partitions.clear()
+        # deletes before a rolled back savepoint still need to be
+        # forgotten when the rest of the transaction commits
+        self._new_ids = {k:v for k,v in self._new_ids.items() if v is None}
+
+    def instrument(self, enabled=True, slow_query_seconds=None, hook=None):
+        ''' starts recording how long every public method, the traversals
+            behind V and VList, serializing, deserializing, running each
+            statement and waiting for the write lock take, replacing
+            anything recorded before. statements that take at least
+            slow_query_seconds are kept and logged as slow queries. hook is
+            called with the (kind, name, seconds) of each recording.
+            instrument(False) stops recording and takes every wrapper off
+            again. returns the Instrumentation. '''
+        return instrument(self, enabled, slow_query_seconds, hook)
+
+    def stats(self):
+        ''' returns what instrument() has recorded or None if it is off '''
+        return None if self._instrumentation is None else self._instrumentation.stats()
+
+    def cache_info(self):
+        ''' returns the hits, misses, maxsize and currsize of the object cache '''
+        return self._cache.info()
 
     @property
     def conn(self):
-        ''' return the connection for this thread '''
-        return self._connections[hash(current_thread())]
+        ''' return the connection writes go through '''
+        return self._writer
 
     def autocommit(self):
-        if self._autocommit:
+        if self._autocommit and not self._transaction_depth:
             self.commit()
 
+    @contextmanager
+    def transaction(self):
+        ''' groups every write in the with block into one sqlite transaction
+            that commits on exit and rolls back if an exception is raised.
+            nested transactions are scoped with savepoints. '''
+        with self._write_lock:
+            depth = self._transaction_depth
+            # without autocommit, writes before the block can have left a
+            # transaction open that only the block should be rolled back in
+            savepoint = None
+            if depth or self.conn.in_transaction:
+                savepoint = 'graphdb_transaction_{}'.format(depth)
+                self._execute('SAVEPOINT {};'.format(savepoint))
+            else:
+                # begin explicitly so savepoints never open their own transaction
+                self._execute('BEGIN;')
+            self._transaction_depth += 1
+            try:
+                yield self
+            except:
+                if savepoint:
+                    self._execute('ROLLBACK TO {};'.format(savepoint))
+                    self._execute('RELEASE {};'.format(savepoint))
+                else:
+                    self.conn.rollback()
+                self._rolled_back()
+                raise
+            else:
+                if savepoint:
+                    self._execute('RELEASE {};'.format(savepoint))
+                if not depth:
+                    self.commit()
+            finally:
+                self._transaction_depth -= 1
+
     @staticmethod
     def _create_file(path=''):
         ''' creates a file at the given path and sets the permissions to user only read/write '''
@@ -183,44 +690,174 @@ class SQLiteGraphDB(object):
             open(path, "a").close()  # create the file
             attempt(lambda: chmod(path, (S_IRUSR | S_IWUSR)))  # set read and write permissions
 
-    @staticmethod
-    def serialize(item):
-        # b64e is used on top of dumps because python loses data when encoding
-        # dilled objects for sqlite
-        return b64e(dill.dumps(
-            item,
-            protocol=dill.HIGHEST_PROTOCOL
-        ))
+    def serialize(self, item):
+        ''' returns the bytes item is stored as '''
+        return self._serializer.dumps(item)
+
+    def deserialize(self, code):
+        return self._serializer.loads(code)
 
     @staticmethod
-    def deserialize(item):
-        return dill.loads(b64d(item))
+    def digest(code):
+        ''' returns the fixed width integer that objects are indexed by '''
+        return unpack('>q', hashlib.sha256(code).digest()[:8])[0]
+
+    def _cache_entry(self, target):
+        ''' returns the value_key of target and its [(digest, code), id]
+            entry. objects that cant be keyed by value are never cached
+            since they could be mutated into something else. '''
+        key = value_key(target)
+        entry = None if key is None else self._cache.get(key)
+        if entry is None:
+            code = self.serialize(target)
+            entry = [(self.digest(code), code), None]
+            if key is not None:
+                entry = self._cache.put(key, entry)
+        return key, entry
+
+    def _lookup(self, target):
+        ''' returns the (digest, code) pair used to match target in the objects table '''
+        return self._cache_entry(target)[1][0]
+
+    def _cached_id(self, key, entry):
+        ''' returns the id of a cache entry, looking it up if it isnt known '''
+        writing = self._reads_through_writer()
+        if writing and key in self._new_ids:
+            _id = self._new_ids[key]
+            if _id is not None:
+                return _id
+            # forgotten by an uncommitted write. the row can have been
+            # stored again since, so it is looked up without caching it
+            # to keep the id forgotten once the write commits
+            row = self._query_one('select id from objects where digest=? and code=? limit 1;', entry[0])
+            return None if row is None else row[0]
+        if entry[1] is not None and self._cache_is_current():
+            return entry[1]
+        generation = self._cache.generation
+        row = self._query_one('select id from objects where digest=? and code=? limit 1;', entry[0])
+        if row is None:
+            return None
+        if key is not None:
+            self._remember_id(key, row[0], generation, writing)
+        return row[0]
+
+    def _cache_is_current(self):
+        ''' clears the cache and returns False if another connection to
+            the file, from this process or any other, has committed since
+            the cached ids were last checked '''
+        if self._readers is None: # nothing else can reach an in memory database
+            return True
+        version = self._writer.execute('PRAGMA data_version;').fetchone()[0]
+        if version == self._data_version:
+            return True
+        self._data_version = version
+        self._cache.clear()
+        return False
+
+    def _remember_id(self, key, _id, generation, writing=True):
+        ''' caches an id, holding it back until commit if it could belong to an uncommitted write '''
+        if writing and self._writer.in_transaction:
+            self._new_ids[key] = _id
+        else:
+            self._cache.set_id(key, _id, generation)
+
+    def _forget_id(self, target):
+        ''' drops the cached id of target once the current write commits '''
+        key = value_key(target)
+        if key is not None:
+            self._new_ids[key] = None
 
     def store_item(self, item):
         ''' use this function to store a python object in the database '''
-        #print('storing item', item)
-        item_id = self._id_of(item)
-        #print('item_id', item_id)
+        self._store(item)
+
+    def _store(self, item):
+        ''' stores item if it is new and returns its id '''
+        key, entry = self._cache_entry(item)
+        item_id = self._cached_id(key, entry)
         if item_id is None:
-            #print('storing item', item)
-            blob = self.serialize(item)
+            digest, code = entry[0]
             with self._write_lock:
-                self._execute(
-                    'INSERT into objects (code) values (?);',
-                    (blob,)
+                # the digest index replaces unique(code) so the
+                # duplicate check happens inside the insert
+                cursor = self._execute(
+                    'INSERT into objects (code, digest) select ?, ? where not exists (select 1 from objects where digest=? and code=?);',
+                    (code, digest, digest, code)
                 )
+                if cursor.rowcount == 1:
+                    item_id = cursor.lastrowid
+                    if key is not None:
+                        self._remember_id(key, item_id, self._cache.generation)
+                else: # another thread stored it first
+                    item_id = self._cached_id(key, entry)
                 self.autocommit()
+        return item_id
+
+    def _lookups(self, items):
+        ''' returns a dict of memo_key to the (digest, code) of each
+            distinct item so every object is only serialized once '''
+        out = {}
+        for item in items:
+            key = memo_key(item)
+            if key not in out:
+                out[key] = self._lookup(item)
+        return out
+
+    def _insert_lookups(self, lookups):
+        ''' inserts the (digest, code) pairs missing from objects and
+            returns how many rows were added '''
+        return self._executemany(
+            'INSERT into objects (code, digest) select ?, ? where not exists (select 1 from objects where digest=? and code=?);',
+            ((code, digest, digest, code) for digest, code in set(lookups))
+        ).rowcount
+
+    def store_items(self, items, chunk_size=4096):
+        ''' stores every object in items in batches of chunk_size and
+            returns how many of them were new to the database '''
+        stored = 0
+        for chunk in gen.chunks(items, chunk_size):
+            lookups = self._lookups(chunk)
+            with self._write_lock:
+                stored += self._insert_lookups(lookups.values())
+                self.autocommit()
+        return stored
+
+    def store_relations(self, relations, chunk_size=4096):
+        ''' stores every (src, name, dst) in relations in batches of
+            chunk_size and returns how many of them were new to the database '''
+        stored = 0
+        for chunk in gen.chunks(relations, chunk_size):
+            for src, name, dst in chunk:
+                self.__require_string__(name)
+            lookups = self._lookups(gen.chain((src, dst) for src, name, dst in chunk))
+            with self._write_lock:
+                self._insert_lookups(lookups.values())
+                ids = {}
+                for lookup in set(lookups.values()):
+                    ids[lookup] = self._query_one('select id from objects where digest=? and code=? limit 1;', lookup)[0]
+                id_of = lambda i: ids[lookups[memo_key(i)]]
+                by_name = {}
+                for src, name, dst in chunk:
+                    by_name.setdefault(name, []).append({'src': id_of(src), 'relation': name, 'dst': id_of(dst)})
+                for name, rows in by_name.items():
+                    stored += self._executemany(
+                        self._insert_relations_sql(name, 'select :src as src, :dst as dst'),
+                        rows
+                    ).rowcount
+                self.autocommit()
+        return stored
 
     def delete_item(self, item):
         ''' removes an item from the db '''
-        for relation in self.relations_of(item):
+        for relation in list(self.relations_of(item)):
             self.delete_relation(item, relation)
-        for origin, relation in self.relations_to(item, True):
+        for origin, relation in list(self.relations_to(item, True)):
             self.delete_relation(origin, relation, item)
         with self._write_lock:
             self._execute('''
-                DELETE from objects where code=?
-            ''', (self.serialize(item),))
+                DELETE from objects where digest=? and code=?
+            ''', self._lookup(item))
+            self._forget_id(item)
             self.autocommit()
 
     def replace_item(self, old_item, new_item):
@@ -228,39 +865,99 @@ class SQLiteGraphDB(object):
             if self._id_of(new_item) is None: # if the replacement does not already exist
                 with self._write_lock:
                     self._execute('''
-                        UPDATE objects set code=? where code=?
-                    ''', (self.serialize(new_item), self.serialize(old_item)))
+                        UPDATE objects set digest=?, code=? where digest=? and code=?
+                    ''', self._lookup(new_item) + self._lookup(old_item))
+                    self._forget_id(old_item)
+                    self._forget_id(new_item)
                     self.autocommit()
             else: # if the replacement does exist, just move the links from old to new
-                for relation, target in self.relations_of(old_item, True):
+                for relation, target in list(self.relations_of(old_item, True)):
                     self.store_relation(new_item, relation, target)
-                for origin, relation in self.relations_to(old_item, True):
+                for origin, relation in list(self.relations_to(old_item, True)):
                     self.store_relation(origin, relation, new_item)
                 self.delete_item(old_item)
 
     def _id_of(self, target):
-        try:
-            self._execute(
-                'select id from objects where code=? limit 1;',
-                (self.serialize(target),)
-            )
-            return self._fetchone()[0]
-        except:
-            return None
+        return self._cached_id(*self._cache_entry(target))
 
     def __contains__(self, target):
         return self._id_of(target) != None
 
     def __iadd__(self, target):
-        ''' use this to combine databases '''
+        ''' use this to combine databases. every object and relation in
+            target is copied over, including objects without relations.
+            targets stored in files are merged in a few bulk statements by
+            attaching them, everything else is copied in bulk batches. '''
         assert type(target) is self.__class__, 'graph databases can only be added to other graph databases'
-        for src, name, dst in target.list_relations():
-            self.store_relation(src, name, dst)
+        if target is self:
+            return self
+        with self._write_lock:
+            if self._can_attach(target):
+                self._merge_attached(target)
+            else:
+                with self.transaction():
+                    self.store_items(target)
+                    self.store_relations(target.list_relations())
+        return self
+
+    def _can_attach(self, target):
+        ''' true if everything in target can be read by attaching its file.
+            codes are only comparable between files with the same serializer
+            and attaching only works outside of transactions. '''
+        return (
+            target._path not in (':memory:', '') and
+            target._serializer_name == self._serializer_name and
+            not target._writer.in_transaction and
+            not self._writer.in_transaction
+        )
+
+    def _merge_attached(self, target):
+        ''' attaches the file of target to the writer, inserts the objects
+            missing here, maps the ids of target to the ids here and copies
+            each relation name over with one join through that map '''
+        self._execute('ATTACH DATABASE ? as graphdb_merged;', (target._path,))
+        try:
+            layout = self._execute("select value from graphdb_merged.graphdb_meta where key='layout'").fetchone()
+            if layout is not None and layout[0] == 'partitioned':
+                sources = [
+                    (name, 'graphdb_merged.{}'.format(tbl))
+                    for name, tbl in self._execute('select name, tbl from graphdb_merged.relation_tables').fetchall()
+                ]
+            else:
+                sources = [
+                    (name, '(select src, dst from graphdb_merged.relations where name=:relation)')
+                    for name, in self._execute('select distinct name from graphdb_merged.relations').fetchall()
+                ]
+            with self.transaction():
+                self._execute('''
+                    INSERT into main.objects (code, digest) select o.code, o.digest from graphdb_merged.objects as o
+                    where not exists (select 1 from main.objects where digest=o.digest and code=o.code);
+                ''')
+                self._execute('CREATE TEMP TABLE graphdb_merge_ids (old integer primary key, new integer not null);')
+                self._execute('''
+                    INSERT into temp.graphdb_merge_ids (old, new) select o.id, (
+                        select id from main.objects where digest=o.digest and code=o.code limit 1
+                    ) from graphdb_merged.objects as o;
+                ''')
+                for name, relations in sources:
+                    self._execute(
+                        self._insert_relations_sql(name, '''
+                            select old_src.new as src, old_dst.new as dst from {} as r
+                            cross join temp.graphdb_merge_ids as old_src on old_src.old=r.src
+                            cross join temp.graphdb_merge_ids as old_dst on old_dst.old=r.dst
+                        '''.format(relations)),
+                        {'relation': name}
+                    )
+                self._execute('DROP TABLE temp.graphdb_merge_ids;')
+        finally:
+            self._execute('DETACH DATABASE graphdb_merged;')
 
     def __add__(self, target):
-        ''' use this to create a joined database from two graph databases '''
+        ''' use this to create a joined database from two graph databases.
+            the result is in memory and uses the layout and serializer of
+            this database so merging files into it stays a bulk copy. '''
         assert type(target) is self.__class__, 'graph databases can only be added to other graph databases'
-        out = SQLiteGraphDB()
+        out = SQLiteGraphDB(layout=self._layout, serializer=self._serializer_name)
         out += self
         out += target
         return out
@@ -272,16 +969,12 @@ class SQLiteGraphDB(object):
     def store_relation(self, src, name, dst):
         ''' use this to store a relation between two objects '''
         self.__require_string__(name)
-        #print('storing relation', src, name, dst)
-        # make sure both items are stored
-        self.store_item(src)
-        self.store_item(dst)
         with self._write_lock:
-            #print(locals())
-            # run the insertion
+            # holding the lock keeps both ids valid until the relation is inserted
+            src_id, dst_id = self._store(src), self._store(dst)
             self._execute(
-                'insert into relations select ob1.id, ?, ob2.id from objects as ob1, objects as ob2 where ob1.code=? and ob2.code=?;',
-                (name, self.serialize(src), self.serialize(dst))
+                self._insert_relations_sql(name, 'select :src as src, :dst as dst'),
+                {'relation': name, 'src': src_id, 'dst': dst_id}
             )
             self.autocommit()
 
@@ -291,9 +984,10 @@ class SQLiteGraphDB(object):
         src_id = self._id_of(src)
         dst_id = self._id_of(dst)
         with self._write_lock:
-            self._execute('''
-                DELETE from relations where src=? and name=? and dst=?
-            ''', (src_id, relation, dst_id))
+            sql = self._delete_relations_sql(relation, 'src=:src and dst=:dst')
+            if sql is None:
+                return
+            self._execute(sql, {'src': src_id, 'relation': relation, 'dst': dst_id})
             self.autocommit()
 
     def delete_relation(self, src, relation, *targets):
@@ -310,54 +1004,357 @@ class SQLiteGraphDB(object):
 
     def find(self, target, relation):
         ''' returns back all elements the target has a relation to '''
-        query = 'select ob1.code from objects as ob1, objects as ob2, relations where relations.dst=ob1.id and relations.name=? and relations.src=ob2.id and ob2.code=?' # src is id not source :/
-        for i in self._execute(query, (relation, self.serialize(target))):
+        # src is resolved in a subquery so sqlite always starts from the
+        # target instead of every relation with that name
+        query = 'select objects.code from {} as relations, objects where relations.src=(select id from objects where digest=:digest and code=:code) and relations.dst=objects.id'.format(self._relations_named(relation))
+        digest, code = self._lookup(target)
+        for i in self._query(query, {'digest': digest, 'code': code, 'relation': relation}):
             yield self.deserialize(i[0])
 
     def relations_of(self, target, include_object=False):
         ''' list all relations the originate from target '''
         if include_object:
-            _ = self._execute('''
-                select relations.name, ob2.code from relations, objects as ob1, objects as ob2 where relations.src=ob1.id and ob2.id=relations.dst and ob1.code=?
-            ''', (self.serialize(target),))
+            _ = self._query('''
+                select relations.name, objects.code from relations, objects where relations.src=(select id from objects where digest=? and code=?) and objects.id=relations.dst
+            ''', self._lookup(target))
             for i in _:
                 yield i[0], self.deserialize(i[1])
         else:
 
-            _ = self._execute('''
-                select distinct relations.name from relations, objects where relations.src=objects.id and objects.code=?
-            ''', (self.serialize(target),))
+            _ = self._query('''
+                select distinct name from relations where src=?
+            ''', (self._id_of(target),))
             for i in _:
                 yield i[0]
 
     def relations_to(self, target, include_object=False):
         ''' list all relations pointing at an object '''
         if include_object:
-            _ = self._execute('''
+            _ = self._query('''
                 select name, (select code from objects where id=src) from relations where dst=?
             ''', (self._id_of(target),))
             for i in _:
                 yield self.deserialize(i[1]), i[0]
         else:
-            _ = self._execute('''
+            _ = self._query('''
                 select distinct name from relations where dst=?
             ''', (self._id_of(target),))
             for i in _:
                 yield i[0]
 
+    # sqlite allows 64 tables in a join
+    max_traversal_joins = 32
+
+    def _target_ids(self, targets):
+        ''' returns the ids of targets that are stored as a sql list or None '''
+        ids = [i for i in (self._id_of(t) for t in targets) if i is not None]
+        return ','.join(str(int(i)) for i in ids) if ids else None
+
+    def _traversal_sql(self, ids, steps, columns):
+        ''' compiles steps starting from the objects with ids into one
+            query of chained joins selecting columns of the last object.
+            every path is kept so objects are found once per way there.
+            returns (sql, params) or None if nothing can match. '''
+        start = ' union all '.join('select {} as id'.format(int(i)) for i in ids) or 'select 0 as id where 0'
+        sql = ['select {} from ({}) as start'.format(columns, start)]
+        where, params = [], {}
+        node = 'start.id'
+        for n, step in enumerate(steps):
+            param = 'relation_{}'.format(n)
+            params[param] = step[1]
+            relations = self._relations_named(step[1], param=param)
+            if step[0] == 'hop':
+                # cross joins keep sqlite from searching every join order
+                if self._layout == 'single':
+                    sql.append('cross join relations as r{n} on r{n}.src={} and r{n}.name=:{}'.format(node, param, n=n))
+                else:
+                    sql.append('cross join {} as r{n} on r{n}.src={}'.format(relations, node, n=n))
+                node = 'r{}.dst'.format(n)
+            else:
+                targets = self._target_ids(step[2])
+                if targets is None:
+                    return None
+                where.append('exists (select 1 from {} as r{n} where r{n}.src={} and r{n}.dst in ({}))'.format(
+                    relations, node, targets, n=n
+                ))
+        sql.append('cross join objects on objects.id={}'.format(node))
+        if where:
+            sql.append('where ' + ' and '.join(where))
+        return ' '.join(sql), params
+
+    def _distinct_traversal_sql(self, ids, steps, columns):
+        ''' compiles steps like _traversal_sql but as a chain of common
+            table expressions where each hop only steps from the distinct
+            objects the last one reached '''
+        levels = ['l0(id) as ({})'.format(
+            ' union '.join('select {} as id'.format(int(i)) for i in ids) or 'select 0 as id where 0'
+        )]
+        params = {}
+        for n, step in enumerate(steps):
+            param = 'relation_{}'.format(n)
+            params[param] = step[1]
+            relations = self._relations_named(step[1], param=param)
+            if step[0] == 'hop':
+                levels.append('l{m}(id) as (select r{n}.dst from {} as r{n} where r{n}.src in l{n})'.format(relations, n=n, m=n+1))
+            else:
+                targets = self._target_ids(step[2])
+                if targets is None:
+                    return None
+                levels.append('l{m}(id) as (select id from l{n} where exists (select 1 from {} as r{n} where r{n}.src=l{n}.id and r{n}.dst in ({})))'.format(
+                    relations, targets, n=n, m=n+1
+                ))
+        return 'with {} select {} from objects where objects.id in l{}'.format(', '.join(levels), columns, len(steps)), params
+
+    def _traverse(self, values, steps, distinct=False, chunk_size=256):
+        ''' streams every value reached by following steps from each value
+            in values. steps are ('hop', relation) to move along a relation
+            or ('has', relation, targets) to keep what has relation to one of
+            targets. each chunk of values runs as one query over ids so only
+            the results are ever deserialized. distinct finds every object
+            once instead of once per path to it. '''
+        for row in self._traversal_rows(values, steps, 'objects.id, objects.code', distinct, chunk_size):
+            yield self.deserialize(row[1])
+
+    def _count_traversal(self, values, steps, distinct=False, chunk_size=256):
+        ''' returns how many objects _traverse would generate. every chunk
+            of values is counted in sql unless distinct needs the ids to
+            drop objects found by earlier chunks. '''
+        if distinct:
+            return sum(1 for row in self._traversal_rows(values, steps, 'objects.id', True, chunk_size))
+        return sum(row[0] for row in self._traversal_rows(values, steps, 'count(*)', False, chunk_size))
+
+    def _matches_by_id(self, relation):
+        ''' returns True if relation only links to objects of the builtin
+            types equivalent_values lists every equal form of, so has steps
+            over it can match target ids. the tagged serializer dills every
+            other type, and those can == values of other types. '''
+        if self._serializer_name != 'tagged':
+            return False
+        return self._query_one('''
+            select 1 from objects where {} and exists (select 1 from {} as r where r.dst=objects.id) limit 1
+        '''.format(dilled_sql, self._relations_named(relation)), {'relation': relation}) is None
+
+    def _ids_with_equal(self, ids, relation, targets, chunk_size):
+        ''' returns the ids that have relation to an object == one of targets '''
+        out = []
+        for chunk in gen.chunks(ids, chunk_size):
+            chunk = list(chunk)
+            matched = {
+                row[0] for row in self._query('''
+                    select r.src, objects.code from {} as r cross join objects on objects.id=r.dst where r.src in ({})
+                '''.format(self._relations_named(relation), ','.join(str(int(i)) for i in chunk)), {'relation': relation})
+                if any(self.deserialize(row[1]) == t for t in targets)
+            }
+            out.extend(i for i in chunk if i in matched)
+        return out
+
+    def _traversal_rows(self, values, steps, columns, distinct, chunk_size):
+        ''' generates the columns of every object _traverse would reach '''
+        ids = (i for i in (self._id_of(v) for v in values) if i is not None)
+        # has steps that cant match by id split the traversal so whatever
+        # reached them is filtered with == in python
+        exact = [step[0] == 'hop' or self._matches_by_id(step[1]) for step in steps]
+        while not all(exact):
+            n = exact.index(False)
+            ids = [row[0] for row in self._split_traversal_rows(ids, steps[:n], 'objects.id', distinct, chunk_size)]
+            ids = self._ids_with_equal(ids, steps[n][1], steps[n][2], chunk_size)
+            steps, exact = steps[n+1:], exact[n+1:]
+        return self._split_traversal_rows(ids, steps, columns, distinct, chunk_size)
+
+    def _split_traversal_rows(self, ids, steps, columns, distinct, chunk_size):
+        ''' runs _traverse_rows with chains too long for one query split up '''
+        hops = [i for i, step in enumerate(steps) if step[0] == 'hop']
+        # really long chains are split into queries that pass ids along
+        while len(hops) > self.max_traversal_joins:
+            split = hops[self.max_traversal_joins]
+            ids = [row[0] for row in self._traverse_rows(ids, steps[:split], 'objects.id', distinct, chunk_size)]
+            steps, hops = steps[split:], [i - split for i in hops[self.max_traversal_joins:]]
+        return self._traverse_rows(ids, steps, columns, distinct, chunk_size)
+
+    def _traverse_rows(self, ids, steps, columns, distinct, chunk_size):
+        ''' runs a traversal for each chunk of ids. the first column needs
+            to be the object id so distinct can drop rows found by earlier chunks '''
+        compile = self._distinct_traversal_sql if distinct else self._traversal_sql
+        seen = set()
+        for chunk in gen.chunks(ids, chunk_size):
+            compiled = compile(chunk, steps, columns)
+            if compiled is None:
+                return
+            for row in self._query(*compiled):
+                if distinct:
+                    if row[0] in seen:
+                        continue
+                    seen.add(row[0])
+                yield row
+
+    def _link_tables(self, relations):
+        ''' returns the sql tables or subqueries of (src, dst) that hold the
+            relations named in relations, or every relation if it is None,
+            with the params they need '''
+        names = relation_names(relations)
+        if names is None:
+            if self._layout == 'single':
+                return ['relations'], {}
+            names = [row[0] for row in self._query('select name from relation_tables order by name')]
+        params = {'relation_{}'.format(n): name for n, name in enumerate(names)}
+        if self._layout == 'single':
+            return ['(select src, dst from relations where name in ({}))'.format(
+                ', '.join(':' + param for param in params)
+            )], params
+        return [self._relations_named(name, param='relation_{}'.format(n)) for n, name in enumerate(names)], params
+
+    def _count_links(self, relations, where='', params=None):
+        ''' returns how many rows of the link tables of relations match where
+            with one query that adds up the count of every table '''
+        tables, link_params = self._link_tables(relations)
+        if not tables:
+            return 0
+        link_params.update(params or {})
+        return self._query_one('select {}'.format(' + '.join(
+            '(select count(*) from {}{})'.format(table, where) for table in tables
+        )), link_params)[0]
+
+    def count_objects(self):
+        ''' returns how many objects are stored '''
+        return self._query_one('select count(*) from objects')[0]
+
+    def count_relations(self, name=None):
+        ''' returns how many relations are stored, or how many are named name '''
+        return self._count_links(name)
+
+    def out_degree(self, obj, relation=None):
+        ''' returns how many relations obj has, or how many named relation '''
+        _id = self._id_of(obj)
+        return 0 if _id is None else self._count_links(relation, ' where src=:id', {'id': _id})
+
+    def in_degree(self, obj, relation=None):
+        ''' returns how many relations point at obj, or how many named relation '''
+        _id = self._id_of(obj)
+        return 0 if _id is None else self._count_links(relation, ' where dst=:id', {'id': _id})
+
+    def bfs(self, start, relations=None, max_depth=None):
+        ''' generates (object, depth) for everything reachable from start in
+            breadth first order, beginning with (start, 0). each object is
+            found once at the depth of its shortest path. relations limits
+            which relation names are followed and max_depth how many hops. '''
+        assert max_depth is None or (isinstance(max_depth, int) and max_depth >= 0), max_depth  # max_depth needs to be None or a non negative int
+        start = self._id_of(start)
+        if start is None:
+            return
+        tables, params = self._link_tables(relations)
+        if len(tables) > 1 and sqlite3.sqlite_version_info < (3, 34, 0):
+            # older sqlite only allows one recursive select
+            tables = ['({})'.format(' union all '.join('select src, dst from {}'.format(i) for i in tables))]
+        params.update(start=start, max_depth=max_depth)
+        # sqlite walks the recursive table as a queue so rows come out one
+        # depth after another. the union only drops repeats of (id, depth)
+        # so objects are skipped here once they have been found.
+        steps = ''.join(
+            ' union select links.dst, walk.depth+1 from walk cross join {} as links on links.src=walk.id{}'.format(
+                table, '' if max_depth is None else ' where walk.depth<:max_depth'
+            ) for table in tables
+        )
+        query = 'with recursive walk(id, depth) as (select :start, 0{}) select id, depth, (select code from objects where objects.id=walk.id) from walk'.format(steps)
+        seen = set()
+        depth, found = 0, True
+        for _id, row_depth, code in self._query(query, params):
+            if row_depth != depth:
+                # everything a depth without anything new leads to was already found
+                if not found:
+                    return
+                depth, found = row_depth, False
+            if _id not in seen:
+                seen.add(_id)
+                found = True
+                yield self.deserialize(code), row_depth
+
+    def neighbourhood(self, start, k, relations=None):
+        ''' generates everything within k hops of start, not counting start '''
+        for obj, depth in self.bfs(start, relations, k):
+            if depth:
+                yield obj
+
+    def shortest_path(self, src, dst, relations=None, chunk_size=4096):
+        ''' returns the objects on a shortest path from src to dst, both
+            included, or None if dst cant be reached from src. both ends are
+            searched from at once over ids, one query per level and chunk. '''
+        src, dst = self._id_of(src), self._id_of(dst)
+        if src is None or dst is None:
+            return None
+        tables, params = self._link_tables(relations)
+        def expand(ids, reverse):
+            columns = 'dst, src' if reverse else 'src, dst'
+            for chunk in gen.chunks(ids, chunk_size):
+                where = '{} in ({})'.format(columns[:3], ','.join(str(int(i)) for i in chunk))
+                query = ' union all '.join('select {} from {} where {}'.format(columns, table, where) for table in tables)
+                if query:
+                    yield from self._query(query, params)
+        path = bidirectional_path(src, dst, expand)
+        if path is None:
+            return None
+        codes = dict(self._query('select id, code from objects where id in ({})'.format(','.join(str(int(i)) for i in path))))
+        return [self.deserialize(codes[i]) for i in path]
+
     def connections_of(self, target):
         ''' generate tuples containing (relation, object_that_applies) '''
         return gen.chain( ((r,i) for i in self.find(target,r)) for r in self.relations_of(target) )
 
-    def list_objects(self):
-        ''' list the entire of objects with their (id, serialized_form, actual_value) '''
-        for i in self._execute('select * from objects'):
-            _id, code = i
-            yield _id, code, self.deserialize(code)
+    def _parallel_scan(self, rows, columns, parallel, ordered, chunk_size=1024):
+        ''' generates rows with the codes in columns replaced by what they
+            deserialize to. chunks of rows are deserialized by parallel
+            workers, at most two chunks per worker at a time, and come back
+            in order if ordered is set or as soon as they are done if not.
+            workers use the serializer by name so it has to be registered
+            when graphdb is imported and objects have to be picklable to be
+            sent back from worker processes. '''
+        assert isinstance(parallel, int) and parallel > 0, parallel  # parallel needs to be a positive int
+        def submit(chunk):
+            return pool.submit(_loads_chunk, self._serializer_name, [row[i] for row in chunk for i in columns])
+        def assemble(chunk, future):
+            loaded = iter(future.result())
+            for row in chunk:
+                row = list(row)
+                for i in columns:
+                    row[i] = next(loaded)
+                yield row
+        def finished():
+            ''' pops the (chunk, future) pairs that can be yielded next '''
+            if ordered:
+                return [pending.popitem(last=False)[1]]
+            done, _ = wait([f for c, f in pending.values()], return_when=FIRST_COMPLETED)
+            return [pending.pop(n) for n in [n for n, (c, f) in pending.items() if f in done]]
+        pool = _scan_pool(parallel)
+        # submission number: (chunk, future)
+        pending = OrderedDict()
+        try:
+            for n, chunk in enumerate(gen.chunks(rows, chunk_size)):
+                pending[n] = chunk, submit(chunk)
+                while len(pending) >= 2 * parallel:
+                    for chunk, future in finished():
+                        yield from assemble(chunk, future)
+            while pending:
+                for chunk, future in finished():
+                    yield from assemble(chunk, future)
+        finally:
+            for chunk, future in pending.values():
+                future.cancel()
+            pool.shutdown()
+
+    def list_objects(self, parallel=None, ordered=True):
+        ''' list the entire of objects with their (id, serialized_form, actual_value).
+            parallel deserializes with that many workers and ordered=False
+            yields objects as soon as their chunk is done. '''
+        rows = self._query('select id, code from objects')
+        if parallel is None:
+            for _id, code in rows:
+                yield _id, code, self.deserialize(code)
+        else:
+            for _id, code, obj in self._parallel_scan(((_id, code, code) for _id, code in rows), (2,), parallel, ordered):
+                yield _id, code, obj
 
     def __iter__(self):
         ''' iterate over all stored objects in the database '''
-        for i in self._execute('select code from objects'):
+        for i in self._query('select code from objects'):
             yield self.deserialize(i[0])
 
     def show_objects(self):
@@ -365,19 +1362,37 @@ class SQLiteGraphDB(object):
         for i in self.list_objects():
             print(*i)
 
-    def list_relations(self):
-        ''' list every relation in the database as (src, relation, dst) '''
-        _ = self._execute('select * from relations').fetchall()
-        for i in _:
-            #print(i)
-            src, name, dst = i
-            src = self.deserialize(
-                next(self._execute('select code from objects where id=?',(src,)))[0]
-            )
-            dst = self.deserialize(
-                next(self._execute('select code from objects where id=?',(dst,)))[0]
-            )
-            yield src, name, dst
+    def list_relations(self, cache_size=65536, parallel=None, ordered=True):
+        ''' list every relation in the database as (src, relation, dst). the
+            scan is one streamed join and objects are only deserialized the
+            first time they show up among the last cache_size objects seen.
+            mutable objects are deserialized for every relation so changing
+            one never changes another. parallel deserializes with that many
+            workers instead and ordered=False yields relations as soon as
+            their chunk is done. '''
+        rows = self._query('''
+            select relations.src, relations.name, relations.dst, s.code, d.code from relations
+            cross join objects as s on s.id=relations.src
+            cross join objects as d on d.id=relations.dst
+        ''')
+        if parallel is not None:
+            for src, name, dst, src_obj, dst_obj in self._parallel_scan(rows, (3, 4), parallel, ordered):
+                yield src_obj, name, dst_obj
+            return
+        loaded = OrderedDict()
+        def load(_id, code):
+            obj = loaded.get(_id, loaded)
+            if obj is loaded:
+                obj = self.deserialize(code)
+                if value_key(obj) is not None:
+                    loaded[_id] = obj
+                    if len(loaded) > cache_size:
+                        loaded.popitem(last=False)
+            else:
+                loaded.move_to_end(_id)
+            return obj
+        for src, name, dst, src_code, dst_code in rows:
+            yield load(src, src_code), name, load(dst, dst_code)
 
     def show_relations(self):
         ''' display every relation in the database as (src, relation, dst) '''
@@ -410,7 +1425,7 @@ class V(object):
         if key in V.__slots__ or key == '__slots__':
             return object.__getattribute__(self, key)
         else:
-            return VList(V(self._graph_db, _) for _ in self._graph_db.find(self._graph_value, key))
+            return VList._traversal(self._graph_db, (self._graph_value,), (('hop', key),), False)
             #return V(self._graph_db, next(self._graph_db.find(self._graph_value, key), None))
 
     __getitem__ = __getattribute__
@@ -435,15 +1450,112 @@ class V(object):
     def __call__(self):
         return self._graph_value
 
+def _materialized(method):
+    ''' wraps a list method so it sees what pending plans find, both in
+        the VList it runs on and in any VList passed to it '''
+    @wraps(method)
+    def wrapper(self, *args, **kwargs):
+        return method(self._materialize(), *(i._materialize() if isinstance(i, VList) else i for i in args), **kwargs)
+    return wrapper
+
 class VList(list):
-    _slots = tuple(dir(list)) + ('_slots','to','where')
+    ''' list of V's. stepping through relations builds a query plan of
+        (db, start values, steps, distinct) that only runs in a single sql
+        query once the VList is called, iterated or otherwise looked at. '''
+    _slots = frozenset(dir(list)) | {'_slots','to','where','distinct','distinct_count','stream','_plan','_traversal','_materialize','_then','_where_equals','__radd__','__copy__'}
 
     def __init__(self, *args):
         list.__init__(self, *args)
-        for i in self:
+        object.__setattr__(self, '_plan', None)
+        for i in list.__iter__(self):
             #print(type(i))
             assert type(i) == V, 'needed a V and got a {}'.format(type(i))
 
+    @staticmethod
+    def _traversal(db, values, steps, distinct):
+        ''' returns a VList of what steps reach from values in db '''
+        out = VList()
+        object.__setattr__(out, '_plan', (db, values, steps, distinct))
+        return out
+
+    def _materialize(self):
+        ''' runs the pending plan and fills the list with what it finds '''
+        if self._plan is not None:
+            db, values, steps, distinct = self._plan
+            object.__setattr__(self, '_plan', None)
+            list.extend(self, (V(db, i) for i in db._traverse(values, steps, distinct)))
+        return self
+
+    def _then(self, *step, distinct=False):
+        ''' returns a VList that runs step on everything in this one.
+            once a plan is distinct every later step is as well. '''
+        if self._plan is not None:
+            db, values, steps, was_distinct = self._plan
+            return VList._traversal(db, values, steps + step, distinct or was_distinct)
+        if not list.__len__(self):
+            return VList()
+        return VList._traversal(
+            list.__getitem__(self, 0)._graph_db,
+            tuple(i() for i in list.__iter__(self)),
+            step,
+            distinct
+        )
+
+    def distinct(self):
+        ''' returns a VList that only holds each object once and only steps
+            from each object once on every later hop. use this on graphs with
+            cycles or shared neighbours where paths multiply with each hop. '''
+        return self._then(distinct=True)
+
+    def stream(self):
+        ''' generates the V's of this VList straight from its query without
+            holding them in the list '''
+        if self._plan is None:
+            return list.__iter__(self)
+        db, values, steps, distinct = self._plan
+        return (V(db, i) for i in db._traverse(values, steps, distinct))
+
+    def __iter__(self):
+        return list.__iter__(self._materialize())
+
+    def __len__(self):
+        return list.__len__(self._materialize())
+
+    def __contains__(self, target):
+        return list.__contains__(self._materialize(), target)
+
+    def __repr__(self):
+        return list.__repr__(self._materialize())
+
+    def __radd__(self, other):
+        # list + VList reads the list storage of the VList directly
+        if not isinstance(other, list):
+            return NotImplemented
+        return list.__add__(other, self._materialize())
+
+    def __copy__(self):
+        return VList(list.__iter__(self._materialize()))
+
+    def __reduce_ex__(self, protocol):
+        return VList, (list(list.__iter__(self._materialize())),)
+
+    def count(self, *value):
+        ''' returns how many objects the VList holds by counting its query
+            in sql without loading anything. count(value) works like list.count. '''
+        if value:
+            return list.count(self._materialize(), *value)
+        if self._plan is None:
+            return list.__len__(self)
+        db, values, steps, distinct = self._plan
+        return db._count_traversal(values, steps, distinct)
+
+    def distinct_count(self):
+        ''' returns how many different objects the VList holds '''
+        if self._plan is None:
+            return len({i._graph_db._id_of(i._graph_value) for i in list.__iter__(self)})
+        db, values, steps, distinct = self._plan
+        return db._count_traversal(values, steps, True)
+
     def where(self, relation, filter_fn):
         ''' use this to filter VLists, simply provide a filter function and what relation to apply it to '''
         assert type(relation).__name__ in {'str','unicode'}, 'where needs the first arg to be a string'
@@ -461,11 +1573,21 @@ class VList(list):
         '''use this to filter VLists with kv pairs'''
         out = self
         for k,v in kwargs.items():
-            out = out.where(k, lambda i:i==v)
+            out = out._where_equals(k, v)
         return out
-    
+
     where = overload(_where, where)
 
+    def _where_equals(self, relation, value):
+        ''' keeps what has relation to something equal to value. this runs
+            in sql when every stored form of value is known and relation only
+            links to builtin types, otherwise neighbours are compared in python. '''
+        assert type(relation).__name__ in {'str','unicode'}, 'where needs a string relation'
+        targets = equivalent_values(value)
+        if targets is None:
+            return self.where(relation, lambda i:i==value)
+        return self._then(('has', relation, targets))
+
     def to(self, output_type):
         assert type(output_type) == type, 'needed a type here not: {}'.format(output_type)
         return output_type(self())
@@ -489,15 +1611,31 @@ class VList(list):
         if key in VList._slots:
             return object.__getattribute__(self, key)
         else:
-            # run the attribute query on all elements in self
-            g = lambda:gen.chain( (fv for fv in getattr(v,key)) for v in self )
-            return VList(g())
+            # add the attribute query to the plan
+            return self._then(('hop', key))
 
     __getitem__ = __getattribute__
 
     def __call__(self, output_type=None):
-        # load all values where this is called
+        # load all values where this is called. pending plans stream
+        # straight from the query without filling the list
+        if self._plan is not None:
+            db, values, steps, distinct = self._plan
+            values = db._traverse(values, steps, distinct)
+        else:
+            values = (i() for i in list.__iter__(self))
         if output_type is None:
-            return (i() for i in self)
+            return values
         else:
-            return output_type(i() for i in self)
+            return output_type(values)
+
+# list methods that read or change the list storage directly instead of
+# going through __iter__ or __len__
+for _name in (
+    '__eq__', '__ne__', '__lt__', '__le__', '__gt__', '__ge__', '__add__',
+    '__mul__', '__rmul__', '__reversed__', 'copy', 'index', 'append',
+    'extend', 'insert', 'pop', 'remove', 'clear', 'sort', 'reverse',
+    '__setitem__', '__delitem__', '__iadd__', '__imul__'
+):
+    setattr(VList, _name, _materialized(getattr(list, _name)))
+del _name
@@ -2,13 +2,28 @@
 from __future__ import print_function
 from itertools import count
 from functools import partial
-import unittest, sys, os
+from threading import Thread, Event
+from tempfile import mkdtemp
+from shutil import rmtree
+from time import sleep, time
+import tracemalloc
+import asyncio, json, subprocess, unittest, sys, os
 
-from graphdb import GraphDB
+from graphdb import GraphDB, RamGraphDB, SQLiteGraphDB, AsyncGraphDB
+from graphdb.serializers import serializers
+from graphdb.io import load_edges, dump_edges
 from generators import rps, G
 
 def report(name, speed):
     print('{:7}/sec - {}'.format(speed, name))
+
+def bulk_rps(fn, batch_size=1000):
+    ''' runs fn with consecutive batches of counters and returns how many
+        counters it got through per second '''
+    def run():
+        for start in count(0, batch_size):
+            yield fn(range(start, start+batch_size))
+    return batch_size * rps(run())
     
 class GraphDBTest(unittest.TestCase):
     def setUp(self):
@@ -32,6 +47,12 @@ class GraphDBTest(unittest.TestCase):
         report('relation insertion', rps(
             G(count()).map(lambda i:db.store_relation(i,'less_than',i+1))
         ))
+
+    def test_bulk_insert_relation(self):
+        db=self.db
+        report('bulk relation insertion', bulk_rps(
+            lambda c:db.store_relations((i,'less_than',i+1) for i in c)
+        ))
         
     def test_serialization(self):
         db=self.db
@@ -124,6 +145,683 @@ class GraphDBTest(unittest.TestCase):
             iter((lambda:next(db(5).under.under.under.under.under.under.under())), 2)
         ))
         
+class RamGraphDBTest(unittest.TestCase):
+    ''' benchmarks for the in memory adjacency of RamGraphDB '''
+    hub_links = 1000000
+
+    def test_hub_insert_relation(self):
+        db = RamGraphDB()
+        start = time()
+        db.store_relations((i,'member_of','hub') for i in range(self.hub_links))
+        report('relation insertion into a hub with {} links'.format(self.hub_links), int(self.hub_links/(time()-start)))
+        report('relation insertion into a hub that already has {} links'.format(self.hub_links), rps(
+            G(count(self.hub_links)).map(lambda i:db.store_relation(i,'member_of','hub'))
+        ))
+        report('relation lookup on a hub with {} links'.format(self.hub_links), rps(
+            G(count()).map(lambda i:db.store_relation(i%self.hub_links,'member_of','hub'))
+        ))
+
+class RamGraphDBStartupTest(unittest.TestCase):
+    ''' measures how long durable RamGraphDBs take to open as they grow,
+        from a compacted snapshot and from replaying only the log '''
+
+    def setUp(self):
+        self.dir = mkdtemp()
+
+    def tearDown(self):
+        rmtree(self.dir)
+
+    def run_startup(self, edges):
+        path = os.path.join(self.dir, str(edges))
+        db = RamGraphDB(path=path, fsync=None, snapshot_every=None)
+        db.store_relations((i, 'knows', (i*7)%edges) for i in range(edges))
+        db.close()
+        start = time()
+        db = RamGraphDB(path=path)
+        print('{:7.2f}s - startup replaying a log of {} relations'.format(time()-start, edges))
+        db.snapshot()
+        db.close()
+        start = time()
+        db = RamGraphDB(path=path)
+        print('{:7.2f}s - startup loading a snapshot of {} relations'.format(time()-start, edges))
+        db.close()
+
+    def test_10000_relations(self):
+        self.run_startup(10000)
+
+    def test_100000_relations(self):
+        self.run_startup(100000)
+
+    def test_1000000_relations(self):
+        self.run_startup(1000000)
+
+class RamGraphDBMemoryTest(unittest.TestCase):
+    ''' records the peak RSS of a RamGraphDB holding edges links so hosts
+        can be sized. every graph is built in a fresh interpreter so the
+        peak only includes that graph. '''
+    edges = 10000000
+
+    script = '''
+import json, resource, sys
+from graphdb import RamGraphDB
+edges, fan_out = int(sys.argv[1]), int(sys.argv[2])
+db = RamGraphDB()
+db.store_relations((i//fan_out, 'knows', i+1) for i in range(edges))
+usage = db.memory_usage()
+del usage['relations']
+usage['peak_rss'] = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * 1024
+print(json.dumps(usage))
+'''
+
+    def run_peak_rss(self, name, fan_out):
+        out = subprocess.run(
+            (sys.executable, '-c', self.script, str(self.edges), str(fan_out)),
+            stdout=subprocess.PIPE,
+            check=True,
+            # makes this copy of graphdb importable in the child
+            env=dict(os.environ, PYTHONPATH=os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+        ).stdout
+        usage = json.loads(out.decode())
+        print('{:7}MB - peak rss of a {} with {} edges ({:.0f} bytes per node, {:.0f} bytes per edge)'.format(
+            usage['peak_rss'] // 2**20,
+            name,
+            self.edges,
+            usage['bytes_per_node'],
+            usage['bytes_per_edge']
+        ))
+
+    def test_chain_peak_rss(self):
+        self.run_peak_rss('chain', 1)
+
+    def test_fan_out_peak_rss(self):
+        self.run_peak_rss('tree with a fan out of 16', 16)
+
+class FrozenRamGraphDBTest(unittest.TestCase):
+    ''' compares the memory and traversal speed of frozen snapshots with
+        the mutable RamGraphDB they were frozen from '''
+    size = 100000
+
+    def build(self):
+        db = RamGraphDB()
+        db.store_relations((i, 'knows', (i*7+j)%self.size) for i in range(self.size) for j in range(4))
+        db.store_relations((i, 'even', not i%2) for i in range(self.size))
+        return db
+
+    def setUp(self):
+        self.db = self.build()
+        self.frozen = self.db.freeze()
+
+    def tearDown(self):
+        self.frozen._destroy()
+        self.db._destroy()
+
+    def test_memory(self):
+        tracemalloc.start()
+        start = tracemalloc.get_traced_memory()[0]
+        db = self.build()
+        middle = tracemalloc.get_traced_memory()[0]
+        frozen = db.freeze()
+        end = tracemalloc.get_traced_memory()[0]
+        tracemalloc.stop()
+        print('{:7}MB - mutable graph with {} nodes'.format((middle-start)//2**20, self.size))
+        print('{:7}MB - frozen snapshot with {} nodes'.format((end-middle)//2**20, self.size))
+        frozen._destroy()
+        db._destroy()
+
+    def test_traversal(self):
+        for name, db in (('mutable', self.db), ('frozen', self.frozen)):
+            report('{} 3 step traversal'.format(name), rps(
+                G(count()).map(lambda i:list(db(i%self.size).knows.knows.knows()))
+            ))
+
+    def test_relations_of(self):
+        for name, db in (('mutable', self.db), ('frozen', self.frozen)):
+            report('{} relations_of'.format(name), rps(
+                G(count()).map(lambda i:list(db.relations_of(i%self.size, True)))
+            ))
+
+class SQLiteGraphDBTest(unittest.TestCase):
+    ''' benchmarks for the parts of SQLiteGraphDB that RamGraphDB doesnt have '''
+    def setUp(self):
+        self.db = SQLiteGraphDB()
+
+    def tearDown(self):
+        self.db._destroy()
+
+    def test_insert_relation(self):
+        db=self.db
+        report('sqlite relation insertion', rps(
+            G(count()).map(lambda i:db.store_relation(i,'less_than',i+1))
+        ))
+
+    def test_bulk_insert_relation(self):
+        db=self.db
+        report('sqlite bulk relation insertion', bulk_rps(
+            lambda c:db.store_relations((i,'less_than',i+1) for i in c)
+        ))
+
+    def test_insert_relation_in_transaction(self):
+        db=self.db
+        with db.transaction():
+            report('sqlite relation insertion in a transaction', rps(
+                G(count()).map(lambda i:db.store_relation(i,'less_than',i+1))
+            ))
+
+    def test_serialization(self):
+        for name, serializer in sorted(serializers.items()):
+            report('{} serialization'.format(name), rps(
+                G(count()).map(serializer.dumps)
+            ))
+
+    def test_serialization_deserialization(self):
+        for name, serializer in sorted(serializers.items()):
+            report('{} serialization/deserialization'.format(name), rps(
+                G(count()).map(lambda i:serializer.loads(serializer.dumps(i)))
+            ))
+
+    def run_lookup(self, size):
+        db=self.db
+        for i in range(256):
+            db.store_item('{}-{}'.format(i, 'x'*size))
+        target = '128-{}'.format('x'*size)
+        report('{} byte object lookup'.format(size), rps(
+            lambda:db._id_of(target)
+        ))
+
+    def test_lookup_16_bytes(self):
+        self.run_lookup(16)
+
+    def test_lookup_1024_bytes(self):
+        self.run_lookup(1024)
+
+    def test_lookup_65536_bytes(self):
+        self.run_lookup(65536)
+
+    def run_traversal(self, steps):
+        db=self.db
+        db.store_relations((i,'under',i+1) for i in range(steps))
+        def traverse():
+            chain = db(0)
+            for _ in range(steps):
+                chain = chain.under
+            return next(chain())
+        report('sqlite {} step traversal'.format(steps), rps(
+            iter(traverse, None)
+        ))
+
+    def test_1_traversal(self):
+        self.run_traversal(1)
+
+    def test_7_traversal(self):
+        self.run_traversal(7)
+
+    def test_64_traversal(self):
+        self.run_traversal(64)
+
+    def run_hub_insert(self, cache_size):
+        db = SQLiteGraphDB(cache_size=cache_size)
+        hub = ('hub', 'x'*1024)
+        report('sqlite hub relation insertion with a cache of {}'.format(cache_size), rps(
+            G(count()).map(lambda i:db.store_relation(hub,'connected_to',i%1000))
+        ))
+        db._destroy()
+
+    def test_hub_insert_uncached(self):
+        self.run_hub_insert(0)
+
+    def test_hub_insert_cached(self):
+        self.run_hub_insert(4096)
+
+class SQLiteScanTest(unittest.TestCase):
+    ''' measures full scans of every relation and object '''
+    edges = 1000000
+
+    def setUp(self):
+        self.db = SQLiteGraphDB()
+        # a power law-ish graph where low numbers are linked to the most
+        self.db.store_relations((i, 'knows', (i*i)%(i//16+1)) for i in range(self.edges))
+
+    def tearDown(self):
+        self.db._destroy()
+
+    def test_list_relations(self):
+        start = time()
+        scanned = sum(1 for i in self.db.list_relations())
+        took = time() - start
+        print('{:7.2f}s - list_relations over {} edges ({:.0f}/sec)'.format(took, scanned, scanned/took))
+
+    def test_parallel_list_relations(self):
+        for parallel in (None, 1, 2, 4, 8):
+            for ordered in (True, False):
+                if parallel is None and not ordered:
+                    continue
+                start = time()
+                scanned = sum(1 for i in self.db.list_relations(parallel=parallel, ordered=ordered))
+                took = time() - start
+                print('{:7.2f}s - list_relations over {} edges with {} workers{} ({:.0f}/sec)'.format(
+                    took, scanned, parallel or 'no', '' if ordered else ', unordered', scanned/took
+                ))
+
+    def test_parallel_list_objects(self):
+        # dill is the format where deserializing costs the most
+        db = SQLiteGraphDB(serializer='base64-dill')
+        db.store_items(('object', i, float(i)) for i in range(self.edges))
+        for parallel in (None, 1, 2, 4, 8):
+            start = time()
+            scanned = sum(1 for i in db.list_objects(parallel=parallel))
+            took = time() - start
+            print('{:7.2f}s - list_objects over {} dilled objects with {} workers ({:.0f}/sec)'.format(
+                took, scanned, parallel or 'no', scanned/took
+            ))
+        db._destroy()
+
+    def test_iter(self):
+        start = time()
+        scanned = sum(1 for i in self.db)
+        took = time() - start
+        print('{:7.2f}s - iterating over {} objects ({:.0f}/sec)'.format(took, scanned, scanned/took))
+
+class EdgeListTest(unittest.TestCase):
+    ''' measures how many rows per second edge lists are dumped and loaded
+        at in every format compared to looping over store_relation '''
+    backends = {'ram': RamGraphDB, 'sqlite': SQLiteGraphDB}
+    rows = 100000
+
+    def setUp(self):
+        self.dir = mkdtemp()
+
+    def tearDown(self):
+        rmtree(self.dir)
+
+    def relations(self):
+        return ((i, 'knows', (i*7)%(self.rows//10)) for i in range(self.rows))
+
+    def run_backend(self, backend):
+        db = self.backends[backend]()
+        start = time()
+        for src, name, dst in self.relations():
+            db.store_relation(src, name, dst)
+        report('{} rows stored with store_relation'.format(backend), int(self.rows/(time()-start)))
+        for format in ('csv', 'jsonl', 'binary'):
+            path = os.path.join(self.dir, 'edges.' + format)
+            start = time()
+            dump_edges(db, path, format)
+            report('{} rows dumped as {}'.format(backend, format), int(self.rows/(time()-start)))
+            copy = self.backends[backend]()
+            start = time()
+            load_edges(copy, path, format)
+            report('{} rows loaded from {}'.format(backend, format), int(self.rows/(time()-start)))
+            copy._destroy()
+        db._destroy()
+
+    def test_ram(self):
+        self.run_backend('ram')
+
+    def test_sqlite(self):
+        self.run_backend('sqlite')
+
+class MergeTest(unittest.TestCase):
+    ''' compares merging shards with += against copying their relations one at a time '''
+    edges = 100000
+
+    def setUp(self):
+        self.dir = mkdtemp()
+
+    def tearDown(self):
+        rmtree(self.dir)
+
+    def shards(self, backend):
+        if backend == 'ram':
+            shards = RamGraphDB(), RamGraphDB()
+        else:
+            shards = tuple(SQLiteGraphDB(os.path.join(self.dir, '{}-{}.db'.format(backend, i))) for i in range(2))
+        for n, db in enumerate(shards):
+            db.store_relations((i, 'knows', (i*7+n)%self.edges) for i in range(self.edges))
+        return shards
+
+    def run_merge(self, backend):
+        db, other = self.shards(backend)
+        start = time()
+        for src, name, dst in other.list_relations():
+            db.store_relation(src, name, dst)
+        print('{:7.2f}s - {} copying {} relations one at a time'.format(time()-start, backend, self.edges))
+        db._destroy()
+        other._destroy()
+        db, other = self.shards(backend)
+        start = time()
+        db += other
+        print('{:7.2f}s - {} merging {} relations with +='.format(time()-start, backend, self.edges))
+        db._destroy()
+        other._destroy()
+
+    def test_ram(self):
+        self.run_merge('ram')
+
+    def test_sqlite(self):
+        self.run_merge('sqlite')
+
+class AsyncLatencyTest(unittest.TestCase):
+    ''' measures how late a 1ms ticker on the event loop runs while tasks
+        read and write a sqlite file, calling the database directly and
+        through AsyncGraphDB '''
+    tasks = 16
+    operations = 200
+
+    def setUp(self):
+        self.dir = mkdtemp()
+
+    def tearDown(self):
+        rmtree(self.dir)
+
+    def run_load(self, name, wrap):
+        db = SQLiteGraphDB(os.path.join(self.dir, name + '.db'))
+        db.store_relations((i, 'knows', i+1) for i in range(1000))
+        store_relation, find, close = wrap(db)
+        lateness = []
+        done = []
+
+        async def ticker():
+            loop = asyncio.get_event_loop()
+            while not done:
+                start = loop.time()
+                await asyncio.sleep(0.001)
+                lateness.append(loop.time() - start - 0.001)
+
+        async def writer(n):
+            for i in range(self.operations):
+                await store_relation(n, 'wrote', i)
+
+        async def reader(n):
+            for i in range(self.operations):
+                await find((n*self.operations+i)%1000, 'knows')
+
+        async def run():
+            tick = asyncio.ensure_future(ticker())
+            start = time()
+            await asyncio.gather(*(f(n) for n in range(self.tasks) for f in (writer, reader)))
+            took = time() - start
+            done.append(True)
+            await tick
+            return took
+
+        loop = asyncio.new_event_loop()
+        took = loop.run_until_complete(run())
+        loop.run_until_complete(close())
+        loop.close()
+        lateness.sort()
+        print('{:7.2f}ms p50 {:7.2f}ms p99 {:7.2f}ms max event loop lateness, {:.0f} ops/sec - {}'.format(
+            lateness[len(lateness)//2]*1000,
+            lateness[int(len(lateness)*0.99)]*1000,
+            lateness[-1]*1000,
+            self.tasks*self.operations*2/took,
+            name
+        ))
+        db._destroy()
+
+    def test_blocking(self):
+        # the calls finish before the loop gets control back
+        self.run_load('calling sqlite directly', lambda db: (
+            lambda *args: asyncio.sleep(0, db.store_relation(*args)),
+            lambda *args: asyncio.sleep(0, list(db.find(*args))),
+            lambda: asyncio.sleep(0)
+        ))
+
+    def test_async(self):
+        def wrap(db):
+            adb = AsyncGraphDB(db)
+            return adb.store_relation, adb.find, adb.close
+        self.run_load('through AsyncGraphDB', wrap)
+
+class SQLiteLayoutTest(unittest.TestCase):
+    ''' compares find on the single and partitioned layouts as the number
+        of relation names sharing the same edges grows '''
+    edges = 20000
+
+    def run_find(self, layout, names):
+        db = SQLiteGraphDB(layout=layout)
+        db.store_relations(
+            (i%1000, 'relation_{}'.format(i%names), i) for i in range(self.edges)
+        )
+        report('{} layout find with {} relation names'.format(layout, names), rps(
+            lambda:list(db.find(500, 'relation_0'))
+        ))
+        db._destroy()
+
+    def test_single_1_name(self):
+        self.run_find('single', 1)
+
+    def test_single_10_names(self):
+        self.run_find('single', 10)
+
+    def test_single_100_names(self):
+        self.run_find('single', 100)
+
+    def test_partitioned_1_name(self):
+        self.run_find('partitioned', 1)
+
+    def test_partitioned_10_names(self):
+        self.run_find('partitioned', 10)
+
+    def test_partitioned_100_names(self):
+        self.run_find('partitioned', 100)
+
+class TraversalModeTest(unittest.TestCase):
+    ''' compares keeping every path, distinct frontiers and streaming the
+        first result on cyclic and high fan out graphs for both backends '''
+    backends = {'ram': GraphDB, 'sqlite': SQLiteGraphDB}
+
+    def cyclic(self, db):
+        # every node knows the next two so paths double with each hop
+        db.store_relations((i, 'knows', (i+j)%16) for i in range(16) for j in (1, 2))
+        return lambda:db(0).knows.knows.knows.knows.knows.knows.knows.knows.knows.knows
+
+    def fan_out(self, db):
+        # a hub with 1000 members that all share the same 10 tags
+        db.store_relations(('hub', 'member', i) for i in range(1000))
+        db.store_relations((i, 'tagged', 'tag-{}'.format(i%10)) for i in range(1000))
+        return lambda:db('hub').member.tagged
+
+    def run_mode(self, backend, graph, mode):
+        db = self.backends[backend]()
+        traversal = getattr(self, graph)(db)
+        run = {
+            'every path': lambda:list(traversal()()),
+            'distinct': lambda:list(traversal().distinct()()),
+            'first result': lambda:next(traversal()())
+        }[mode]
+        report('{} {} traversal, {}'.format(backend, graph.replace('_', ' '), mode), rps(
+            iter(run, None)
+        ))
+        db._destroy()
+
+    def test_ram_cyclic(self):
+        for mode in ('every path', 'distinct', 'first result'):
+            self.run_mode('ram', 'cyclic', mode)
+
+    def test_sqlite_cyclic(self):
+        for mode in ('every path', 'distinct', 'first result'):
+            self.run_mode('sqlite', 'cyclic', mode)
+
+    def test_ram_fan_out(self):
+        for mode in ('every path', 'distinct', 'first result'):
+            self.run_mode('ram', 'fan_out', mode)
+
+    def test_sqlite_fan_out(self):
+        for mode in ('every path', 'distinct', 'first result'):
+            self.run_mode('sqlite', 'fan_out', mode)
+
+class GraphSearchTest(unittest.TestCase):
+    ''' compares bfs, neighbourhood and shortest_path with chaining
+        traversals by hand on both backends '''
+    backends = {'ram': GraphDB, 'sqlite': SQLiteGraphDB}
+    size = 10000
+
+    def build(self, backend):
+        db = self.backends[backend]()
+        # a ring with shortcuts so paths stay short but revisit nodes often
+        db.store_relations((i, 'knows', (i+1)%self.size) for i in range(self.size))
+        db.store_relations((i, 'knows', (i*7)%self.size) for i in range(self.size))
+        db.store_relations((i, 'knows', (i*13+5)%self.size) for i in range(self.size))
+        return db
+
+    def run_search(self, backend):
+        db = self.build(backend)
+        report('{} 3 hop neighbourhood by chaining traversals'.format(backend), rps(
+            G(count()).map(lambda i:set(db(i%self.size).knows()) | set(db(i%self.size).knows.knows()) | set(db(i%self.size).knows.knows.knows()))
+        ))
+        report('{} 3 hop neighbourhood'.format(backend), rps(
+            G(count()).map(lambda i:list(db.neighbourhood(i%self.size, 3)))
+        ))
+        report('{} bfs of the whole graph'.format(backend), rps(
+            G(count()).map(lambda i:list(db.bfs(i%self.size)))
+        ))
+        report('{} shortest path'.format(backend), rps(
+            G(count()).map(lambda i:db.shortest_path(i%self.size, (i*31+17)%self.size))
+        ))
+        db._destroy()
+
+    def test_ram_search(self):
+        self.run_search('ram')
+
+    def test_sqlite_search(self):
+        self.run_search('sqlite')
+
+class WhereTest(unittest.TestCase):
+    ''' compares where filters by value, which join through the reverse
+        links of the value, with filtering by a function on both backends '''
+    backends = {'ram': GraphDB, 'sqlite': SQLiteGraphDB}
+    candidates = 100000
+
+    def build(self, backend):
+        db = self.backends[backend]()
+        db.store_relations(('root', 'has', i) for i in range(self.candidates))
+        db.store_relations((i, 'even', i % 2 == 0) for i in range(self.candidates))
+        return db
+
+    def run_where(self, backend):
+        db = self.build(backend)
+        for name, where in (
+            ('function', lambda:db('root').has.where('even', lambda i:i==True)),
+            ('value', lambda:db('root').has.where(even=True))
+        ):
+            start = time()
+            found = len(where())
+            took = time() - start
+            print('{:7.3f}s - {} where by {} over {} candidates found {}'.format(took, backend, name, self.candidates, found))
+        db._destroy()
+
+    def test_ram_where(self):
+        self.run_where('ram')
+
+    def test_sqlite_where(self):
+        self.run_where('sqlite')
+
+class CountTest(unittest.TestCase):
+    ''' compares the count and degree apis with counting what listing
+        everything returns on both backends '''
+    backends = {'ram': GraphDB, 'sqlite': SQLiteGraphDB}
+    edges = 100000
+
+    def run_counts(self, backend):
+        db = self.backends[backend]()
+        db.store_relations(('hub', 'has', i) for i in range(self.edges))
+        for name, fn in (
+            ('len(list(list_relations()))', lambda:len(list(db.list_relations()))),
+            ('count_relations()', lambda:db.count_relations()),
+            ('len(list(find(hub, has)))', lambda:len(list(db.find('hub', 'has')))),
+            ('out_degree(hub, has)', lambda:db.out_degree('hub', 'has')),
+            ('len(hub.has)', lambda:len(db('hub').has)),
+            ('hub.has.count()', lambda:db('hub').has.count())
+        ):
+            start = time()
+            counted = fn()
+            print('{:9.6f}s - {} {} = {}'.format(time() - start, backend, name, counted))
+        db._destroy()
+
+    def test_ram_counts(self):
+        self.run_counts('ram')
+
+    def test_sqlite_counts(self):
+        self.run_counts('sqlite')
+
+class InstrumentationTest(unittest.TestCase):
+    ''' measures what instrument() costs while it is on and that nothing
+        is left behind once it is turned off again '''
+    backends = {'ram': GraphDB, 'sqlite': SQLiteGraphDB}
+
+    def run_instrumentation(self, backend):
+        db = self.backends[backend]()
+        db.store_relations((i, 'less_than', i+1) for i in range(1000))
+        for state in ('off', 'on', 'off again'):
+            if state == 'on':
+                db.instrument(slow_query_seconds=0.1)
+            elif state == 'off again':
+                db.instrument(False)
+            report('{} find with instrumentation {}'.format(backend, state), rps(
+                G(count()).map(lambda i:list(db.find(i%1000, 'less_than')))
+            ))
+            report('{} store_relation with instrumentation {}'.format(backend, state), rps(
+                G(count()).map(lambda i:db.store_relation(i%1000, 'greater_than', i%1000-1))
+            ))
+        db._destroy()
+
+    def test_ram_instrumentation(self):
+        self.run_instrumentation('ram')
+
+    def test_sqlite_instrumentation(self):
+        self.run_instrumentation('sqlite')
+
+class SQLiteConcurrencyTest(unittest.TestCase):
+    ''' measures how reader throughput on a WAL database scales with threads
+        while another thread keeps writing '''
+    size = 10000
+
+    def setUp(self):
+        self.dir = mkdtemp()
+        self.db = SQLiteGraphDB(os.path.join(self.dir, 'graph.db'), readers=8)
+        self.db.store_relations((i,'less_than',i+1) for i in range(self.size))
+
+    def tearDown(self):
+        self.db._destroy()
+        rmtree(self.dir)
+
+    def run_readers(self, thread_count, seconds=3):
+        db=self.db
+        stop = Event()
+        reads = [0] * thread_count
+        def read(n):
+            for i in count():
+                if stop.is_set():
+                    break
+                list(db.find(i % self.size, 'less_than'))
+                reads[n] += 1
+        def write():
+            for i in count(self.size):
+                if stop.is_set():
+                    break
+                db.store_relation(i, 'less_than', i+1)
+        threads = [Thread(target=read, args=(n,)) for n in range(thread_count)]
+        threads.append(Thread(target=write))
+        for t in threads:
+            t.start()
+        sleep(seconds)
+        stop.set()
+        for t in threads:
+            t.join()
+        report('sqlite reads with {} reader threads and 1 writer'.format(thread_count), sum(reads)//seconds)
+
+    def test_1_reader(self):
+        self.run_readers(1)
+
+    def test_2_readers(self):
+        self.run_readers(2)
+
+    def test_4_readers(self):
+        self.run_readers(4)
+
+    def test_8_readers(self):
+        self.run_readers(8)
+
 if __name__ == '__main__':
     unittest.TextTestRunner(verbosity=0).run(
         unittest.findTestCases(sys.modules[__name__])
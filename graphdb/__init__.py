@@ -13,16 +13,18 @@ __all__ = ['GraphDB']
 
 from .SQLiteGraphDB import SQLiteGraphDB
 
-def GraphDB(path='', autostore=True, autocommit=True):
+def GraphDB(path='', autostore=True, autocommit=True, cache_size=4096):
+    ''' cache_size is how many objects sqlite databases remember the
+        serialized form and id of, RamGraphDB has no use for it '''
     if path == ':memory:':
         # load sqlite engine if sqlite syntax for ram db used
-        return SQLiteGraphDB(path=path, autostore=autostore, autocommit=autocommit)
+        return SQLiteGraphDB(path=path, autostore=autostore, autocommit=autocommit, cache_size=cache_size)
     elif path == '' and  sys.version_info > (3,0):
         # load in high peformance ram db if no path specified and running py3+
         return RamGraphDB(autostore=autostore)
     else:
         # if path is specified provide sqlite engine
-        return SQLiteGraphDB(path=path, autostore=autostore, autocommit=autocommit)
+        return SQLiteGraphDB(path=path, autostore=autostore, autocommit=autocommit, cache_size=cache_size)
 
 class DummyRamGraphDB(SQLiteGraphDB):
         '''dummy RamGraphDB that uses sqlite for backwards compatability'''
@@ -31,6 +33,8 @@ class DummyRamGraphDB(SQLiteGraphDB):
 
 if sys.version_info >= (3, 6):
     from .RamGraphDB import RamGraphDB
+    from .AsyncGraphDB import AsyncGraphDB
+    __all__.append('AsyncGraphDB')
 else:
     RamGraphDB = DummyRamGraphDB
 
@@ -6,7 +6,10 @@
 
 from sys import argv
 import graphdb
+import graphdb.io
+import graphdb.bench
 import argparse
+import sys
 
 parser = argparse.ArgumentParser(prog='__main__.py')
 
@@ -16,6 +19,100 @@ parser.add_argument(
     action='store_true'
 )
 
+parser.add_argument(
+    '--bench',
+    help='run the benchmark sweep and write its results as json',
+    action='store_true'
+)
+
+def names(choices):
+    ''' parses a comma separated list of names from choices '''
+    def parse(value):
+        out = value.split(',')
+        for i in out:
+            if i not in choices:
+                raise argparse.ArgumentTypeError('{} is not one of {}'.format(i, ', '.join(choices)))
+        return out
+    return parse
+
+bench = parser.add_argument_group('benchmark options')
+
+bench.add_argument(
+    '--sizes',
+    type=lambda value: [int(float(i)) for i in value.split(',')],
+    default=list(graphdb.bench.sizes),
+    help='comma separated graph sizes in edges, defaults to 1e3 through 1e7'
+)
+
+bench.add_argument(
+    '--backends',
+    type=names(tuple(graphdb.bench.backends)),
+    default=list(graphdb.bench.backends),
+    help='comma separated backends to run, defaults to {}'.format(','.join(graphdb.bench.backends))
+)
+
+bench.add_argument(
+    '--topologies',
+    type=names(tuple(graphdb.bench.topologies)),
+    default=list(graphdb.bench.topologies),
+    help='comma separated topologies to run, defaults to {}'.format(','.join(graphdb.bench.topologies))
+)
+
+bench.add_argument(
+    '--workloads',
+    type=names(tuple(graphdb.bench.workloads)),
+    help='comma separated workloads to run, defaults to {}'.format(','.join(graphdb.bench.workloads))
+)
+
+bench.add_argument(
+    '--samples',
+    type=int,
+    default=1000,
+    help='calls each per object workload makes'
+)
+
+bench.add_argument(
+    '--output',
+    help='file to write the json results to instead of stdout'
+)
+
+bench.add_argument(
+    '--baseline',
+    help='json results of an earlier run to report regressions against'
+)
+
+bench.add_argument(
+    '--tolerance',
+    type=float,
+    default=0.25,
+    help='how much worse than the baseline a result can be before it is a regression'
+)
+
+parser.add_argument(
+    'command',
+    nargs='?',
+    choices=('import', 'export'),
+    help='import an edge list into a database or export a database as one'
+)
+
+parser.add_argument(
+    'db',
+    nargs='?',
+    help='path of the sqlite database to import into or export from'
+)
+
+parser.add_argument(
+    'edges',
+    nargs='?',
+    help='path of the edge list to read or write'
+)
+
+parser.add_argument(
+    '--format',
+    choices=sorted(graphdb.io.formats),
+    help='format of the edge list, defaults to what its extension implies'
+)
+
 if '__main__.py' in argv[-1] or 'help' in argv:
     parsed = parser.parse_args(['-h'])
 
@@ -28,3 +125,28 @@ if args.test:
     print('-'*80)
     print('all tests were successful')
     print('-'*80)
+
+if args.bench:
+    regressions = graphdb.bench.main(
+        args.sizes,
+        args.backends,
+        args.topologies,
+        args.workloads,
+        args.samples,
+        args.output,
+        args.baseline,
+        args.tolerance
+    )
+    if regressions:
+        sys.exit(1)
+
+if args.command is not None:
+    if args.db is None or args.edges is None:
+        parser.error('{} needs a database and an edge list path'.format(args.command))
+    db = graphdb.GraphDB(args.db)
+    if args.command == 'import':
+        rows = graphdb.io.load_edges(db, args.edges, args.format)
+    else:
+        rows = graphdb.io.dump_edges(db, args.edges, args.format)
+    db.close()
+    print('{}ed {} relations'.format(args.command, rows))
@@ -0,0 +1,340 @@
+''' benchmark sweeps over graph sizes, backends and topologies with results
+    that can be saved as json and compared with an earlier run. run it with
+    python -m graphdb --bench. every (backend, topology, size) case builds
+    its graph in a fresh process so peak memory belongs to that case alone.
+
+    each workload times calls on the graph and records how many items went
+    through them per second, the p50 and p99 latency of a call and the peak
+    resident memory of the case so far:
+        insert    - store_relations of insert_batch relations per call
+        lookup    - find from one object per call
+        traversal - neighbourhood of traversal_hops hops from one object per call
+        where     - count of the neighbours of one object kept by where(even=True)
+        scan      - list_relations over the whole graph in one call
+        replace   - replace_item of one object per call
+        delete    - delete_item of one object per call '''
+
+from collections import namedtuple
+from concurrent.futures import ProcessPoolExecutor
+from multiprocessing import get_context
+from os.path import join
+from random import Random
+from shutil import rmtree
+from tempfile import mkdtemp
+from time import perf_counter
+import json
+import platform
+import sys
+
+try:
+    import resource
+except ImportError: # windows
+    resource = None
+
+__all__ = ['sizes', 'backends', 'topologies', 'workloads', 'run_case', 'sweep', 'compare']
+
+# every size a full sweep runs, in edges
+sizes = (10**3, 10**4, 10**5, 10**6, 10**7)
+
+# relations stored per insert call
+insert_batch = 1000
+
+# hops the traversal workload follows
+traversal_hops = 3
+
+def _ram(dir):
+    from . import RamGraphDB
+    return RamGraphDB()
+
+def _sqlite_memory(dir):
+    from . import SQLiteGraphDB
+    return SQLiteGraphDB(':memory:')
+
+def _sqlite_file(dir):
+    from . import SQLiteGraphDB
+    return SQLiteGraphDB(join(dir, 'bench.db'))
+
+# name: function that opens an empty database in a scratch directory
+backends = {
+    'ram': _ram,
+    'sqlite-memory': _sqlite_memory,
+    'sqlite-file': _sqlite_file
+}
+
+# relations(edges, rng) generates (src, 'next', dst) of about edges links
+# and node(edges, rng) picks an object that has links
+Topology = namedtuple('Topology', ('relations', 'node'))
+
+# nodes on each cycle and leaves on each star
+group_size = 1000
+
+def _chain(edges, rng):
+    return ((i, 'next', i+1) for i in range(edges))
+
+def _cycles(edges, rng):
+    size = min(group_size, edges)
+    return ((i, 'next', i - i % size + (i+1) % size) for i in range(edges))
+
+def _stars(edges, rng):
+    # hubs are negative so they never collide with leaves
+    return ((-(i // group_size) - 1, 'next', i) for i in range(edges))
+
+def _power_law_nodes(edges):
+    return max(2, edges // 4)
+
+def _power_law(edges, rng):
+    # every node links to four others picked with a skew towards low ids
+    # so in degrees follow a power law with a few very popular nodes
+    nodes = _power_law_nodes(edges)
+    return ((i % nodes, 'next', int(nodes * rng.random() ** 3)) for i in range(edges))
+
+topologies = {
+    'chain': Topology(_chain, lambda edges, rng: rng.randrange(edges)),
+    'cycles': Topology(_cycles, lambda edges, rng: rng.randrange(edges)),
+    'stars': Topology(_stars, lambda edges, rng: -rng.randrange(max(1, edges // group_size)) - 1),
+    'power-law': Topology(_power_law, lambda edges, rng: rng.randrange(_power_law_nodes(edges)))
+}
+
+def _insert(db, case):
+    relations = iter(case.topology.relations(case.edges, case.rng))
+    while True:
+        batch = [i for i, _ in zip(relations, range(insert_batch))]
+        if not batch:
+            return
+        with case.timer(len(batch)):
+            db.store_relations(batch)
+
+def _lookup(db, case):
+    for node in case.nodes():
+        with case.timer():
+            for obj in db.find(node, 'next'):
+                pass
+
+def _traversal(db, case):
+    for node in case.nodes():
+        with case.timer():
+            for obj in db.neighbourhood(node, traversal_hops):
+                pass
+
+def _where(db, case):
+    nodes = list(case.nodes())
+    # only the neighbours of the nodes that are looked at get the attribute
+    db.store_relations((i, 'even', i % 2 == 0) for node in nodes for i in db(node).next())
+    for node in nodes:
+        with case.timer():
+            db(node).next.where(even=True).count()
+
+def _scan(db, case):
+    with case.timer() as timed:
+        timed.items = sum(1 for i in db.list_relations())
+
+def _replace(db, case):
+    for node in case.nodes():
+        if node in db:
+            with case.timer():
+                db.replace_item(node, ('replaced', node))
+
+def _delete(db, case):
+    for node in case.nodes():
+        # the replace workload can have renamed it
+        if node not in db:
+            node = 'replaced', node
+        if node in db:
+            with case.timer():
+                db.delete_item(node)
+
+# name: function(db, case) that times calls with case.timer. they run in
+# this order on the same graph, so the ones that change it come last.
+workloads = {
+    'insert': _insert,
+    'lookup': _lookup,
+    'traversal': _traversal,
+    'where': _where,
+    'scan': _scan,
+    'replace': _replace,
+    'delete': _delete
+}
+
+def _peak_rss():
+    ''' returns the most memory this process has held in bytes or None '''
+    if resource is None:
+        return None
+    # linux reports kilobytes and macos bytes
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * (1 if sys.platform == 'darwin' else 1024)
+
+def _percentile(ordered, q):
+    ''' returns the nearest rank q quantile of the ordered values '''
+    return ordered[int(round(q * (len(ordered) - 1)))] if ordered else None
+
+class _Timed(object):
+    __slots__ = ('case', 'items', 'start')
+
+    def __init__(self, case, items):
+        self.case = case
+        self.items = items
+
+    def __enter__(self):
+        self.start = perf_counter()
+        return self
+
+    def __exit__(self, *args):
+        took = perf_counter() - self.start
+        if args[0] is None:
+            self.case.latencies.append(took)
+            self.case.items += self.items
+
+class _Case(object):
+    ''' what the workloads of one (backend, topology, size) share '''
+
+    def __init__(self, topology, edges, samples, seed):
+        self.topology = topology
+        self.edges = edges
+        self.samples = samples
+        self.rng = Random(seed)
+        self.latencies = []
+        self.items = 0
+
+    def timer(self, items=1):
+        ''' times the with block as one call that handled items '''
+        return _Timed(self, items)
+
+    def nodes(self):
+        ''' generates the different objects a workload runs its calls on '''
+        seen = set()
+        for _ in range(self.samples * 4):
+            node = self.topology.node(self.edges, self.rng)
+            if node not in seen:
+                seen.add(node)
+                yield node
+                if len(seen) == self.samples:
+                    return
+
+def run_case(backend, topology, edges, names=None, samples=1000, seed=0):
+    ''' runs the workloads in names, or every workload, on a graph of about
+        edges links of topology in backend and returns a result dict for
+        each of them. samples is how many calls the per object workloads
+        make. this runs in the current process. '''
+    assert backend in backends, 'unknown backend: {}'.format(backend)
+    assert topology in topologies, 'unknown topology: {}'.format(topology)
+    assert isinstance(edges, int) and edges > 0, edges  # edges needs to be a positive int
+    names = [i for i in workloads if names is None or i in names]
+    dir = mkdtemp()
+    db = backends[backend](dir)
+    case = _Case(topologies[topology], edges, samples, seed)
+    results = []
+    try:
+        # the graph is needed by every other workload
+        for name in ['insert'] + [i for i in names if i != 'insert']:
+            case.latencies, case.items = [], 0
+            start = perf_counter()
+            workloads[name](db, case)
+            seconds = perf_counter() - start
+            if name not in names:
+                continue
+            latencies = sorted(case.latencies)
+            timed = sum(latencies)
+            results.append({
+                'backend': backend,
+                'topology': topology,
+                'edges': edges,
+                'workload': name,
+                'calls': len(latencies),
+                'items': case.items,
+                'seconds': seconds,
+                'throughput': case.items / timed if timed else None,
+                'p50': _percentile(latencies, 0.5),
+                'p99': _percentile(latencies, 0.99),
+                'peak_rss': _peak_rss()
+            })
+    finally:
+        # the process ends with the case so nothing needs to be deleted
+        if hasattr(db, 'close'):
+            db.close()
+        rmtree(dir, ignore_errors=True)
+    return results
+
+def sweep(sizes=sizes, backends=tuple(backends), topologies=tuple(topologies), names=None, samples=1000, seed=0, report=None):
+    ''' runs every (backend, topology, size) case in a fresh process and
+        returns the results with what they ran on as a json ready dict.
+        report is called with each result as soon as it is in. '''
+    results = []
+    for edges in sizes:
+        for backend in backends:
+            for topology in topologies:
+                with ProcessPoolExecutor(1, mp_context=get_context('spawn')) as pool:
+                    for result in pool.submit(run_case, backend, topology, edges, names, samples, seed).result():
+                        results.append(result)
+                        if report is not None:
+                            report(result)
+    return {
+        'python': platform.python_version(),
+        'implementation': platform.python_implementation(),
+        'machine': platform.machine(),
+        'samples': samples,
+        'seed': seed,
+        'results': results
+    }
+
+def _key(result):
+    return result['backend'], result['topology'], result['edges'], result['workload']
+
+# metric: True if bigger is better
+compared_metrics = {'throughput': True, 'p99': False, 'peak_rss': False}
+
+def compare(run, baseline, tolerance=0.25):
+    ''' returns a dict for every metric of run that is more than tolerance
+        worse than the same case in baseline, which is an earlier run as
+        returned by sweep or loaded from its json '''
+    assert isinstance(tolerance, (int, float)) and tolerance >= 0, tolerance  # tolerance needs to be a non negative number
+    before = {_key(i): i for i in baseline['results']}
+    regressions = []
+    for result in run['results']:
+        old = before.get(_key(result))
+        if old is None:
+            continue
+        for metric, higher_is_better in compared_metrics.items():
+            was, now = old.get(metric), result.get(metric)
+            if not was or now is None:
+                continue
+            change = (now - was) / was
+            if (-change if higher_is_better else change) > tolerance:
+                regression = dict(zip(('backend', 'topology', 'edges', 'workload'), _key(result)))
+                regression.update(metric=metric, baseline=was, current=now, change=change)
+                regressions.append(regression)
+    return regressions
+
+def format_result(result):
+    ''' returns a result as one line of text '''
+    def ms(seconds):
+        return '-' if seconds is None else '{:.3f}ms'.format(seconds * 1000)
+    return '{:>13} {:>9} {:>8} {:>9} {:>12}/sec p50 {:>10} p99 {:>10} peak {:>6}MB'.format(
+        result['backend'],
+        result['topology'],
+        result['edges'],
+        result['workload'],
+        '-' if result['throughput'] is None else int(result['throughput']),
+        ms(result['p50']),
+        ms(result['p99']),
+        '-' if result['peak_rss'] is None else result['peak_rss'] // 2**20
+    )
+
+def format_regression(regression):
+    return 'regression: {backend} {topology} {edges} {workload} {metric} went from {baseline:.6g} to {current:.6g} ({change:+.0%})'.format(**regression)
+
+def main(sizes=sizes, backends=tuple(backends), topologies=tuple(topologies), names=None, samples=1000, output=None, baseline=None, tolerance=0.25):
+    ''' runs a sweep for the command line, writes its json to output or
+        stdout and returns how many regressions it has against baseline '''
+    run = sweep(sizes, backends, topologies, names, samples, report=lambda i: print(format_result(i), file=sys.stderr))
+    if output is None:
+        json.dump(run, sys.stdout, indent=2)
+        print()
+    else:
+        with open(output, 'w') as f:
+            json.dump(run, f, indent=2)
+    regressions = []
+    if baseline is not None:
+        with open(baseline) as f:
+            regressions = compare(run, json.load(f), tolerance)
+        for regression in regressions:
+            print(format_regression(regression), file=sys.stderr)
+    return len(regressions)
@@ -0,0 +1,161 @@
+''' streaming edge list import and export for every backend. edge lists
+    are read and written a row at a time so files of any size only need
+    memory for the batch being stored.
+
+    formats:
+        csv    - src,relation,dst rows of text. objects are written with
+                 str and read back as strings.
+        jsonl  - a [src, relation, dst] json array per line. arrays are
+                 read back as tuples so they stay hashable.
+        binary - each object is written once as tagged bytes and edges
+                 refer to objects and relation names by the order they
+                 were first written in. '''
+
+from itertools import islice
+from os.path import splitext
+import csv
+import json
+
+from .serializers import tagged_dumps, tagged_loads, varint, read_varint
+
+__all__ = ['formats', 'load_edges', 'dump_edges']
+
+binary_magic = b'graphdb-edges\x01'
+
+def _format_of(path, format):
+    ''' returns format or the format the extension of path implies '''
+    if format is None:
+        format = {'.csv': 'csv', '.jsonl': 'jsonl', '.json': 'jsonl'}.get(splitext(path)[1].lower(), 'binary')
+    assert format in formats, 'unknown edge list format: {}'.format(format)
+    return format
+
+def _read_csv(f):
+    for row in csv.reader(f):
+        if row:
+            assert len(row) == 3, 'csv edge rows need to be src,relation,dst: {}'.format(row)
+            yield tuple(row)
+
+def _write_csv(f, relations):
+    writer = csv.writer(f, lineterminator='\n')
+    for row in relations:
+        writer.writerow(row)
+        yield row
+
+def _tuples(obj):
+    ''' turns json arrays into tuples all the way down '''
+    if isinstance(obj, list):
+        return tuple(_tuples(i) for i in obj)
+    if isinstance(obj, dict):
+        return {k: _tuples(v) for k, v in obj.items()}
+    return obj
+
+def _read_jsonl(f):
+    for line in f:
+        if line.strip():
+            src, name, dst = json.loads(line)
+            yield _tuples(src), name, _tuples(dst)
+
+def _write_jsonl(f, relations):
+    for row in relations:
+        f.write(json.dumps(row))
+        f.write('\n')
+        yield row
+
+def _read_binary(f, block_size=2**20):
+    ''' reads o(bject), n(ame) and e(dge) records. records that run past
+        the end of the buffer are parsed again once more is read. '''
+    assert f.read(len(binary_magic)) == binary_magic, 'not a binary graphdb edge list'
+    objects, names = [], []
+    data, i = f.read(block_size), 0
+    while True:
+        start = i
+        try:
+            kind = data[i]
+            if kind == 0x65: # e
+                src, i = read_varint(data, i+1)
+                name, i = read_varint(data, i)
+                dst, i = read_varint(data, i)
+            else:
+                size, i = read_varint(data, i+1)
+                if i + size > len(data):
+                    raise IndexError(i + size)
+        except IndexError:
+            more = f.read(max(block_size, len(data) - start))
+            if not more:
+                if start < len(data):
+                    raise ValueError('truncated binary edge list')
+                return
+            data, i = data[start:] + more, 0
+            continue
+        if kind == 0x65:
+            yield objects[src], names[name], objects[dst]
+            continue
+        if kind == 0x6f: # o
+            objects.append(tagged_loads(data[i:i+size]))
+        elif kind == 0x6e: # n
+            names.append(data[i:i+size].decode('utf-8'))
+        else:
+            raise ValueError('corrupt binary edge list')
+        i += size
+
+def _write_binary(f, relations, buffer_size=2**16):
+    f.write(binary_magic)
+    # tagged code: id so equal objects are only written once
+    objects, names = {}, {}
+    out = bytearray()
+    for row in relations:
+        src, name, dst = row
+        ids = []
+        for obj in (src, dst):
+            code = tagged_dumps(obj)
+            i = objects.get(code)
+            if i is None:
+                i = objects[code] = len(objects)
+                out += b'o' + varint(len(code)) + code
+            ids.append(i)
+        n = names.get(name)
+        if n is None:
+            n = names[name] = len(names)
+            code = name.encode('utf-8')
+            out += b'n' + varint(len(code)) + code
+        out += b'e' + varint(ids[0]) + varint(n) + varint(ids[1])
+        if len(out) >= buffer_size:
+            f.write(out)
+            del out[:]
+        yield row
+    f.write(out)
+
+# format: (open mode, reader, writer)
+formats = {
+    'csv': ('', _read_csv, _write_csv),
+    'jsonl': ('', _read_jsonl, _write_jsonl),
+    'binary': ('b', _read_binary, _write_binary)
+}
+
+def load_edges(db, path, format=None, batch_size=4096):
+    ''' stores every (src, relation, dst) in the edge list at path in db and
+        returns how many rows were read. rows are stored batch_size at a
+        time in one transaction each. format is csv, jsonl or binary and
+        defaults to what the extension of path implies. '''
+    assert isinstance(batch_size, int) and batch_size > 0, batch_size  # batch_size needs to be a positive int
+    mode, read, write = formats[_format_of(path, format)]
+    rows = 0
+    with open(path, 'r' + mode, **({} if mode else {'newline': '', 'encoding': 'utf-8'})) as f:
+        relations = read(f)
+        # islice instead of gen.chunks so nothing past a batch is read before it is stored
+        for chunk in iter(lambda: tuple(islice(relations, batch_size)), ()):
+            with db.transaction():
+                db.store_relations(chunk)
+            rows += len(chunk)
+    return rows
+
+def dump_edges(db, path, format=None):
+    ''' writes every relation in db to an edge list at path and returns how
+        many rows were written. format is csv, jsonl or binary and defaults
+        to what the extension of path implies. '''
+    mode, read, write = formats[_format_of(path, format)]
+    rows = 0
+    with open(path, 'w' + mode, **({} if mode else {'newline': '', 'encoding': 'utf-8'})) as f:
+        for row in write(f, db.list_relations()):
+            rows += 1
+    return rows
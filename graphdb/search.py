@@ -0,0 +1,92 @@
+''' graph searches shared by every backend. backends provide how to step
+    from a set of nodes and these only deal with the keys they hand back,
+    which are RamGraphDBNodes in ram and object ids in sqlite. '''
+
+__all__ = ['relation_names', 'bidirectional_path', 'equivalent_values', 'listed_types']
+
+# objects of exactly these types only ever == values of the types
+# equivalent_values lists every equal form of. anything else, like a
+# Fraction or a subclass of int, can == values it knows nothing about.
+listed_types = frozenset({type(None), bool, int, float, str, bytes, tuple})
+
+def relation_names(relations):
+    ''' returns the relation names a search follows as a tuple, or None to
+        follow every relation. relations can be one name or many. '''
+    if relations is None:
+        return None
+    if isinstance(relations, str):
+        relations = relations,
+    relations = tuple(relations)
+    assert all(isinstance(i, str) and i for i in relations), relations  # relations need to be non-empty strings
+    return relations
+
+def equivalent_values(value):
+    ''' returns the values of builtin types that == value and are stored
+        as something else, or None if that cant be known for its type.
+        where filters match these through the reverse links of each when
+        every object they compare with is of one of listed_types. '''
+    value_type = type(value)
+    if value_type in {type(None), str, bytes}:
+        return (value,)
+    if value_type not in {bool, int, float}:
+        return None
+    if value != value: # nan is never equal to anything
+        return ()
+    out = [value]
+    if value_type is float and value.is_integer():
+        out.append(int(value))
+    if value_type is not float:
+        try:
+            if float(value) == value:
+                out.append(float(value))
+        except OverflowError:
+            pass
+    if value == 0:
+        out.extend((False, 0, 0.0, -0.0))
+    elif value == 1:
+        out.extend((True, 1, 1.0))
+    # hex keeps 0.0 and -0.0 apart since they are stored differently
+    return tuple({(type(i), i.hex() if type(i) is float else i): i for i in out}.values())
+
+def _join(meeting, forward, backward):
+    ''' returns the keys from the start of forward to the start of backward
+        through meeting, where both map a key to its (parent, depth) '''
+    path = []
+    key = meeting
+    while key is not None:
+        path.append(key)
+        key = forward[key][0]
+    path.reverse()
+    key = backward[meeting][0]
+    while key is not None:
+        path.append(key)
+        key = backward[key][0]
+    return path
+
+def bidirectional_path(src, dst, expand):
+    ''' returns the keys of a shortest path from src to dst or None if dst
+        cant be reached. expand(keys, reverse) generates (key, other) for
+        every link from each of keys to other, or from other to each of keys
+        if reverse is True. the side with the smaller frontier steps next
+        so both searches only cover about half the depth of the path. '''
+    if src == dst:
+        return [src]
+    forward, backward = {src: (None, 0)}, {dst: (None, 0)}
+    frontiers = [src], [dst]
+    while frontiers[0] and frontiers[1]:
+        reverse = len(frontiers[1]) < len(frontiers[0])
+        seen, other = (backward, forward) if reverse else (forward, backward)
+        frontier, best = [], None
+        for key, step in expand(frontiers[reverse], reverse):
+            if step in seen:
+                continue
+            seen[step] = key, seen[key][1] + 1
+            frontier.append(step)
+            # the whole level is finished since a later meeting can be
+            # deeper on the other side than an earlier one
+            if step in other and (best is None or other[step][1] < other[best][1]):
+                best = step
+        if best is not None:
+            return _join(best, forward, backward)
+        frontiers = (frontiers[0], frontier) if reverse else (frontier, frontiers[1])
+    return None
@@ -0,0 +1,109 @@
+''' serializers SQLiteGraphDB can store objects with. every database file
+    records the name of the serializer it was written with in graphdb_meta
+    so files written in older formats stay readable. '''
+
+from base64 import b64encode as b64e, b64decode as b64d
+from collections import namedtuple
+from struct import pack, unpack
+import dill
+
+__all__ = ['Serializer', 'serializers', 'register_serializer', 'default_serializer']
+
+Serializer = namedtuple('Serializer', ('dumps', 'loads'))
+
+# name: Serializer
+serializers = {}
+
+def register_serializer(name, dumps, loads):
+    ''' makes a serializer available to SQLiteGraphDB under name. dumps
+        needs to return bytes and always return the same bytes for equal
+        objects since objects are matched by what they serialize to. '''
+    assert isinstance(name, str), name  # name needs to be a string
+    assert callable(dumps), dumps  # dumps needs to be callable
+    assert callable(loads), loads  # loads needs to be callable
+    serializers[name] = Serializer(dumps, loads)
+    return serializers[name]
+
+def dill_dumps(obj):
+    return dill.dumps(obj, protocol=dill.HIGHEST_PROTOCOL)
+
+# the original format. b64e was used on top of dumps because python lost
+# data when encoding dilled objects as sqlite text
+register_serializer(
+    'base64-dill',
+    lambda obj: b64e(dill_dumps(obj)),
+    lambda code: dill.loads(b64d(code))
+)
+
+def varint(n):
+    ''' encodes a non negative int in 7 bit groups '''
+    out = bytearray()
+    while n > 0x7f:
+        out.append(0x80 | (n & 0x7f))
+        n >>= 7
+    out.append(n)
+    return bytes(out)
+
+def read_varint(code, i):
+    ''' returns the varint starting at code[i] and the index after it '''
+    n = shift = 0
+    while True:
+        b = code[i]
+        i += 1
+        n |= (b & 0x7f) << shift
+        if b < 0x80:
+            return n, i
+        shift += 7
+
+def _dump_tuple(obj):
+    parts = [tagged_dumps(i) for i in obj]
+    return b'(' + b''.join(varint(len(i)) + i for i in parts)
+
+def _load_tuple(code):
+    out = []
+    i, end = 1, len(code)
+    while i < end:
+        size, i = read_varint(code, i)
+        out.append(tagged_loads(code[i:i+size]))
+        i += size
+    return tuple(out)
+
+# exact type: dumps. subclasses go through dill so they keep their type.
+_dumpers = {
+    type(None): lambda obj: b'N',
+    bool: lambda obj: b'T' if obj else b'F',
+    int: lambda obj: b'i' + obj.to_bytes(obj.bit_length() // 8 + 1, 'big', signed=True),
+    float: lambda obj: b'f' + pack('>d', obj),
+    str: lambda obj: b's' + obj.encode('utf-8', 'surrogatepass'),
+    bytes: lambda obj: b'b' + obj,
+    tuple: _dump_tuple
+}
+
+# first byte of the code: loads
+_loaders = {
+    ord('N'): lambda code: None,
+    ord('T'): lambda code: True,
+    ord('F'): lambda code: False,
+    ord('i'): lambda code: int.from_bytes(code[1:], 'big', signed=True),
+    ord('f'): lambda code: unpack('>d', code[1:])[0],
+    ord('s'): lambda code: code[1:].decode('utf-8', 'surrogatepass'),
+    ord('b'): lambda code: bytes(code[1:]),
+    ord('('): _load_tuple,
+    ord('d'): lambda code: dill.loads(code[1:])
+}
+
+def tagged_dumps(obj):
+    ''' encodes primitives and tuples of them as a one byte type tag
+        followed by a compact payload. everything else is dilled. '''
+    dumps = _dumpers.get(type(obj))
+    if dumps is None:
+        return b'd' + dill_dumps(obj)
+    return dumps(obj)
+
+def tagged_loads(code):
+    return _loaders[code[0]](code)
+
+register_serializer('tagged', tagged_dumps, tagged_loads)
+
+# what new database files are written with
+default_serializer = 'tagged'
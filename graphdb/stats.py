@@ -0,0 +1,243 @@
+''' opt in instrumentation for both backends. db.instrument() puts timed
+    wrappers over the public methods of one database, its write lock and,
+    in sqlite, its statement and serializer methods. db.instrument(False)
+    takes them off again, so a database that is not instrumented runs the
+    exact same code it always did.
+
+    what is recorded:
+        operations  - latency of each outermost call to a public method.
+                      methods that return iterators are timed while they
+                      are iterated and recorded once they finish.
+        serialize   - time spent turning objects into codes
+        deserialize - time spent turning codes back into objects
+        execute     - time sqlite spends running statements and fetching rows
+        lock_wait   - time spent waiting to get the write lock
+        statements  - count and time of each sql statement with its numbers
+                      replaced by ? so generated queries group together
+        slow        - the newest statements that took slow_query_seconds or
+                      longer, which are also logged to the graphdb logger '''
+
+from collections import deque
+from functools import wraps
+from threading import Lock, local
+from time import perf_counter, time
+import logging
+import re
+
+__all__ = ['Histogram', 'Instrumentation', 'instrument']
+
+logger = logging.getLogger('graphdb')
+
+class Histogram(object):
+    ''' latencies counted in power of two buckets of microseconds '''
+    __slots__ = ('count', 'total', 'max', 'buckets')
+
+    def __init__(self):
+        self.count = 0
+        self.total = 0.0
+        self.max = 0.0
+        self.buckets = [0] * 40
+
+    def add(self, seconds):
+        self.count += 1
+        self.total += seconds
+        if seconds > self.max:
+            self.max = seconds
+        self.buckets[min(int(seconds * 1e6).bit_length(), 39)] += 1
+
+    def percentile(self, q):
+        ''' returns the upper bound in seconds of the bucket holding the q quantile '''
+        rank = q * self.count
+        seen = 0
+        for i, n in enumerate(self.buckets):
+            seen += n
+            if n and seen >= rank:
+                return min(2 ** i / 1e6, self.max)
+        return self.max
+
+    def as_dict(self):
+        return {
+            'count': self.count,
+            'total': self.total,
+            'mean': self.total / self.count if self.count else 0.0,
+            'max': self.max,
+            'p50': self.percentile(0.5),
+            'p99': self.percentile(0.99)
+        }
+
+# numbers written into sql and lists of them
+_sql_number = r'(?<![\w.])-?\d+(?:\.\d+)?\b'
+_sql_numbers = re.compile(_sql_number)
+_sql_number_lists = re.compile(r'{0}(?:\s*,\s*{0})+'.format(_sql_number))
+
+def statement_key(sql):
+    ''' returns sql on one line with its numbers as ? so queries with ids
+        written into them are counted as one statement '''
+    return _sql_numbers.sub('?', _sql_number_lists.sub('?, ...', ' '.join(sql.split())))
+
+class Instrumentation(object):
+    ''' the stats of one instrumented database. hook is called with the
+        (kind, name, seconds) of everything recorded, where kind is one of
+        operation, serialize, deserialize, execute, lock_wait or slow. '''
+
+    def __init__(self, slow_query_seconds=None, hook=None, slow_queries=100):
+        assert slow_query_seconds is None or (isinstance(slow_query_seconds, (int, float)) and slow_query_seconds >= 0), slow_query_seconds  # slow_query_seconds needs to be None or a non negative number
+        assert hook is None or callable(hook), hook  # hook needs to be callable
+        self.slow_query_seconds = slow_query_seconds
+        self.hook = hook
+        self.operations = {} # method name: Histogram
+        self.timers = {kind: Histogram() for kind in ('serialize', 'deserialize', 'execute', 'lock_wait')}
+        self.statements = {} # statement_key: Histogram
+        self.slow = deque(maxlen=slow_queries)
+        self._lock = Lock()
+        self._local = local()
+
+    def record(self, kind, name, seconds):
+        with self._lock:
+            if kind == 'operation':
+                histogram = self.operations.get(name)
+                if histogram is None:
+                    histogram = self.operations[name] = Histogram()
+            else:
+                histogram = self.timers[kind]
+            histogram.add(seconds)
+        if self.hook is not None:
+            self.hook(kind, name, seconds)
+
+    def record_statement(self, sql, seconds):
+        key = statement_key(sql)
+        with self._lock:
+            self.timers['execute'].add(seconds)
+            histogram = self.statements.get(key)
+            if histogram is None:
+                histogram = self.statements[key] = Histogram()
+            histogram.add(seconds)
+        if self.hook is not None:
+            self.hook('execute', key, seconds)
+        if self.slow_query_seconds is not None and seconds >= self.slow_query_seconds:
+            sql = ' '.join(sql.split())
+            self.slow.append({'sql': sql, 'seconds': seconds, 'time': time()})
+            logger.warning('slow query took %.6fs: %s', seconds, sql)
+            if self.hook is not None:
+                self.hook('slow', sql, seconds)
+
+    @staticmethod
+    def _timed_rows(rows, done, state=None):
+        ''' yields from rows and calls done with the seconds spent getting
+            them. state is the thread local depth of wrapped calls to raise
+            while a row is fetched, if there is one. '''
+        took = 0.0
+        try:
+            while True:
+                start = perf_counter()
+                if state is not None:
+                    state.depth = getattr(state, 'depth', 0) + 1
+                try:
+                    row = next(rows)
+                except StopIteration:
+                    return
+                finally:
+                    if state is not None:
+                        state.depth -= 1
+                    took += perf_counter() - start
+                yield row
+        finally:
+            done(took)
+
+    def operation(self, name, method):
+        ''' wraps a bound method so its outermost calls are recorded as name.
+            calls it makes to other wrapped methods are part of its time. '''
+        state = self._local
+        @wraps(method)
+        def wrapper(*args, **kwargs):
+            if getattr(state, 'depth', 0):
+                return method(*args, **kwargs)
+            start = perf_counter()
+            state.depth = 1
+            try:
+                out = method(*args, **kwargs)
+            finally:
+                state.depth = 0
+            took = perf_counter() - start
+            if hasattr(out, '__next__'):
+                return self._timed_rows(out, lambda rest: self.record('operation', name, took + rest), state)
+            self.record('operation', name, took)
+            return out
+        return wrapper
+
+    def timed(self, kind, method):
+        ''' wraps a bound method so every call is recorded as kind '''
+        @wraps(method)
+        def wrapper(*args):
+            start = perf_counter()
+            try:
+                return method(*args)
+            finally:
+                self.record(kind, method.__name__, perf_counter() - start)
+        return wrapper
+
+    def statement(self, method):
+        ''' wraps a bound method that runs the sql in its first argument '''
+        @wraps(method)
+        def wrapper(sql, *args):
+            start = perf_counter()
+            out = method(sql, *args)
+            took = perf_counter() - start
+            if hasattr(out, '__next__') and not hasattr(out, 'fetchone'):
+                return self._timed_rows(out, lambda rest: self.record_statement(sql, took + rest))
+            self.record_statement(sql, took)
+            return out
+        return wrapper
+
+    def stats(self):
+        ''' returns everything recorded as a dict '''
+        with self._lock:
+            out = {kind: histogram.as_dict() for kind, histogram in self.timers.items()}
+            out['operations'] = {name: histogram.as_dict() for name, histogram in self.operations.items()}
+            out['statements'] = {sql: histogram.as_dict() for sql, histogram in self.statements.items()}
+            out['slow'] = list(self.slow)
+        return out
+
+class TimedLock(object):
+    ''' passes everything through to lock and records how long it takes to enter '''
+
+    def __init__(self, lock, instrumentation):
+        self.lock = lock
+        self.instrumentation = instrumentation
+
+    def __enter__(self):
+        start = perf_counter()
+        out = self.lock.__enter__()
+        self.instrumentation.record('lock_wait', 'write_lock', perf_counter() - start)
+        return out
+
+    def __exit__(self, *args):
+        return self.lock.__exit__(*args)
+
+    def __getattr__(self, name):
+        return getattr(self.lock, name)
+
+def instrument(db, enabled=True, slow_query_seconds=None, hook=None):
+    ''' turns the instrumentation of db on with a fresh Instrumentation and
+        returns it, or turns it off and returns None. db lists what to wrap
+        in its instrumented_operations, instrumented_serializers and
+        instrumented_statements. '''
+    current = db._instrumentation
+    if current is not None:
+        # the class versions show through once the wrappers are gone
+        for name in db.instrumented_operations + db.instrumented_serializers + db.instrumented_statements:
+            db.__dict__.pop(name, None)
+        db._write_lock = db._write_lock.lock
+        db._instrumentation = None
+    if not enabled:
+        return None
+    instrumentation = Instrumentation(slow_query_seconds, hook)
+    for name in db.instrumented_operations:
+        setattr(db, name, instrumentation.operation(name.lstrip('_'), getattr(db, name)))
+    for name in db.instrumented_serializers:
+        setattr(db, name, instrumentation.timed(name, getattr(db, name)))
+    for name in db.instrumented_statements:
+        setattr(db, name, instrumentation.statement(getattr(db, name)))
+    db._write_lock = TimedLock(db._write_lock, instrumentation)
+    db._instrumentation = instrumentation
+    return instrumentation
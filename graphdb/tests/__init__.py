@@ -1,14 +1,42 @@
 import sys
+from functools import partial
 
 from graphdb import GraphDB, RamGraphDB, SQLiteGraphDB
 
 from .generate_tests import generate_api_tests
+from .sqlite_tests import TestSQLiteGraphDBMigration, TestSQLiteGraphDBTransactions, TestSQLiteGraphDBConcurrency, TestSQLiteGraphDBQueryPlans, TestPartitionedSQLiteGraphDBQueryPlans, TestSQLiteGraphDBLayouts, TestSQLiteGraphDBObjectCache, TestSQLiteGraphDBSerializers, TestSQLiteGraphDBTraversals, TestPartitionedSQLiteGraphDBTraversals, TestSQLiteGraphDBScans, TestPartitionedSQLiteGraphDBScans, TestSQLiteGraphDBMerge
 
-__all__ = ['TestGraphDB', 'TestSQLiteGraphDB']
+__all__ = [
+    'TestGraphDB',
+    'TestSQLiteGraphDB',
+    'TestPartitionedSQLiteGraphDB',
+    'TestSQLiteGraphDBMigration',
+    'TestSQLiteGraphDBTransactions',
+    'TestSQLiteGraphDBConcurrency',
+    'TestSQLiteGraphDBQueryPlans',
+    'TestPartitionedSQLiteGraphDBQueryPlans',
+    'TestSQLiteGraphDBLayouts',
+    'TestSQLiteGraphDBObjectCache',
+    'TestSQLiteGraphDBSerializers',
+    'TestSQLiteGraphDBTraversals',
+    'TestPartitionedSQLiteGraphDBTraversals',
+    'TestSQLiteGraphDBScans',
+    'TestPartitionedSQLiteGraphDBScans',
+    'TestSQLiteGraphDBMerge'
+]
 
-TestGraphDB       = generate_api_tests(GraphDB)
-TestSQLiteGraphDB = generate_api_tests(SQLiteGraphDB)
+TestGraphDB                  = generate_api_tests(GraphDB)
+TestSQLiteGraphDB            = generate_api_tests(SQLiteGraphDB)
+TestPartitionedSQLiteGraphDB = generate_api_tests(partial(SQLiteGraphDB, layout='partitioned'))
 
 if sys.version_info >= (3, 6):
-	__all__.append('TestRamGraphDB')
+	from .frozen_tests import TestFrozenRamGraphDB
+	from .persistence_tests import TestRamGraphDBPersistence
+	from .memory_tests import TestRamGraphDBMemory, TestNodeCollection
+	from .io_tests import TestEdgeLists
+	from .async_tests import TestAsyncGraphDB
+	from .bench_tests import TestBenchmarks
+	from .stats_tests import TestInstrumentation
+	from .concurrency_tests import TestRamGraphDBConcurrency
+	__all__.extend(('TestRamGraphDB', 'TestFrozenRamGraphDB', 'TestRamGraphDBPersistence', 'TestRamGraphDBMemory', 'TestNodeCollection', 'TestEdgeLists', 'TestAsyncGraphDB', 'TestBenchmarks', 'TestInstrumentation', 'TestRamGraphDBConcurrency'))
 	TestRamGraphDB = generate_api_tests(RamGraphDB)
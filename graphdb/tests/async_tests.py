@@ -0,0 +1,82 @@
+from unittest import TestCase
+from tempfile import mkdtemp
+from shutil import rmtree
+from os.path import join
+import asyncio
+
+from graphdb import AsyncGraphDB, RamGraphDB, SQLiteGraphDB
+
+class TestAsyncGraphDB(TestCase):
+    ''' runs the same async workload against every backend '''
+
+    def setUp(self):
+        self.dir = mkdtemp()
+        self.loop = asyncio.new_event_loop()
+
+    def tearDown(self):
+        self.loop.close()
+        rmtree(self.dir)
+
+    def backends(self):
+        yield RamGraphDB()
+        yield SQLiteGraphDB()
+        yield SQLiteGraphDB(join(self.dir, 'graph.db'))
+
+    def run_async(self, coroutine):
+        return self.loop.run_until_complete(coroutine)
+
+    def test_api(self):
+        async def run(db):
+            async with AsyncGraphDB(db) as adb:
+                await asyncio.gather(*(adb.store_relation(i, 'next', i+1) for i in range(32)))
+                await adb.store_item('lonely')
+                self.assertEqual(await adb.store_relations([(0, 'first', True), (0, 'next', 1)]), 1, 'wrong number of new relations')
+                self.assertEqual(await adb.store_items(['lonely', 'new']), 1, 'wrong number of new items')
+                self.assertTrue(await adb.contains('lonely'), 'stored item not found')
+                self.assertEqual(await adb.find(3, 'next'), [4], 'wrong objects found')
+                self.assertEqual(sorted(await adb.relations_of(0)), ['first', 'next'], 'wrong relations_of')
+                self.assertEqual(sorted(await adb.relations_of(0, True)), [('first', True), ('next', 1)], 'wrong relations_of with objects')
+                self.assertEqual(await adb.relations_to(4, True), [(3, 'next')], 'wrong relations_to with objects')
+                await adb.delete_relation(0, 'first', True)
+                await adb.delete_item(32)
+                await adb.replace_item('new', 'newer')
+                self.assertFalse(await adb.contains('new'), 'replaced item still found')
+                relations = [i async for i in adb.list_relations(chunk_size=5)]
+                self.assertEqual(sorted(relations), sorted((i, 'next', i+1) for i in range(31)), 'wrong relations listed')
+                self.assertEqual(await adb.count_relations('next'), 31, 'wrong relation count')
+                self.assertEqual((await adb.out_degree(0), await adb.in_degree(1, 'next')), (1, 1), 'wrong degrees')
+                # backends disagree on keeping replacements without relations
+                objects = [i async for i in adb.list_objects(chunk_size=7) if i != 'newer']
+                self.assertEqual(sorted(map(repr, objects)), sorted(map(repr, list(range(32)) + [True, 'lonely'])), 'wrong objects listed')
+        for db in self.backends():
+            self.run_async(run(db))
+
+    def test_coalesced_writes(self):
+        async def run(db):
+            adb = AsyncGraphDB(db)
+            batches = []
+            apply = adb._apply
+            adb._apply = lambda batch: batches.append(len(batch)) or apply(batch)
+            await asyncio.gather(*(adb.store_relation(i, 'next', i+1) for i in range(100)))
+            self.assertEqual(sum(batches), 100, 'writes went missing')
+            self.assertLess(len(batches), 100, 'concurrent writes were not batched')
+            self.assertEqual(len(await adb.find(99, 'next')), 1, 'batched write was not stored')
+            await adb.close()
+        for db in self.backends():
+            self.run_async(run(db))
+
+    def test_failing_write(self):
+        async def run(db):
+            adb = AsyncGraphDB(db)
+            results = await asyncio.gather(
+                adb.store_relation(1, 'next', 2),
+                adb.store_relation(1, 5, 2),
+                adb.store_relation(2, 'next', 3),
+                return_exceptions=True
+            )
+            self.assertIsNone(results[0], 'write next to a failing write failed')
+            self.assertIsInstance(results[1], AssertionError, 'failing write did not fail its await')
+            self.assertEqual(await adb.find(2, 'next'), [3], 'write after a failing write was lost')
+            await adb.close()
+        for db in self.backends():
+            self.run_async(run(db))
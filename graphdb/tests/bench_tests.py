@@ -0,0 +1,62 @@
+from unittest import TestCase
+from tempfile import mkdtemp
+from shutil import rmtree
+from os.path import join
+import json, subprocess, sys, os
+
+from graphdb import bench
+
+class TestBenchmarks(TestCase):
+    ''' makes sure the benchmark sweep runs every workload and flags regressions '''
+
+    def setUp(self):
+        self.dir = mkdtemp()
+
+    def tearDown(self):
+        rmtree(self.dir)
+
+    def test_run_case(self):
+        for backend in bench.backends:
+            for topology in bench.topologies:
+                results = bench.run_case(backend, topology, 200, samples=5)
+                self.assertEqual([i['workload'] for i in results], list(bench.workloads), 'wrong workloads ran for {} {}'.format(backend, topology))
+                insert, scan = results[0], results[4]
+                self.assertEqual(insert['items'], 200, 'wrong number of relations inserted')
+                self.assertGreaterEqual(scan['items'], 150, 'scan missed relations')
+                for result in results:
+                    if result['calls']:
+                        self.assertLessEqual(result['p50'], result['p99'], 'p50 is slower than p99')
+                        self.assertGreater(result['throughput'], 0, 'wrong throughput')
+
+    def test_workload_subset(self):
+        results = bench.run_case('ram', 'chain', 100, ['lookup'], samples=5)
+        self.assertEqual([i['workload'] for i in results], ['lookup'], 'workloads that were not asked for ran')
+        self.assertEqual(results[0]['calls'], 5, 'wrong number of calls')
+
+    def test_compare(self):
+        def run(**metrics):
+            result = dict(backend='ram', topology='chain', edges=1000, workload='lookup', throughput=1000.0, p99=0.001, peak_rss=2**20)
+            result.update(metrics)
+            return {'results': [result]}
+        self.assertEqual(bench.compare(run(throughput=900.0), run()), [], 'a change within the tolerance was a regression')
+        self.assertEqual(bench.compare(run(throughput=2000.0, p99=0.0001), run()), [], 'an improvement was a regression')
+        slower, = bench.compare(run(throughput=500.0), run())
+        self.assertEqual((slower['metric'], slower['change']), ('throughput', -0.5), 'wrong throughput regression')
+        self.assertEqual([i['metric'] for i in bench.compare(run(p99=0.002, peak_rss=2**21), run())], ['p99', 'peak_rss'], 'wrong regressions')
+        self.assertEqual(bench.compare(run(edges=10), run(throughput=1.0)), [], 'different cases were compared')
+
+    def test_command_line(self):
+        output, baseline = join(self.dir, 'run.json'), join(self.dir, 'baseline.json')
+        env = dict(os.environ, PYTHONPATH=os.path.dirname(os.path.dirname(os.path.dirname(os.path.abspath(__file__)))))
+        args = (sys.executable, '-m', 'graphdb', '--bench', '--sizes', '100', '--backends', 'ram,sqlite-memory', '--topologies', 'stars', '--samples', '3')
+        subprocess.run(args + ('--output', output), check=True, stderr=subprocess.PIPE, env=env)
+        with open(output) as f:
+            run = json.load(f)
+        self.assertEqual(len(run['results']), 2 * len(bench.workloads), 'wrong number of results')
+        for result in run['results']:
+            result['throughput'] = None if result['throughput'] is None else result['throughput'] * 100
+        with open(baseline, 'w') as f:
+            json.dump(run, f)
+        ran = subprocess.run(args + ('--output', output, '--baseline', baseline), stderr=subprocess.PIPE, env=env)
+        self.assertEqual(ran.returncode, 1, 'regressions did not fail the run')
+        self.assertIn(b'regression: ram stars 100 insert throughput', ran.stderr, 'regressions were not reported')
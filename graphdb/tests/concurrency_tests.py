@@ -0,0 +1,120 @@
+from unittest import TestCase
+from threading import Thread
+from random import Random
+import sys
+
+from graphdb import RamGraphDB
+from graphdb.RamGraphDB import graph_hash
+
+class TestRamGraphDBConcurrency(TestCase):
+    ''' makes sure RamGraphDB stays consistent with many threads using it '''
+
+    def setUp(self):
+        self.db = RamGraphDB()
+        # switching threads often makes writes interleave far more
+        self.interval = sys.getswitchinterval()
+        sys.setswitchinterval(1e-6)
+
+    def tearDown(self):
+        sys.setswitchinterval(self.interval)
+
+    def run_threads(self, *targets):
+        errors = []
+        def run(target):
+            try:
+                target()
+            except Exception as e:
+                errors.append(e)
+        threads = [Thread(target=run, args=(i,)) for i in targets]
+        for t in threads:
+            t.start()
+        for t in threads:
+            t.join()
+        self.assertEqual(errors, [], 'threads raised errors')
+
+    def assertConsistent(self):
+        db = self.db
+        counts = {}
+        for node in db.iter_nodes():
+            self.assertIs(db.nodes[node._hash], node, 'a node is stored under the wrong hash')
+            for name, other in node.outgoing.links():
+                self.assertIs(db.nodes.get(other._hash), other, 'a link points at a deleted node')
+                self.assertIn(node, other.incoming.targets(name), 'an outgoing link has no matching incoming link')
+                counts[name] = counts.get(name, 0) + 1
+            for name, other in node.incoming.links():
+                self.assertIs(db.nodes.get(other._hash), other, 'a link comes from a deleted node')
+                self.assertIn(node, other.outgoing.targets(name), 'an incoming link has no matching outgoing link')
+        self.assertEqual(db._relation_counts, counts, 'relation counts drifted from the links')
+
+    def test_stress(self):
+        db = self.db
+        ids = range(48)
+        def write(seed):
+            rng = Random(seed)
+            for _ in range(3000):
+                op = rng.random()
+                src, name, dst = rng.choice(ids), rng.choice('ab'), rng.choice(ids)
+                if op < 0.5:
+                    db.store_relation(src, name, dst)
+                elif op < 0.6:
+                    db.store_relations((src, name, i) for i in rng.sample(ids, 4))
+                elif op < 0.9:
+                    db.delete_relation(src, name, dst)
+                elif op < 0.97:
+                    db.delete_item(src)
+                else:
+                    db.replace_item(src, dst)
+        def read(seed):
+            rng = Random(seed)
+            for _ in range(1500):
+                i = rng.choice(ids)
+                try:
+                    list(db.find(i, 'a'))
+                    list(db.relations_of(i, True))
+                    list(db.relations_to(i, True))
+                    db(i).a.b.where(a=i).count()
+                except KeyError: # i is not stored right now
+                    pass
+                list(db.bfs(i, max_depth=3))
+                db.out_degree(i) + db.in_degree(i, 'b')
+                if not rng.randrange(50):
+                    for src, name, dst in db.list_relations():
+                        self.assertIn(name, 'ab', 'a scan found a relation that was never stored')
+        self.run_threads(*[lambda s=s: write(s) for s in range(8)] + [lambda s=s: read(-s) for s in range(1, 9)])
+        self.assertConsistent()
+
+    def test_concurrent_inserts(self):
+        db = self.db
+        def write(offset):
+            db.store_relations((i, 'next', i+1) for i in range(offset, 2000, 4))
+        self.run_threads(*[lambda o=o: write(o) for o in range(4)])
+        self.assertEqual(db.count_relations('next'), 2000, 'concurrent inserts lost relations')
+        self.assertEqual(db.count_objects(), 2001, 'concurrent inserts lost objects')
+        self.assertConsistent()
+
+    def test_stripes(self):
+        db = self.db
+        a = 0
+        b = next(i for i in range(1, 1000) if graph_hash(i) % db.lock_stripes != graph_hash(a) % db.lock_stripes)
+        with db._stripes(graph_hash(a)):
+            writer = Thread(target=db.store_relation, args=(b, 'knows', b))
+            writer.start()
+            writer.join(5)
+            self.assertFalse(writer.is_alive(), 'a write waited on a stripe it does not use')
+            writer = Thread(target=db.store_relation, args=(b, 'knows', a))
+            writer.start()
+            writer.join(0.1)
+            self.assertTrue(writer.is_alive(), 'a write did not wait for the stripe of its node')
+        writer.join()
+        self.assertEqual(db.out_degree(b), 2, 'the waiting write was lost')
+
+    def test_transaction(self):
+        db = self.db
+        with db.transaction():
+            writer = Thread(target=db.store_relation, args=(1, 'knows', 2))
+            writer.start()
+            writer.join(0.1)
+            self.assertTrue(writer.is_alive(), 'a write ran during a transaction of another thread')
+            self.assertNotIn(1, db, 'a write ran during a transaction of another thread')
+        writer.join()
+        self.assertEqual(list(db.relations_of(1, True)), [('knows', 2)], 'the waiting write was lost')
@@ -0,0 +1,83 @@
+from unittest import TestCase
+from fractions import Fraction
+
+from graphdb import RamGraphDB
+
+class TestFrozenRamGraphDB(TestCase):
+    ''' makes sure snapshots answer every read the same way the graph they were frozen from does '''
+
+    def setUp(self):
+        self.db = RamGraphDB()
+        self.db.store_relations((i, 'knows', (i+j)%8) for i in range(8) for j in (1, 2))
+        self.db.store_relations((i, 'even', not i%2) for i in range(8))
+        self.db.store_relation([1, 2], 'contains', 1)
+        self.db.store_item('lonely')
+        self.frozen = self.db.freeze()
+
+    def tearDown(self):
+        self.frozen._destroy()
+        self.db._destroy()
+
+    def test_objects(self):
+        self.assertEqual(list(self.frozen), list(self.db), 'wrong objects in snapshot')
+        self.assertIn('lonely', self.frozen, 'unlinked object missing from snapshot')
+        self.assertNotIn('missing', self.frozen, 'snapshot contains an object that was never stored')
+
+    def test_relations(self):
+        self.assertEqual(
+            sorted(map(repr, self.frozen.list_relations())),
+            sorted(map(repr, self.db.list_relations())),
+            'wrong relations in snapshot'
+        )
+        for i in list(self.db):
+            self.assertEqual(set(self.frozen.relations_of(i)), set(self.db.relations_of(i)), 'wrong relations_of({!r})'.format(i))
+            self.assertEqual(
+                sorted(map(repr, self.frozen.relations_of(i, True))),
+                sorted(map(repr, self.db.relations_of(i, True))),
+                'wrong relations_of({!r}, True)'.format(i)
+            )
+            self.assertEqual(set(self.frozen.relations_to(i)), set(self.db.relations_to(i)), 'wrong relations_to({!r})'.format(i))
+            self.assertEqual(
+                sorted(map(repr, self.frozen.relations_to(i, True))),
+                sorted(map(repr, self.db.relations_to(i, True))),
+                'wrong relations_to({!r}, True)'.format(i)
+            )
+        self.assertEqual(sorted(self.frozen.find(3, 'knows')), [4, 5], 'wrong values found in snapshot')
+        self.assertEqual(list(self.frozen.find(3, 'missing')), [], 'found values for a missing relation')
+
+    def test_counts(self):
+        self.assertEqual(self.frozen.count_objects(), self.db.count_objects(), 'wrong object count in snapshot')
+        self.assertEqual(self.frozen.count_relations(), self.db.count_relations(), 'wrong relation count in snapshot')
+        for i in self.db:
+            self.assertEqual(self.frozen.out_degree(i), self.db.out_degree(i), 'wrong out_degree({!r})'.format(i))
+            self.assertEqual(self.frozen.in_degree(i, 'knows'), self.db.in_degree(i, 'knows'), 'wrong in_degree({!r})'.format(i))
+        self.assertEqual(self.frozen(0).knows.knows.count(), len(list(self.db(0).knows.knows())), 'wrong traversal count in snapshot')
+
+    def test_traversals(self):
+        self.assertEqual(
+            sorted(self.frozen(0).knows.knows.knows()),
+            sorted(self.db(0).knows.knows.knows()),
+            'wrong values after traversing a snapshot'
+        )
+        self.assertEqual(sorted(self.frozen(0).distinct().knows.knows.knows()), [3, 4, 5, 6], 'wrong values after a distinct traversal')
+        self.assertEqual(set(self.frozen(0).knows.where(even=True)()), {2}, 'wrong values after where on a snapshot')
+
+    def test_where_equality_of_other_types(self):
+        self.db.store_relations([(0, 'half', Fraction(0)), (1, 'half', 0j), (2, 'half', 1)])
+        frozen = self.db.freeze()
+        self.assertEqual(set(frozen(7).knows.where(half=0)()), {0, 1}, 'where missed objects of other types equal to the value')
+        frozen._destroy()
+
+    def test_read_only(self):
+        with self.assertRaises(TypeError):
+            self.frozen.store_relation(1, 'knows', 9)
+        with self.assertRaises(TypeError):
+            self.frozen(1).knows = 9
+        with self.assertRaises(TypeError):
+            self.frozen.delete_item(1)
+
+    def test_snapshot_is_independent(self):
+        self.db.store_relation(0, 'knows', 7)
+        self.db.delete_item(3)
+        self.assertEqual(sorted(self.frozen.find(0, 'knows')), [1, 2], 'writes after freezing changed the snapshot')
+        self.assertIn(3, self.frozen, 'deletes after freezing changed the snapshot')
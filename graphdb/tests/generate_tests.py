@@ -1,4 +1,7 @@
 from unittest import TestCase
+from copy import copy
+from fractions import Fraction
+from decimal import Decimal
 
 def generate_api_tests(GraphDB: type) -> TestCase:
     ''' generates a generic set of tests for multiple types of GraphDB's
@@ -33,6 +36,34 @@ def generate_api_tests(GraphDB: type) -> TestCase:
             self.test_store_relation()
             self.test_store_relation()
 
+        def test_store_items(self):
+            self.assertEqual(self.db.store_items(range(64)), 64, 'wrong count of new objects')
+            self.assertEqual(self.db.store_items(range(32, 96)), 32, 'wrong count of new objects')
+            self.assertEqual(len(list(self.db.list_objects())), 96, 'wrong object count after bulk inserts')
+
+        def test_store_relations(self):
+            relations = [(i, 'less_than', i+1) for i in range(64)]
+            self.assertEqual(self.db.store_relations(iter(relations)), 64, 'wrong count of new relations')
+            self.assertEqual(self.db.store_relations(relations + [(1, 'odd', True)]), 1, 'wrong count of new relations')
+            self.assertEqual(len(list(self.db.list_relations())), 65, 'wrong relation count after bulk inserts')
+            self.assertEqual(len(list(self.db.list_objects())), 66, 'wrong object count after bulk inserts')
+            self.assertEqual(next(self.db(10).less_than.less_than()), 12, 'wrong value after traversing bulk inserts')
+
+        def test_transaction(self):
+            with self.db.transaction():
+                self.db.store_relation(1, 'less_than', 2)
+                with self.db.transaction():
+                    self.db.store_relation(2, 'less_than', 3)
+                    self.db.store_item(4)
+                self.db.replace_item(3, 'three')
+                self.db.delete_item(4)
+            self.assertEqual(
+                set(self.db.list_relations()),
+                {(1, 'less_than', 2), (2, 'less_than', 'three')},
+                'wrong relations after transaction'
+            )
+            self.assertNotIn(4, self.db, 'deleted item found after transaction')
+
         def test_relation_count_after_storing_relations(self):
             self.test_duplicate_store_relation()
             self.assertEqual(len(list(self.db.list_relations())), 64, 'wrong relation count after inserts')
@@ -85,6 +116,116 @@ def generate_api_tests(GraphDB: type) -> TestCase:
                     'loss of data found in serialize/deserialize'
                 )
 
+        def test_distinct_traversal(self):
+            # every node knows the next two so paths double with each hop
+            self.db.store_relations((i, 'knows', (i+j)%5) for i in range(5) for j in (1, 2))
+            bag, distinct = self.db(0), self.db(0).distinct()
+            for _ in range(8):
+                bag, distinct = bag.knows, distinct.knows
+            self.assertEqual(len(bag), 2**8, 'traversal should keep every path')
+            self.assertEqual(sorted(distinct()), [0, 1, 2, 3, 4], 'wrong values after a distinct traversal')
+            self.assertEqual(len(distinct), 5, 'distinct traversal found objects more than once')
+            self.assertEqual(sorted(self.db(0).knows.knows.distinct()()), [2, 3, 4], 'wrong values after distinct')
+            self.db.store_relations((i, 'parity', i%2) for i in range(5))
+            self.assertEqual(sorted(self.db(0).knows.parity()), [0, 1], 'wrong values after hopping through different relations')
+
+        def test_stream_traversal(self):
+            self.test_store_relation()
+            streamed = self.db(10).less_than.less_than.stream()
+            self.assertFalse(isinstance(streamed, list), 'stream should not build a list')
+            self.assertEqual([i() for i in streamed], [12], 'wrong values streamed')
+            self.assertEqual(next(self.db(0).less_than.less_than()), 2, 'wrong first value streamed')
+
+        def test_list_operations_on_plans(self):
+            # every call gets a fresh plan so nothing is filled in beforehand
+            self.db.store_relations([(1, 'a', 2), (1, 'a', 3)])
+            values = [i() for i in self.db(1).a]
+            self.assertEqual(sorted(values), [2, 3])
+            self.assertNotEqual(self.db(1).a, [], 'a pending plan compared equal to an empty list')
+            self.assertFalse(self.db(1).a == [], 'a pending plan compared equal to an empty list')
+            self.assertGreater(self.db(1).a, [], 'a pending plan was ordered like an empty list')
+            found = self.db(1).a
+            self.assertEqual(found, list(found), 'a VList does not equal its own items')
+            self.assertEqual([i() for i in reversed(self.db(1).a)], values[::-1], 'wrong values reversed')
+            self.assertEqual([i() for i in self.db(1).a + []], values, 'wrong values added')
+            self.assertEqual([i() for i in [] + self.db(1).a], values, 'wrong values added to a list')
+            self.assertEqual(len(self.db(1).a * 2), 4, 'wrong length after multiplying')
+            self.assertEqual(len(2 * self.db(1).a), 4, 'wrong length after multiplying')
+            self.assertEqual([i() for i in copy(self.db(1).a)], values, 'wrong values copied')
+            self.assertEqual([i() for i in self.db(1).a.copy()], values, 'wrong values copied')
+            found = self.db(1).a
+            self.assertEqual(found.index(list(copy(found))[1]), 1, 'wrong index')
+            extended = self.db(1).a
+            extended.extend(self.db(1).a)
+            self.assertEqual([i() for i in extended], values * 2, 'wrong values after extending')
+            added = self.db(1).a
+            added += self.db(1).a
+            self.assertEqual(len(added), 4, 'wrong length after adding in place')
+
+        def graph_search_setup(self):
+            # a ring of next links with a ring of skip links jumping three ahead
+            self.db.store_relations((i, 'next', (i+1)%10) for i in range(10))
+            self.db.store_relations((i, 'skip', (i+3)%10) for i in range(10))
+            self.db.store_item('lonely')
+
+        def test_bfs(self):
+            self.graph_search_setup()
+            found = list(self.db.bfs(0))
+            self.assertEqual(found[0], (0, 0), 'bfs should start with the start')
+            self.assertEqual(sorted(i for i, depth in found), list(range(10)), 'bfs should find everything reachable once')
+            self.assertEqual([depth for i, depth in found], sorted(depth for i, depth in found), 'bfs found objects out of depth order')
+            self.assertEqual(dict(found), {0: 0, 1: 1, 3: 1, 2: 2, 4: 2, 6: 2, 5: 3, 7: 3, 9: 3, 8: 4}, 'bfs found objects at the wrong depths')
+            self.assertEqual(list(self.db.bfs(0, 'next', 3)), [(0, 0), (1, 1), (2, 2), (3, 3)], 'wrong objects following one relation')
+            self.assertEqual(dict(self.db.bfs(0, ('next', 'skip'), 1)), {0: 0, 1: 1, 3: 1}, 'wrong objects following named relations')
+            self.assertEqual(list(self.db.bfs(0, max_depth=0)), [(0, 0)], 'max_depth 0 should only find the start')
+            self.assertEqual(list(self.db.bfs('lonely')), [('lonely', 0)], 'wrong objects found from an unlinked object')
+            self.assertEqual(list(self.db.bfs('missing')), [], 'objects found from an object that was never stored')
+            self.assertEqual(next(self.db.bfs(0)), (0, 0), 'bfs should stream')
+
+        def test_neighbourhood(self):
+            self.graph_search_setup()
+            self.assertEqual(sorted(self.db.neighbourhood(0, 1)), [1, 3], 'wrong 1 hop neighbourhood')
+            self.assertEqual(sorted(self.db.neighbourhood(0, 2)), [1, 2, 3, 4, 6], 'wrong 2 hop neighbourhood')
+            self.assertEqual(sorted(self.db.neighbourhood(0, 3, 'skip')), [3, 6, 9], 'wrong neighbourhood following one relation')
+            self.assertEqual(list(self.db.neighbourhood(0, 0)), [], 'a 0 hop neighbourhood should be empty')
+
+        def test_shortest_path(self):
+            self.graph_search_setup()
+            self.assertEqual(self.db.shortest_path(0, 9), [0, 3, 6, 9], 'wrong shortest path')
+            self.assertEqual(self.db.shortest_path(0, 9, 'next'), list(range(10)), 'wrong shortest path following one relation')
+            self.assertEqual(len(self.db.shortest_path(0, 8)), 5, 'shortest path is not the shortest')
+            self.assertEqual(self.db.shortest_path(4, 4), [4], 'wrong path to the start')
+            self.assertIsNone(self.db.shortest_path(0, 'lonely'), 'found a path to an unreachable object')
+            self.assertIsNone(self.db.shortest_path(0, 'missing'), 'found a path to an object that was never stored')
+            self.assertIsNone(self.db.shortest_path(1, 0, 'missing'), 'found a path along a relation that was never stored')
+            # relations only lead one way
+            self.db.store_relation('a', 'next', 'b')
+            self.db.store_relation('b', 'next', 'c')
+            self.assertIsNone(self.db.shortest_path('c', 'a'), 'found a path against the direction of relations')
+            self.assertEqual(self.db.shortest_path('a', 'c'), ['a', 'b', 'c'], 'wrong path along a chain')
+
+        def test_merge(self):
+            self.db.store_relations((i, 'next', i+1) for i in range(8))
+            other = GraphDB()
+            other.store_relations((i, 'next', i+1) for i in range(4, 12))
+            other.store_relation(0, 'first', True)
+            other.store_item('lonely')
+            expected = sorted(set(map(repr, self.db.list_relations())) | set(map(repr, other.list_relations())))
+            added = self.db + other
+            self.assertEqual(sorted(map(repr, added.list_relations())), expected, 'wrong relations after adding databases')
+            db = self.db
+            db += other
+            self.assertIs(db, self.db, '+= should return the database it merged into')
+            self.assertEqual(sorted(map(repr, db.list_relations())), expected, 'wrong relations after merging')
+            self.assertIn('lonely', db, 'merging dropped an object without relations')
+            self.assertIn('lonely', added, 'adding dropped an object without relations')
+            self.assertEqual(sorted(db(10).next()), [11], 'wrong traversal after merging')
+            self.assertEqual(len(list(other.list_relations())), 9, 'merging changed the database merged from')
+            db += db
+            self.assertEqual(sorted(map(repr, db.list_relations())), expected, 'merging a database into itself changed it')
+            added._destroy()
+            other._destroy()
+
         def test_loadbalancer_example(self):
             ''' this builds an example mapping of a loadbalancer setup '''
             self.db('cluster').entry_point = 'loadbalancer-1'
@@ -147,6 +288,76 @@ def generate_api_tests(GraphDB: type) -> TestCase:
                 'wrong set of loadbalancers found'
             )
 
+        def test_counts(self):
+            self.db.store_relations((i, 'less_than', i+1) for i in range(8))
+            self.db.store_relations((0, 'knows', i) for i in range(1, 4))
+            self.db.store_relations([(0, 'likes', 1), (0, 'likes', 2), (1, 'next', 5), (2, 'next', 5)])
+            self.db.store_item('alone')
+            self.assertEqual(self.db.count_objects(), len(list(self.db.list_objects())), 'wrong object count')
+            self.assertEqual(self.db.count_relations(), len(list(self.db.list_relations())), 'wrong relation count')
+            self.assertEqual(self.db.count_relations('knows'), 3, 'wrong relation count for a name')
+            self.assertEqual(self.db.count_relations('missing'), 0, 'counted relations of a missing name')
+            self.assertEqual(self.db.out_degree(0), 6, 'wrong out degree')
+            self.assertEqual(self.db.out_degree(0, 'knows'), 3, 'wrong out degree for a relation')
+            self.assertEqual(self.db.in_degree(1), 3, 'wrong in degree')
+            self.assertEqual(self.db.in_degree(5, 'next'), 2, 'wrong in degree for a relation')
+            self.assertEqual(self.db.out_degree('alone'), 0, 'wrong out degree without relations')
+            self.assertEqual(self.db.in_degree('missing'), 0, 'wrong in degree of a missing object')
+            self.db.delete_relation(0, 'knows', 1)
+            self.db.delete_item(8)
+            self.assertEqual(self.db.count_relations(), len(list(self.db.list_relations())), 'wrong relation count after deletes')
+            self.assertEqual(self.db.count_relations('knows'), 2, 'wrong relation count for a name after deletes')
+            self.assertEqual(self.db.count_objects(), len(list(self.db.list_objects())), 'wrong object count after deletes')
+            self.assertEqual(self.db.in_degree(1), 2, 'wrong in degree after deletes')
+            self.assertEqual(self.db(0).knows.less_than.count(), 2, 'wrong traversal count')
+            self.assertEqual(self.db(0).likes.next.count(), 2, 'wrong traversal count')
+            self.assertEqual(self.db(0).likes.next.distinct_count(), 1, 'wrong distinct traversal count')
+            self.assertEqual(self.db(0).distinct().likes.next.count(), 1, 'wrong count of a distinct traversal')
+            self.assertEqual(self.db(0).likes.where(next=5).count(), 2, 'wrong count after where')
+            found = self.db(0).likes.next
+            self.assertEqual(len(found), 2, 'wrong length of a traversal')
+            self.assertEqual((found.count(), found.distinct_count()), (2, 1), 'wrong counts of a loaded traversal')
+
+        def test_where_equality(self):
+            self.db.store_relations((i, 'even', i % 2 == 0) for i in range(20))
+            self.db.store_relations((i, 'half', i // 2) for i in range(0, 20, 2))
+            self.db.store_relations((20, 'next', i) for i in range(20))
+            db = self.db
+            self.assertEqual(db(20).next.where(even=True)(set), set(range(0, 20, 2)), 'wrong values after where')
+            self.assertEqual(db(20).next.where(even=True)(set), db(20).next.where('even', lambda i:i==True)(set), 'where by value and by function disagree')
+            self.assertEqual(db(20).next.where(half=3)(set), {6}, 'wrong values after where')
+            self.assertEqual(db(20).next.where(half=3.0)(set), {6}, 'where should match equal numbers of other types')
+            self.assertEqual(db(20).next.where(even=1)(set), set(range(0, 20, 2)), 'where should match equal numbers of other types')
+            self.assertEqual(db(20).next.where(half='3')(set), set(), 'where matched something that was not equal')
+            self.assertEqual(db(20).next.where(missing=True)(set), set(), 'where matched a missing relation')
+            self.assertEqual(db(20).next.where(even=True, half=3)(set), {6}, 'where should keep what matches every pair')
+            self.assertEqual(sorted(db(20).next.distinct().where(even=False)()), list(range(1, 20, 2)), 'wrong values after a distinct where')
+
+        def test_where_equality_of_other_types(self):
+            db = self.db
+            db.store_relations([
+                (1, 'half', Fraction(1)),
+                (2, 'half', 1+0j),
+                (3, 'half', Decimal(1)),
+                (4, 'half', 1),
+                (5, 'half', Fraction(1, 2)),
+                (6, 'half', 'one')
+            ])
+            db.store_relations((0, 'next', i) for i in range(1, 8))
+            self.assertEqual(db(0).next.where(half=1)(set), {1, 2, 3, 4}, 'where missed objects of other types equal to the value')
+            for value in (1, 1.0, True, 0.5, 'one', 2, None):
+                self.assertEqual(
+                    db(0).next.where(half=value)(set),
+                    db(0).next.where('half', lambda i:i==value)(set),
+                    'where by value and by function disagree on {!r}'.format(value)
+                )
+            self.assertEqual(db(0).next.where(half=1).count(), 4, 'wrong count after where')
+            self.assertEqual(db(0).next.distinct().where(half=0.5)(list), [5], 'wrong values after a distinct where')
+            db.delete_relation(1, 'half', Fraction(1))
+            db.delete_relation(2, 'half', 1+0j)
+            db.delete_relation(3, 'half', Decimal(1))
+            self.assertEqual(db(0).next.where(half=1)(set), {4}, 'wrong values after deleting the other types')
+
         def test_relations_to(self):
             self.test_loadbalancer_example()
 
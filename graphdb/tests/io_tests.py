@@ -0,0 +1,97 @@
+from unittest import TestCase
+from tempfile import mkdtemp
+from shutil import rmtree
+from os.path import join, getsize
+import subprocess, sys, os
+
+from graphdb import GraphDB, RamGraphDB, SQLiteGraphDB
+from graphdb.io import load_edges, dump_edges
+
+class TestEdgeLists(TestCase):
+    ''' makes sure edge lists round trip through every format and backend '''
+
+    def setUp(self):
+        self.dir = mkdtemp()
+        self.relations = [(i, 'knows', (i*7)%50) for i in range(200)]
+        self.relations += [(i, 'named', 'node-{}'.format(i)) for i in range(50)]
+        self.relations += [('pair', 'has', (1, ('a', 2.5), None)), ('pair', 'has', True)]
+
+    def tearDown(self):
+        rmtree(self.dir)
+
+    def relations_of(self, db):
+        return sorted(map(repr, db.list_relations()))
+
+    def round_trip(self, backend, format, small_batches=False):
+        db = backend()
+        db.store_relations(self.relations)
+        path = join(self.dir, 'edges.' + format)
+        self.assertEqual(dump_edges(db, path), len(self.relations), 'wrong number of rows dumped')
+        copy = backend()
+        self.assertEqual(load_edges(copy, path, batch_size=7 if small_batches else 4096), len(self.relations), 'wrong number of rows loaded')
+        return db, copy
+
+    def test_binary(self):
+        for backend in (RamGraphDB, SQLiteGraphDB):
+            db, copy = self.round_trip(backend, 'bin', True)
+            self.assertEqual(self.relations_of(copy), self.relations_of(db), 'binary round trip changed the relations')
+
+    def test_jsonl(self):
+        for backend in (RamGraphDB, SQLiteGraphDB):
+            db, copy = self.round_trip(backend, 'jsonl')
+            self.assertEqual(self.relations_of(copy), self.relations_of(db), 'jsonl round trip changed the relations')
+
+    def test_csv(self):
+        for backend in (RamGraphDB, SQLiteGraphDB):
+            db, copy = self.round_trip(backend, 'csv')
+            self.assertIn(('0', 'knows', '0'), set(copy.list_relations()), 'csv should read objects back as strings')
+            self.assertEqual(len(list(copy.list_relations())), len(self.relations), 'wrong number of relations after a csv round trip')
+
+    def test_binary_writes_objects_once(self):
+        db = RamGraphDB()
+        db.store_relations(('hub-with-a-long-name', 'has-a-long-relation-name', i) for i in range(1000))
+        dump_edges(db, join(self.dir, 'edges.bin'))
+        dump_edges(db, join(self.dir, 'edges.csv'))
+        self.assertLess(getsize(join(self.dir, 'edges.bin')) * 4, getsize(join(self.dir, 'edges.csv')), 'repeated objects were written more than once')
+
+    def test_large_binary(self):
+        # objects bigger than the read buffer have to span reads
+        db = RamGraphDB()
+        db.store_relations((i, 'holds', 'x' * 2**21 + str(i)) for i in range(2))
+        db.store_relations((i, 'next', i+1) for i in range(10000))
+        path = join(self.dir, 'edges.bin')
+        dump_edges(db, path)
+        copy = RamGraphDB()
+        load_edges(copy, path)
+        self.assertEqual(self.relations_of(copy), self.relations_of(db), 'wrong relations loaded from a large file')
+
+    def test_truncated_binary(self):
+        db = RamGraphDB()
+        db.store_relations(self.relations)
+        path = join(self.dir, 'edges.bin')
+        dump_edges(db, path)
+        with open(path, 'r+b') as f:
+            f.truncate(getsize(path) - 1)
+        with self.assertRaises(ValueError):
+            load_edges(RamGraphDB(), path)
+
+    def test_batches_are_transactions(self):
+        db = SQLiteGraphDB()
+        path = join(self.dir, 'edges.jsonl')
+        with open(path, 'w') as f:
+            f.write('[1, "knows", 2]\n[3, "knows", 4]\nnot json\n')
+        with self.assertRaises(ValueError):
+            load_edges(db, path, batch_size=2)
+        self.assertEqual(sorted(db.list_relations()), [(1, 'knows', 2), (3, 'knows', 4)], 'finished batches should stay stored')
+
+    def test_command_line(self):
+        path, edges, copy = join(self.dir, 'graph.db'), join(self.dir, 'edges.bin'), join(self.dir, 'copy.jsonl')
+        db = RamGraphDB()
+        db.store_relations(self.relations)
+        dump_edges(db, edges)
+        env = dict(os.environ, PYTHONPATH=os.path.dirname(os.path.dirname(os.path.dirname(os.path.abspath(__file__)))))
+        for args in (('import', path, edges), ('export', path, copy)):
+            subprocess.run((sys.executable, '-m', 'graphdb') + args, check=True, stdout=subprocess.PIPE, env=env)
+        loaded = RamGraphDB()
+        load_edges(loaded, copy)
+        self.assertEqual(self.relations_of(loaded), self.relations_of(db), 'wrong relations after importing and exporting')
@@ -0,0 +1,114 @@
+from unittest import TestCase
+
+from graphdb import RamGraphDB
+from graphdb.RamGraphDB import NodeCollection, RamGraphDBNode, empty_relations
+
+class TestRamGraphDBMemory(TestCase):
+    ''' makes sure nodes only hold adjacency while they have links and that memory_usage adds up '''
+
+    def setUp(self):
+        self.db = RamGraphDB()
+
+    def tearDown(self):
+        self.db._destroy()
+
+    def test_unlinked_nodes_share_empty_relations(self):
+        self.db.store_items(range(4))
+        for node in self.db.iter_nodes():
+            self.assertIs(node.outgoing, empty_relations, 'unlinked node allocated outgoing relations')
+            self.assertIs(node.incoming, empty_relations, 'unlinked node allocated incoming relations')
+        self.db.store_relation(0, 'knows', 1)
+        self.assertIs(self.db._get_item_node(0).incoming, empty_relations, 'linking allocated the wrong direction')
+        self.assertIs(self.db._get_item_node(1).outgoing, empty_relations, 'linking allocated the wrong direction')
+        self.assertEqual(len(empty_relations), 0, 'the shared empty relations were written to')
+
+    def test_collections_grow_and_shrink(self):
+        self.db.store_relation(0, 'knows', 1)
+        self.assertNotIsInstance(self.db._get_item_node(0).outgoing['knows'], NodeCollection, 'single link allocated a NodeCollection')
+        self.db.store_relation(0, 'knows', 2)
+        self.assertIsInstance(self.db._get_item_node(0).outgoing['knows'], NodeCollection, 'second link did not grow into a NodeCollection')
+        self.assertEqual(self.db.store_relations([(0, 'knows', 1), (0, 'knows', 2)]), 0, 'duplicate links were stored')
+        self.assertEqual({i.obj for i in self.db.find(0, 'knows')}, {1, 2}, 'wrong links after growing')
+        self.db.delete_relation(0, 'knows', 1)
+        self.assertEqual(list(self.db.relations_of(0, True)), [('knows', 2)], 'wrong links after shrinking')
+        self.db.delete_relation(0, 'knows', 2)
+        for i in range(3):
+            node = self.db._get_item_node(i)
+            self.assertIs(node.outgoing, empty_relations, 'node kept outgoing relations after its last link was deleted')
+            self.assertIs(node.incoming, empty_relations, 'node kept incoming relations after its last link was deleted')
+        self.assertEqual(list(self.db.find(0, 'knows')), [], 'deleted links still found')
+
+    def test_memory_usage(self):
+        empty = self.db.memory_usage()
+        self.assertEqual((empty['nodes'], empty['edges'], empty['relations']), (0, 0, {}), 'empty database reports a graph')
+        self.db.store_relations((i, 'knows', i+1) for i in range(100))
+        self.db.store_relations((0, 'likes', i) for i in range(10))
+        usage = self.db.memory_usage()
+        self.assertEqual(usage['nodes'], 101, 'wrong node count')
+        self.assertEqual(usage['edges'], 110, 'wrong edge count')
+        self.assertEqual(set(usage['relations']), {'knows', 'likes'}, 'wrong relation names')
+        self.assertEqual(usage['edge_bytes'], sum(usage['relations'].values()), 'relation bytes do not add up to the edge bytes')
+        self.assertEqual(usage['total'], usage['node_bytes'] + usage['edge_bytes'], 'total does not add up')
+        self.assertAlmostEqual(usage['bytes_per_edge'], usage['edge_bytes'] / 110, msg='wrong bytes_per_edge')
+        self.assertGreater(usage['relations']['knows'], usage['relations']['likes'], 'more links were counted as smaller')
+        for i in range(101):
+            self.db.delete_item(i)
+        self.assertEqual(self.db.memory_usage()['edges'], 0, 'deleted edges are still counted')
+
+class TestNodeCollection(TestCase):
+    ''' makes sure NodeCollection keeps behaving like the list of nodes it replaced '''
+
+    def setUp(self):
+        self.nodes = [RamGraphDBNode(i) for i in range(4)]
+
+    def test_append_deduplicates(self):
+        links = NodeCollection()
+        for node in self.nodes + self.nodes:
+            links.append(node)
+        self.assertEqual(list(links), self.nodes, 'append stored a node twice')
+        with self.assertRaises(AssertionError):
+            links.append(0)
+
+    def test_remove(self):
+        links = NodeCollection(self.nodes)
+        links.remove(self.nodes[1])
+        self.assertEqual(list(links), [self.nodes[0], self.nodes[2], self.nodes[3]], 'wrong nodes after remove')
+        with self.assertRaises(KeyError):
+            links.remove(self.nodes[1])
+
+    def test_membership(self):
+        mutable = [0]
+        links = NodeCollection(self.nodes + [RamGraphDBNode(mutable)])
+        self.assertIn(self.nodes[0], links, 'appended node not found')
+        # nodes of hashable objects match by type and equality
+        self.assertIn(RamGraphDBNode(0), links, 'a node for an equal object was not found')
+        self.assertNotIn(RamGraphDBNode(0.0), links, 'a node for an object of another type was found')
+        # nodes of unhashable objects match by identity
+        self.assertIn(RamGraphDBNode(mutable), links, 'a node for the same object was not found')
+        self.assertNotIn(RamGraphDBNode([0]), links, 'a node for an equal mutable object was found')
+
+    def test_order_after_readding(self):
+        links = NodeCollection(self.nodes)
+        links.remove(self.nodes[0])
+        links.append(self.nodes[0])
+        self.assertEqual(list(links), self.nodes[1:] + self.nodes[:1], 're-added node did not move to the end')
+
+    def test_iadd_returns_self(self):
+        links = NodeCollection(self.nodes[:1])
+        same = links
+        links += self.nodes[1:3]
+        links += self.nodes[3]
+        self.assertIs(links, same, '+= made a new collection')
+        self.assertEqual(list(links), self.nodes, 'wrong nodes after +=')
+
+    def test_pop(self):
+        links = NodeCollection(self.nodes)
+        self.assertIs(links.pop(), self.nodes[3], 'pop did not return the newest node')
+        self.assertIs(links.pop(0), self.nodes[0], 'pop ignored its index')
+        self.assertIs(links.pop(-2), self.nodes[1], 'pop ignored its index')
+        self.assertEqual(list(links), [self.nodes[2]], 'wrong nodes after pop')
+        with self.assertRaises(IndexError):
+            links.pop(3)
+        links.pop()
+        with self.assertRaises(IndexError):
+            links.pop()
@@ -0,0 +1,128 @@
+from unittest import TestCase
+from tempfile import mkdtemp
+from shutil import rmtree
+from os import listdir
+from os.path import join, getsize
+from time import sleep
+
+from graphdb import RamGraphDB
+
+class TestRamGraphDBPersistence(TestCase):
+    def setUp(self):
+        self.dir = mkdtemp()
+        self.path = join(self.dir, 'graph')
+
+    def tearDown(self):
+        rmtree(self.dir)
+
+    def reopen(self, db, **kwargs):
+        db.close()
+        return RamGraphDB(path=self.path, **kwargs)
+
+    def relations(self, db):
+        return sorted(map(repr, db.list_relations()))
+
+    def test_log_replay(self):
+        db = RamGraphDB(path=self.path)
+        db.store_relations((i, 'less_than', i+1) for i in range(16))
+        db.store_relation('list', 'holds', [1, 2])
+        db.store_item('lonely')
+        db.delete_relation(3, 'less_than', 4)
+        db.delete_item(8)
+        db.replace_item(10, 'ten')
+        db(20).even = True
+        expected = self.relations(db)
+        db = self.reopen(db)
+        self.assertEqual(self.relations(db), expected, 'wrong relations after replaying the log')
+        self.assertIn('lonely', db, 'stored item lost after replaying the log')
+        self.assertNotIn(8, db, 'deleted item found after replaying the log')
+        db.close()
+
+    def test_objects_keyed_by_identity(self):
+        db = RamGraphDB(path=self.path, snapshot_every=None)
+        held = [1, 2]
+        db.store_relation(held, 'x', 1)
+        db.store_relation(held, 'x', 2)
+        db.store_relation('a', 'has', held)
+        db.store_relation('b', 'has', [1, 2]) # equal but its own node
+        db.delete_relation(held, 'x', 1)
+        self.assertEqual(db.count_objects(), 6)
+        expected = self.relations(db)
+        db = self.reopen(db, snapshot_every=None)
+        self.assertEqual(db.count_objects(), 6, 'replaying made new nodes for an object keyed by identity')
+        self.assertEqual(self.relations(db), expected, 'wrong relations after replaying objects keyed by identity')
+        held, = db.find('a', 'has')
+        held = held.obj
+        self.assertEqual(held, [1, 2])
+        db.snapshot()
+        db.store_relation(held, 'x', 3)
+        db = self.reopen(db)
+        self.assertEqual(db.count_objects(), 7, 'replaying after a snapshot made new nodes for an object keyed by identity')
+        held, = db.find('a', 'has')
+        self.assertEqual(sorted(i.obj for i in db.find(held.obj, 'x')), [2, 3], 'a log after a snapshot lost an object keyed by identity')
+        db.delete_item(held.obj)
+        db = self.reopen(db)
+        self.assertEqual(db.count_objects(), 6, 'deleting an object keyed by identity was not replayed')
+        self.assertEqual(self.relations(db), sorted(map(repr, [('b', 'has', [1, 2])])), 'wrong relations after replaying a delete')
+        db.close()
+
+    def test_fsync_timer(self):
+        db = RamGraphDB(path=self.path, fsync=0.05)
+        persistence = db._persistence
+        persistence._fsync() # the next write is inside the interval
+        synced = persistence._synced
+        db.store_relation(1, 'less_than', 2)
+        self.assertEqual(persistence._synced, synced, 'a write inside the interval was fsynced right away')
+        sleep(0.5)
+        self.assertGreater(persistence._synced, synced, 'a write was left unsynced past the interval')
+        self.assertIsNone(persistence._timer, 'the timer was not cleared after it ran')
+        db.close()
+
+    def test_merge(self):
+        db = RamGraphDB(path=self.path)
+        db.store_relations((i, 'less_than', i+1) for i in range(8))
+        other = RamGraphDB()
+        other.store_relations((i, 'less_than', i+1) for i in range(4, 12))
+        other.store_item('lonely')
+        db += other
+        expected = self.relations(db)
+        db = self.reopen(db)
+        self.assertEqual(self.relations(db), expected, 'wrong relations after replaying a merge')
+        self.assertIn('lonely', db, 'merged item lost after replaying the log')
+        db.close()
+
+    def test_snapshots(self):
+        db = RamGraphDB(path=self.path, snapshot_every=10)
+        db.store_relations((i, 'less_than', i+1) for i in range(25))
+        for i in range(5):
+            db.store_relation(i, 'even', not i%2)
+        self.assertEqual(sorted(listdir(self.path)), ['log-1.bin', 'snapshot-1.bin'], 'old snapshots and logs were not removed')
+        self.assertGreater(getsize(join(self.path, 'log-1.bin')), 0, 'writes after the snapshot were not logged')
+        expected = self.relations(db)
+        db = self.reopen(db, snapshot_every=None)
+        self.assertEqual(self.relations(db), expected, 'wrong relations after loading a snapshot and log tail')
+        db.snapshot()
+        db = self.reopen(db)
+        self.assertEqual(self.relations(db), expected, 'wrong relations after loading a compacted snapshot')
+        db.close()
+
+    def test_torn_log(self):
+        db = RamGraphDB(path=self.path, fsync=0)
+        db.store_relations((i, 'less_than', i+1) for i in range(4))
+        db.close()
+        log = join(self.path, 'log-0.bin')
+        with open(log, 'ab') as f:
+            f.write(b'\x00\x00\x00\x40partial')
+        db = RamGraphDB(path=self.path)
+        self.assertEqual(len(list(db.list_relations())), 4, 'wrong relation count after a torn write')
+        db.store_relation(4, 'less_than', 5)
+        db = self.reopen(db)
+        self.assertEqual(len(list(db.list_relations())), 5, 'writes after a torn record were lost')
+        self.assertEqual(db.count_relations('less_than'), 5, 'relation counts were not rebuilt when loading')
+        db.close()
+
+    def test_destroy(self):
+        db = RamGraphDB(path=self.path, fsync=None)
+        db.store_relation(1, 'less_than', 2)
+        db._destroy()
+        self.assertEqual(listdir(self.path), [], 'files left behind after destroying')
@@ -0,0 +1,638 @@
+from unittest import TestCase
+from tempfile import mkdtemp
+from shutil import rmtree
+from os.path import join
+from threading import Thread, get_ident
+import sqlite3
+from fractions import Fraction
+from decimal import Decimal
+
+from graphdb import SQLiteGraphDB
+from graphdb.serializers import serializers
+
+class TestSQLiteGraphDBMigration(TestCase):
+    ''' makes sure database files written by older versions of graphdb still open '''
+
+    def setUp(self):
+        self.dir = mkdtemp()
+        self.path = join(self.dir, 'graph.db')
+
+    def tearDown(self):
+        rmtree(self.dir)
+
+    def create_legacy_file(self, relations):
+        ''' writes relations with the original schema where objects were unique on code '''
+        serialize = serializers['base64-dill'].dumps
+        conn = sqlite3.connect(self.path)
+        conn.execute('CREATE TABLE objects (id integer primary key autoincrement, code text not null, unique(code) on conflict ignore);')
+        conn.execute('CREATE TABLE relations (src int not null, name text not null, dst int not null, unique(src, name, dst) on conflict ignore);')
+        for src, name, dst in relations:
+            for i in (src, dst):
+                conn.execute('INSERT into objects (code) values (?);', (serialize(i),))
+            conn.execute(
+                'insert into relations select ob1.id, ?, ob2.id from objects as ob1, objects as ob2 where ob1.code=? and ob2.code=?;',
+                (name, serialize(src), serialize(dst))
+            )
+        conn.commit()
+        conn.close()
+
+    def test_digest_migration(self):
+        self.create_legacy_file([(1, 'precedes', 2), (2, 'precedes', 3)])
+        db = SQLiteGraphDB(self.path)
+        self.assertEqual(next(db(1).precedes.precedes()), 3, 'wrong value after traversing a migrated file')
+        db.store_relation(3, 'precedes', 4)
+        self.assertEqual(len(list(db.list_objects())), 4, 'duplicate objects found after migrating')
+        self.assertEqual(
+            {i[0] for i in db._execute("select name from sqlite_master where type='index' and tbl_name='objects'")},
+            {'objects_digest', 'objects_dilled'},
+            'objects should only be indexed by digest and by being dilled after migrating'
+        )
+        self.assertLessEqual(
+            {'relations_dst', 'relations_name'},
+            {i[0] for i in db._execute("select name from sqlite_master where type='index' and tbl_name='relations'")},
+            'relation indexes missing after migrating'
+        )
+        db.close()
+        db = SQLiteGraphDB(self.path)
+        self.assertEqual(set(db.find(3, 'precedes')), {4}, 'relation lost after reopening a migrated file')
+        db.close()
+
+class TestSQLiteGraphDBTransactions(TestCase):
+    def setUp(self):
+        self.dir = mkdtemp()
+        self.path = join(self.dir, 'graph.db')
+        self.db = SQLiteGraphDB(self.path)
+
+    def tearDown(self):
+        self.db.close()
+        rmtree(self.dir)
+
+    def committed_relations(self):
+        ''' reads the relation count through a separate connection '''
+        conn = sqlite3.connect(self.path)
+        try:
+            return conn.execute('select count(*) from relations').fetchone()[0]
+        finally:
+            conn.close()
+
+    def test_commit_on_exit(self):
+        with self.db.transaction():
+            for i in range(8):
+                self.db.store_relation(i, 'less_than', i+1)
+            self.assertEqual(self.committed_relations(), 0, 'transaction committed before exiting')
+        self.assertEqual(self.committed_relations(), 8, 'transaction did not commit on exit')
+
+    def test_rollback(self):
+        self.db.store_relation(0, 'less_than', 1)
+        with self.assertRaises(KeyError):
+            with self.db.transaction():
+                self.db.store_relation(1, 'less_than', 2)
+                self.db.delete_item(0)
+                raise KeyError()
+        self.assertEqual(set(self.db.list_relations()), {(0, 'less_than', 1)}, 'transaction was not rolled back')
+        self.assertEqual(set(self.db), {0, 1}, 'transaction was not rolled back')
+
+    def test_savepoint_rollback(self):
+        with self.db.transaction():
+            self.db.store_relation(0, 'less_than', 1)
+            try:
+                with self.db.transaction():
+                    self.db.store_relation(1, 'less_than', 2)
+                    raise KeyError()
+            except KeyError:
+                pass
+            self.db.store_relation(2, 'less_than', 3)
+        self.assertEqual(
+            set(self.db.list_relations()),
+            {(0, 'less_than', 1), (2, 'less_than', 3)},
+            'nested transaction was not rolled back to its savepoint'
+        )
+
+    def test_rollback_without_autocommit(self):
+        db = SQLiteGraphDB(autocommit=False)
+        db.store_item(1)
+        with self.assertRaises(KeyError):
+            with db.transaction():
+                db.store_item(2)
+                raise KeyError()
+        self.assertIn(1, db, 'transaction rolled back writes made before it')
+        self.assertNotIn(2, db, 'transaction was not rolled back')
+        with db.transaction():
+            db.store_item(3)
+        db.conn.rollback()
+        self.assertEqual(set(db), {1, 3}, 'transaction did not commit on exit')
+        db._destroy()
+
+class TestSQLiteGraphDBConcurrency(TestCase):
+    def setUp(self):
+        self.dir = mkdtemp()
+        self.db = SQLiteGraphDB(join(self.dir, 'graph.db'), readers=2)
+
+    def tearDown(self):
+        self.db.close()
+        rmtree(self.dir)
+
+    def run_threads(self, *targets):
+        threads = [Thread(target=i) for i in targets]
+        for t in threads:
+            t.start()
+        for t in threads:
+            t.join()
+
+    def test_wal_mode(self):
+        self.assertEqual(self.db._execute('PRAGMA journal_mode;').fetchone()[0], 'wal', 'file databases should run in WAL mode')
+
+    def test_reader_pool_is_bounded(self):
+        self.db.store_relations((i, 'less_than', i+1) for i in range(64))
+        def read():
+            for i in range(64):
+                self.assertEqual(list(self.db.find(i, 'less_than')), [i+1], 'wrong value read from a reader thread')
+        self.run_threads(*[read]*16)
+        self.assertLessEqual(len(self.db._readers.connections), 2, 'reader connections leaked past the pool size')
+        self.assertEqual(self.db._readers._leases, {}, 'exited threads still hold reader connections')
+
+    def test_concurrent_reads_and_writes(self):
+        found = []
+        def write():
+            for i in range(128):
+                self.db.store_relation(i, 'less_than', i+1)
+        def read():
+            for i in range(128):
+                found.extend(self.db.find(i, 'less_than'))
+        self.run_threads(write, read, read, read)
+        self.assertTrue(set(found) <= set(range(1, 129)), 'readers found values that were never written')
+        self.assertEqual(len(list(self.db.list_relations())), 128, 'wrong relation count after concurrent writes')
+
+class TestSQLiteGraphDBQueryPlans(TestCase):
+    layout = 'single'
+
+    def setUp(self):
+        self.db = SQLiteGraphDB(layout=self.layout)
+        self.db.store_relations((i, 'less_than', i+1) for i in range(64))
+        self.db.store_relations((i, 'greater_than', i-1) for i in range(64))
+
+    def tearDown(self):
+        self.db._destroy()
+
+    def assertNoScans(self, method, *args):
+        for sql, plan in self.db.explain(method, *args):
+            # scanning constants or the output of subqueries is fine
+            scans = [i for i in plan if i.startswith('SCAN') and not i.startswith(('SCAN CONSTANT ROW', 'SCAN (subquery'))]
+            self.assertEqual(scans, [], 'full scan found in {}{} running: {}'.format(method.__name__, args, sql))
+
+    def test_lookups(self):
+        self.assertNoScans(self.db._id_of, 5)
+        self.assertNoScans(self.db.__contains__, 5)
+
+    def test_find(self):
+        self.assertNoScans(self.db.find, 5, 'less_than')
+
+    def test_relations_of(self):
+        self.assertNoScans(self.db.relations_of, 5)
+        self.assertNoScans(self.db.relations_of, 5, True)
+
+    def test_relations_to(self):
+        self.assertNoScans(self.db.relations_to, 5)
+        self.assertNoScans(self.db.relations_to, 5, True)
+
+    def test_writes(self):
+        self.assertNoScans(self.db.store_relation, 5, 'greater_than', 4)
+        self.assertNoScans(self.db.delete_relation, 5, 'less_than')
+        self.assertNoScans(self.db.delete_item, 7)
+
+    def test_single_layout_sql(self):
+        if self.layout != 'single':
+            return
+        (sql, plan), = self.db.explain('select src from relations where name=?', 'less_than')
+        self.assertEqual(plan, ['SEARCH relations USING COVERING INDEX relations_name (name=?)'], 'wrong plan for relations by name')
+
+class TestPartitionedSQLiteGraphDBQueryPlans(TestSQLiteGraphDBQueryPlans):
+    layout = 'partitioned'
+
+class TestSQLiteGraphDBLayouts(TestCase):
+    relations = {(i, 'less_than', i+1) for i in range(32)} | {(i, 'even', not i%2) for i in range(32)}
+
+    def setUp(self):
+        self.dir = mkdtemp()
+        self.path = join(self.dir, 'graph.db')
+
+    def tearDown(self):
+        rmtree(self.dir)
+
+    def convert(self, a, b):
+        db = SQLiteGraphDB(self.path, layout=a)
+        db.store_relations(self.relations)
+        db.close()
+        db = SQLiteGraphDB(self.path, layout=b)
+        self.assertEqual(db.layout, b, 'layout was not converted')
+        self.assertEqual(set(db.list_relations()), self.relations, 'relations lost converting from {} to {}'.format(a, b))
+        self.assertEqual(list(db.find(4, 'less_than')), [5], 'wrong value found after converting from {} to {}'.format(a, b))
+        db.store_relation(4, 'less_than', 6)
+        db.close()
+        db = SQLiteGraphDB(self.path)
+        self.assertEqual(db.layout, b, 'layout not remembered after reopening')
+        self.assertEqual(set(db.find(4, 'less_than')), {5, 6}, 'wrong values found after reopening')
+        db.close()
+
+    def test_single_to_partitioned(self):
+        self.convert('single', 'partitioned')
+
+    def test_partitioned_to_single(self):
+        self.convert('partitioned', 'single')
+
+    def test_partitions_are_per_relation(self):
+        db = SQLiteGraphDB(self.path, layout='partitioned')
+        db.store_relations(self.relations)
+        self.assertEqual(
+            {i[0] for i in db._execute('select name from relation_tables')},
+            {'less_than', 'even'},
+            'wrong relation names in the partition registry'
+        )
+        self.assertEqual(
+            db._execute('select count(*) from {}'.format(db._partition_name('even'))).fetchone()[0],
+            32,
+            'wrong relation count in the partition for even'
+        )
+        db.close()
+
+    def test_unknown_relations(self):
+        for layout in ('single', 'partitioned'):
+            db = SQLiteGraphDB(layout=layout)
+            db.store_relations(self.relations)
+            db.delete_relation(1, 'nope', 2)
+            db.delete_relation(1, 'nope')
+            db.delete_relation('missing', 'nope', 'also missing')
+            self.assertEqual(list(db.find(1, 'nope')), [], 'found an unknown relation in the {} layout'.format(layout))
+            self.assertEqual(set(db.list_relations()), self.relations, 'deleting an unknown relation changed the {} layout'.format(layout))
+            db.close()
+
+    def test_uncommitted_partitions(self):
+        db = SQLiteGraphDB(self.path, layout='partitioned')
+        with db.transaction():
+            db.store_relation(1, 'odd', True)
+            found = []
+            reader = Thread(target=lambda:found.extend(db.find(1, 'odd')))
+            reader.start()
+            reader.join()
+            self.assertEqual(found, [], 'reader saw an uncommitted partition')
+        self.assertEqual(list(db.find(1, 'odd')), [True], 'committed partition not found')
+        try:
+            with db.transaction():
+                db.store_relation(1, 'prime', False)
+                raise KeyError()
+        except KeyError:
+            pass
+        db.store_relation(2, 'prime', True)
+        self.assertEqual(set(db.list_relations()), {(1, 'odd', True), (2, 'prime', True)}, 'wrong relations after a rolled back partition')
+        db.close()
+
+class TestSQLiteGraphDBObjectCache(TestCase):
+    def setUp(self):
+        self.dir = mkdtemp()
+        self.db = SQLiteGraphDB(join(self.dir, 'graph.db'), cache_size=8)
+
+    def tearDown(self):
+        self.db.close()
+        rmtree(self.dir)
+
+    def test_hub_hits(self):
+        for i in range(4):
+            self.db.store_relation('hub', 'connected_to', i)
+        hits = self.db.cache_info().hits
+        self.db.store_relation('hub', 'connected_to', 0)
+        self.assertGreater(self.db.cache_info().hits, hits, 'hub was not found in the cache')
+        self.assertEqual(set(self.db.find('hub', 'connected_to')), {0, 1, 2, 3}, 'wrong relations stored through the cache')
+
+    def test_eviction(self):
+        self.db.store_items(range(64))
+        self.assertEqual(self.db.cache_info().currsize, 8, 'cache grew past its size')
+
+    def test_delete_invalidates(self):
+        self.db.store_relation(1, 'less_than', 2)
+        self.db.delete_item(2)
+        self.assertNotIn(2, self.db, 'deleted item still found through the cache')
+        self.db.store_relation(1, 'less_than', 2)
+        self.assertEqual(list(self.db.find(1, 'less_than')), [2], 'deleted item was not stored again')
+
+    def test_replace_invalidates(self):
+        self.db.store_relation(1, 'less_than', 2)
+        self.db.replace_item(2, 'two')
+        self.assertNotIn(2, self.db, 'replaced item still found through the cache')
+        self.assertIn('two', self.db, 'replacement not found')
+        self.assertEqual(list(self.db.find(1, 'less_than')), ['two'], 'wrong value after replacing')
+
+    def test_other_connections_invalidate(self):
+        other = SQLiteGraphDB(join(self.dir, 'graph.db'))
+        try:
+            self.db.store_item('x')
+            self.assertIn('x', self.db)
+            other.delete_item('x')
+            self.assertNotIn('x', self.db, 'an item deleted by another connection was still found through the cache')
+            self.db.store_relation('x', 'r', 'y')
+            self.assertEqual(list(self.db.find('x', 'r')), ['y'], 'a relation was stored to a row deleted by another connection')
+            self.assertEqual(list(self.db.list_relations()), [('x', 'r', 'y')], 'wrong relations after another connection deleted')
+            self.assertEqual(self.db.count_relations(), 1, 'wrong relation count after another connection deleted')
+            other.replace_item('y', 'z')
+            self.assertEqual(list(other.find('x', 'r')), ['z'])
+            self.assertNotIn('y', self.db, 'an item replaced by another connection was still found through the cache')
+            self.assertEqual(list(self.db.find('x', 'r')), ['z'], 'wrong value after another connection replaced it')
+        finally:
+            other.close()
+
+    def test_replace_in_transaction(self):
+        self.db.store_item(1)
+        with self.db.transaction():
+            self.db.replace_item(1, 'a')
+            self.assertIn('a', self.db, 'replacement not found inside the transaction')
+            self.db.store_relation('a', 'r', 'b')
+        self.assertNotIn(1, self.db, 'replaced item still found through the cache')
+        self.assertEqual(list(self.db.find('a', 'r')), ['b'], 'wrong relations after replacing inside a transaction')
+
+    def test_rollback_invalidates(self):
+        try:
+            with self.db.transaction():
+                self.db.store_item(5)
+                raise KeyError()
+        except KeyError:
+            pass
+        self.assertNotIn(5, self.db, 'rolled back item still found through the cache')
+        self.db.store_item(5)
+        self.assertIn(5, self.db, 'item not stored after a rollback')
+
+    def test_uncommitted_deletes(self):
+        self.db.store_item(5)
+        self.assertIn(5, self.db)
+        found = []
+        with self.db.transaction():
+            self.db.delete_item(5)
+            reader = Thread(target=lambda:found.append(5 in self.db))
+            reader.start()
+            reader.join()
+        self.assertEqual(found, [True], 'reader saw an uncommitted delete')
+        self.assertNotIn(5, self.db, 'committed delete still found through the cache')
+
+    def test_mutable_objects_are_not_cached(self):
+        target = [1, 2]
+        self.db.store_item(target)
+        target.append(3)
+        self.assertNotIn(target, self.db, 'mutated object matched what it used to be')
+        self.assertEqual(self.db.cache_info().currsize, 0, 'mutable object was cached')
+
+    def test_disabled(self):
+        db = SQLiteGraphDB(cache_size=0)
+        db.store_relation(1, 'less_than', 2)
+        db.store_relation(1, 'less_than', 2)
+        self.assertEqual(db.cache_info().hits, 0, 'disabled cache had hits')
+        self.assertEqual(list(db.find(1, 'less_than')), [2], 'wrong value without a cache')
+        db._destroy()
+
+class TestSQLiteGraphDBSerializers(TestCase):
+    targets = [
+        None, True, False, 0, 1, -1, 127, 128, -128, -129, 2**70, -2**70,
+        0.0, -0.0, 74.98462, float('inf'), '', 'hello', '\ud800', b'', b'\x00hi',
+        (), (1,), (1, 'two', (3.0, None), b'four'), ([9, 10],), [9, 10], {1, 7}
+    ]
+
+    def setUp(self):
+        self.dir = mkdtemp()
+        self.path = join(self.dir, 'graph.db')
+
+    def tearDown(self):
+        rmtree(self.dir)
+
+    def test_round_trips(self):
+        for name, serializer in serializers.items():
+            for i in self.targets:
+                code = serializer.dumps(i)
+                self.assertIsInstance(code, bytes, '{} needs to serialize to bytes'.format(name))
+                self.assertEqual(code, serializer.dumps(i), '{} is not deterministic for {!r}'.format(name, i))
+                out = serializer.loads(code)
+                self.assertEqual((type(out), out), (type(i), i), '{} lost data for {!r}'.format(name, i))
+        self.assertEqual(str(serializers['tagged'].loads(serializers['tagged'].dumps(-0.0))), '-0.0', 'sign of -0.0 lost')
+
+    def test_types_stay_apart(self):
+        codes = {serializers['tagged'].dumps(i) for i in (1, True, 1.0, '1', b'1', (1,))}
+        self.assertEqual(len(codes), 6, 'objects of different types serialized the same')
+
+    def test_blob_storage(self):
+        db = SQLiteGraphDB(self.path)
+        self.assertEqual(db.serializer, 'tagged', 'new files should use the tagged serializer')
+        db.store_item('hello')
+        self.assertEqual(db._execute('select typeof(code), code from objects').fetchone(), ('blob', b'shello'), 'objects should be stored as raw blobs')
+        db.close()
+
+    def test_legacy_files(self):
+        db = SQLiteGraphDB(self.path, serializer='base64-dill')
+        db.store_relations((i, 'less_than', i+1) for i in range(16))
+        db._execute('DELETE from graphdb_meta;')
+        db.commit()
+        db.close()
+        db = SQLiteGraphDB(self.path)
+        self.assertEqual(db.serializer, 'base64-dill', 'files without a marker should be read as base64 dill')
+        self.assertEqual(list(db.find(4, 'less_than')), [5], 'wrong value read from a legacy file')
+        db.close()
+
+    def test_conversion(self):
+        db = SQLiteGraphDB(self.path, serializer='base64-dill')
+        db.store_relations((i, 'less_than', i+1) for i in range(16))
+        db.close()
+        db = SQLiteGraphDB(self.path, serializer='tagged')
+        self.assertEqual(db.serializer, 'tagged', 'serializer was not converted')
+        self.assertEqual(list(db.find(4, 'less_than')), [5], 'wrong value found after converting')
+        db.store_relation(4, 'less_than', 5)
+        self.assertEqual(len(list(db.list_objects())), 17, 'duplicate objects found after converting')
+        db.close()
+        db = SQLiteGraphDB(self.path)
+        self.assertEqual(db.serializer, 'tagged', 'serializer not remembered after reopening')
+        db.close()
+
+class TestSQLiteGraphDBTraversals(TestCase):
+    layout = 'single'
+
+    def setUp(self):
+        self.db = SQLiteGraphDB(layout=self.layout)
+        self.db.store_relations((i, 'less_than', i+1) for i in range(64))
+        self.db.store_relations((i, 'even', not i%2) for i in range(64))
+        self.db.store_relations((i, 'half', i/2) for i in range(64))
+
+    def tearDown(self):
+        self.db._destroy()
+
+    def test_single_query(self):
+        statements = self.db.explain(lambda:self.db(10).less_than.less_than.less_than())
+        self.assertEqual(len(statements), 2, 'traversal should be one id lookup and one query')
+        for sql, plan in statements:
+            scans = [i for i in plan if i.startswith('SCAN') and not i.startswith(('SCAN CONSTANT ROW', 'SCAN (subquery', 'SCAN start'))]
+            self.assertEqual(scans, [], 'full scan found in traversal: {}'.format(sql))
+
+    def test_lazy(self):
+        statements = self.db.explain(lambda:(self.db(10).less_than.less_than.even,))
+        self.assertEqual(statements, [], 'traversal ran before it was needed')
+
+    def test_matches_find(self):
+        db = self.db
+        db.store_relations((i, 'knows', (i+j)%8) for i in range(8) for j in (1, 2))
+        expected = [0]
+        for _ in range(4):
+            expected = [i for v in expected for i in db.find(v, 'knows')]
+        self.assertEqual(sorted(db(0).knows.knows.knows.knows()), sorted(expected), 'traversal should keep every path like find does')
+        self.assertEqual(len(db(0).knows.knows), 4, 'wrong length of a traversed VList')
+
+    def test_long_chains(self):
+        self.db.store_relations((i, 'next', (i+1)%3) for i in range(3))
+        chain = self.db(0)
+        for _ in range(100):
+            chain = chain.next
+        self.assertEqual(list(chain()), [1], 'wrong value after a chain longer than the join limit')
+
+    def test_where_pushdown(self):
+        db = self.db
+        self.assertEqual(set(db(10).less_than.less_than.where(even=True)()), {12}, 'wrong values after where')
+        self.assertEqual(set(db(10).less_than.where(even=1)()), set(), 'wrong values after where')
+        self.assertEqual(set(db(11).less_than.where(half=6)()), {12}, 'where should match equal numbers of other types')
+        self.assertEqual(set(db(11).less_than.where(half='6')()), set(), 'where matched something that was not equal')
+        self.assertEqual(set(db(11).less_than.where(missing=True)()), set(), 'where matched a missing relation')
+        sql, plan = self.db.explain(lambda:db(10).less_than.where(even=True)())[-1]
+        self.assertIn('exists', sql, 'where was not pushed into the traversal query')
+
+    def test_where_fallback(self):
+        self.db.store_relation(1, 'tags', ('a', [1]))
+        self.assertEqual(list(self.db(0).less_than.where(tags=('a', [1]))()), [1], 'where should fall back for unknown types')
+
+    def test_where_other_types(self):
+        db = self.db
+        db.store_relations([(13, 'half', Fraction(6)), (14, 'half', 6+0j), (15, 'half', Decimal(6))])
+        for value in (6, 6.0, 0.5, True, 'six'):
+            self.assertEqual(
+                set(db(11).less_than.less_than.less_than.less_than.where(half=value)()),
+                set(db(11).less_than.less_than.less_than.less_than.where('half', lambda i:i==value)()),
+                'where by value and by function disagree on {!r}'.format(value)
+            )
+        self.assertEqual(set(db(11).less_than.less_than.less_than.where(half=6)()), {14}, 'where missed objects of other types equal to the value')
+        self.assertEqual(db(11).less_than.less_than.less_than.where(half=6).count(), 1, 'wrong count after where')
+        sql, plan = db.explain(lambda:db(10).less_than.where(even=True)())[-1]
+        self.assertIn('exists', sql, 'where was not pushed into the traversal query for builtin types')
+        sql, plan = db.explain(lambda:db(10).less_than.where(half=6)())[-1]
+        self.assertNotIn('exists', sql, 'where was pushed into sql with objects of other types stored')
+
+class TestPartitionedSQLiteGraphDBTraversals(TestSQLiteGraphDBTraversals):
+    layout = 'partitioned'
+
+class TestSQLiteGraphDBScans(TestCase):
+    layout = 'single'
+
+    def setUp(self):
+        self.db = SQLiteGraphDB(layout=self.layout)
+        self.db.store_relations(('hub', 'has', i) for i in range(64))
+        self.db.store_relations((i, 'next', i+1) for i in range(64))
+        self.expected = sorted(map(repr, [('hub', 'has', i) for i in range(64)] + [(i, 'next', i+1) for i in range(64)]))
+
+    def tearDown(self):
+        self.db._destroy()
+
+    def test_single_query(self):
+        statements = self.db.explain(lambda:list(self.db.list_relations()))
+        self.assertEqual(len(statements), 1, 'list_relations should be one query')
+        self.assertEqual(sorted(map(repr, self.db.list_relations())), self.expected, 'wrong relations listed')
+
+    def test_deserializes_once(self):
+        loads = []
+        deserialize = self.db.deserialize
+        self.db.deserialize = lambda code: loads.append(code) or deserialize(code)
+        self.assertEqual(sorted(map(repr, self.db.list_relations())), self.expected, 'wrong relations listed')
+        self.assertEqual(len(loads), 66, 'objects were deserialized more than once')
+        del loads[:]
+        self.assertEqual(sorted(map(repr, self.db.list_relations(cache_size=1))), self.expected, 'wrong relations listed with a small cache')
+        self.assertLess(len(loads), 256, 'nothing was reused with a small cache')
+
+    def test_mutable_objects_are_not_shared(self):
+        self.db.store_relation(['a'], 'has', 1)
+        self.db.store_relation(['a'], 'has', 2)
+        found = [src for src, name, dst in self.db.list_relations() if src == ['a']]
+        self.assertEqual(len(found), 2, 'wrong relations listed')
+        self.assertIsNot(found[0], found[1], 'mutable objects were shared between relations')
+
+    def test_parallel(self):
+        # enough relations for several chunks
+        self.db.store_relations((i, 'tagged', ('tag', i%7)) for i in range(3000))
+        expected = list(self.db.list_relations())
+        self.assertEqual(list(self.db.list_relations(parallel=2)), expected, 'parallel scan changed the relations or their order')
+        self.assertEqual(
+            sorted(map(repr, self.db.list_relations(parallel=2, ordered=False))),
+            sorted(map(repr, expected)),
+            'unordered parallel scan changed the relations'
+        )
+        self.assertEqual(list(self.db.list_objects(parallel=2)), list(self.db.list_objects()), 'parallel scan changed the objects')
+        scan = self.db.list_relations(parallel=2)
+        self.assertEqual(next(scan), expected[0], 'wrong first relation from a parallel scan')
+        scan.close()
+
+class TestPartitionedSQLiteGraphDBScans(TestSQLiteGraphDBScans):
+    layout = 'partitioned'
+
+class TestSQLiteGraphDBMerge(TestCase):
+    ''' makes sure merging files attaches them and copies everything over '''
+
+    def setUp(self):
+        self.dir = mkdtemp()
+
+    def tearDown(self):
+        rmtree(self.dir)
+
+    def open(self, name, **kwargs):
+        return SQLiteGraphDB(join(self.dir, name), **kwargs)
+
+    def relations(self, db):
+        return sorted(map(repr, db.list_relations()))
+
+    def merge(self, db, other):
+        ''' merges other into db and returns the statements that ran. explain
+            cant be used since the attached file is gone once it returns. '''
+        db._traces[get_ident()] = statements = []
+        try:
+            db += other
+        finally:
+            del db._traces[get_ident()]
+        return [i[0] for i in statements]
+
+    def test_layouts(self):
+        for a in ('single', 'partitioned'):
+            for b in ('single', 'partitioned'):
+                db, other = self.open(a + b + '-a.db', layout=a), self.open(a + b + '-b.db', layout=b)
+                db.store_relations((i, 'next', i+1) for i in range(8))
+                other.store_relations((i, 'next', i+1) for i in range(4, 12))
+                other.store_relations((i, 'even', not i%2) for i in range(12))
+                other.store_item('lonely')
+                expected = sorted(set(self.relations(db)) | set(self.relations(other)))
+                statements = self.merge(db, other)
+                self.assertTrue(any(sql.startswith('ATTACH') for sql in statements), 'files should be merged by attaching them')
+                self.assertEqual(self.relations(db), expected, 'wrong relations after merging {} into {}'.format(b, a))
+                self.assertIn('lonely', db, 'merging dropped an object without relations')
+                self.assertEqual(sorted(db(3).next.next.even()), [False], 'wrong traversal after merging')
+                self.assertEqual(db.layout, a, 'merging changed the layout')
+                db._destroy()
+                other._destroy()
+
+    def test_cached_ids(self):
+        db, other = self.open('a.db'), self.open('b.db')
+        # other gives its objects different ids than db does
+        other.store_items(range(100, 0, -1))
+        db.store_relations((i, 'next', i+1) for i in range(8))
+        db += other
+        for i in range(9):
+            self.assertEqual(db._id_of(i), db._query_one('select id from objects where digest=? and code=?', db._lookup(i))[0], 'cached id is wrong after merging')
+        self.assertEqual(len(list(db)), 101, 'objects were duplicated by merging')
+        db.store_relation(1, 'next', 2)
+        self.assertEqual(list(db.find(1, 'next')), [2], 'merging duplicated a relation')
+
+    def test_fallback(self):
+        db = self.open('a.db')
+        db.store_relation(1, 'next', 2)
+        for other in (SQLiteGraphDB(), self.open('legacy.db', serializer='base64-dill')):
+            other.store_relation(2, 'next', 3)
+            other.store_item('lonely')
+            statements = self.merge(db, other)
+            self.assertFalse(any(sql.startswith('ATTACH') for sql in statements), 'merged by attaching a file that cant be attached')
+            self.assertEqual(sorted(db(1).next.next()), [3], 'wrong traversal after merging')
+            self.assertIn('lonely', db, 'merging dropped an object without relations')
+            other._destroy()
@@ -0,0 +1,75 @@
+from unittest import TestCase
+
+from graphdb import RamGraphDB, SQLiteGraphDB
+from graphdb.stats import statement_key
+
+class TestInstrumentation(TestCase):
+    ''' makes sure instrumentation records what runs and comes off cleanly '''
+
+    def backends(self):
+        for backend in (RamGraphDB, SQLiteGraphDB):
+            db = backend()
+            db.store_relations((i, 'next', i+1) for i in range(16))
+            yield db
+
+    def test_off_by_default(self):
+        for db in self.backends():
+            self.assertIsNone(db.stats(), 'stats were recorded without instrument()')
+            self.assertNotIn('store_item', db.__dict__, 'methods were wrapped without instrument()')
+
+    def test_operations(self):
+        for db in self.backends():
+            db.instrument()
+            db.replace_item(3, 'three')
+            with db.transaction():
+                db.store_relation(0, 'first', True)
+            relations = db.relations_of(0)
+            self.assertNotIn('relations_of', db.stats()['operations'], 'an iterator was recorded before it finished')
+            self.assertEqual(sorted(relations), ['first', 'next'], 'instrumenting changed what was found')
+            self.assertEqual(sorted(db(0).next.next()), [2], 'instrumenting changed a traversal')
+            operations = db.stats()['operations']
+            self.assertEqual(
+                {name: stats['count'] for name, stats in operations.items()},
+                {'replace_item': 1, 'store_relation': 1, 'relations_of': 1, 'traverse': 1},
+                'wrong operations recorded for {}'.format(type(db).__name__)
+            )
+            for stats in operations.values():
+                self.assertLessEqual(stats['p50'], stats['max'], 'p50 is slower than the slowest call')
+            self.assertGreater(db.stats()['lock_wait']['count'], 0, 'lock waits were not recorded')
+
+    def test_statements(self):
+        db = SQLiteGraphDB()
+        seen = []
+        db.instrument(slow_query_seconds=0, hook=lambda *recorded: seen.append(recorded))
+        with self.assertLogs('graphdb', 'WARNING'):
+            self.assertEqual(list(db.find(1, 'next')), [], 'instrumenting changed what was found')
+            db.store_relation(1, 'next', 2)
+        stats = db.stats()
+        self.assertGreater(stats['serialize']['count'], 0, 'serializing was not recorded')
+        self.assertGreater(stats['execute']['count'], 0, 'statements were not recorded')
+        self.assertEqual(stats['execute']['count'], sum(i['count'] for i in stats['statements'].values()), 'statements do not add up to execute')
+        self.assertEqual(len(stats['slow']), stats['execute']['count'], 'slow queries were not kept')
+        self.assertEqual({i[0] for i in seen}, {'operation', 'serialize', 'execute', 'lock_wait', 'slow'}, 'hook missed recordings')
+        db.instrument(slow_query_seconds=60)
+        list(db.find(1, 'next'))
+        self.assertEqual(db.stats()['slow'], [], 'fast statements were kept as slow queries')
+        self.assertEqual(db.stats()['deserialize']['count'], 1, 'instrument() did not start over')
+
+    def test_off_again(self):
+        for db in self.backends():
+            lock = db._write_lock
+            db.instrument()
+            db.instrument(False)
+            self.assertIsNone(db.stats(), 'stats were kept after instrument(False)')
+            self.assertIs(db._write_lock, lock, 'the write lock was not put back')
+            self.assertFalse(set(db.__dict__) & set(db.instrumented_operations + db.instrumented_statements), 'wrappers were left on')
+            db.store_relation(0, 'first', True)
+            self.assertEqual(set(db.relations_of(0)), {'first', 'next'}, 'the database broke after instrument(False)')
+
+    def test_statement_key(self):
+        self.assertEqual(
+            statement_key('select code from objects\n   where id in (1, 2,3) and x=-4.5 limit 1'),
+            'select code from objects where id in (?, ...) and x=? limit ?',
+            'numbers were not grouped'
+        )
+        self.assertEqual(statement_key('select src from graphdb_relations_12 where dst=?'), 'select src from graphdb_relations_12 where dst=?', 'a table name was changed')